@@ -16,10 +16,12 @@ from .browser_sync import (
     BrowserSync,
     TabSync,
 )
+from .scheduler import Scheduler
 
 __all__ = [
     "Browser",
     "BrowserSync",
+    "Scheduler",
     "Tab",
     "TabSync",
 ]
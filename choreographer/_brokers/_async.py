@@ -2,25 +2,47 @@ from __future__ import annotations
 
 import asyncio
 import warnings
-from functools import partial
 from typing import TYPE_CHECKING
 
 import logistro
 
 from choreographer import channels, protocol
+from choreographer.protocol._dispatch import SubscriptionIndex
+
+from ._callbacks import CallbackScheduler
+from ._lanes import Lanes
 
 # afrom choreographer.channels import ChannelClosedError
 
 if TYPE_CHECKING:
-    from typing import Any, MutableMapping
+    from typing import Any, Awaitable, MutableMapping, Optional, Sequence, Tuple
 
     from choreographer.browser_async import Browser
     from choreographer.channels._interface_type import ChannelInterface
+    from choreographer.protocol._batches import EventBatcher
+    from choreographer.protocol._streams import EventStream
     from choreographer.protocol.devtools_async import Session, Target
 
+    from ._limiter import Limiter
+
+    # a command waiting to be written, and its future if it's not a notification
+    _Queued = Tuple[protocol.BrowserCommand, Optional[asyncio.Future[Any]]]
+
 
 _logger = logistro.getLogger(__name__)
 
+_MAX_FUTURES = 2**16
+"""Past this many unanswered commands, the oldest is abandoned."""
+_MAX_TOMBSTONES = 2**12
+"""
+How many abandoned commands to remember, to drop their late responses quietly.
+Older ones' responses are dropped too, with a warning.
+"""
+_BATCH_MAX = 64
+"""The most commands the writer writes at once."""
+_LATENCY_WEIGHT = 0.2
+"""How much the latest command counts in the `Broker.latency` moving average."""
+
 
 class UnhandledMessageWarning(UserWarning):
     pass
@@ -38,16 +60,22 @@ class Broker:
     """
     futures: MutableMapping[protocol.MessageKey, asyncio.Future[Any]]
     """A mapping of all the futures for all sent commands."""
+    timeout: float | None = None
+    """How long commands wait for a response by default, in seconds, None is ever."""
+    limiter: Limiter | None = None
+    """If set, it admits commands, capping how many are in flight."""
+    latency: float | None = None
+    """A moving average of how long commands take to be answered, in seconds."""
 
     _subscriptions_futures: MutableMapping[
         str,
-        MutableMapping[
-            str,
-            list[asyncio.Future[Any]],
-        ],
+        SubscriptionIndex[list[asyncio.Future[Any]]],
     ]
     """A mapping of session id: subscription: list[futures]"""
 
+    _routes: MutableMapping[str, tuple[Target, Session]]
+    """A mapping of session id: (target, session), for every session we know."""
+
     def __init__(self, browser: Browser, channel: ChannelInterface) -> None:
         """
         Construct a broker for a synchronous arragenment w/ both ends.
@@ -61,13 +89,23 @@ class Broker:
         self._channel = channel
         self._background_tasks: set[asyncio.Task[Any]] = set()
         # if its a task you dont want canceled at close (like the close task)
-        self._background_tasks_cancellable: set[asyncio.Task[Any]] = set()
-        # if its a user task, can cancel
+        self.callbacks = CallbackScheduler()
+        # runs the subscriptions' callbacks, those can be cancelled
         self._current_read_task: asyncio.Task[Any] | None = None
         self.futures = {}
         self._subscriptions_futures = {}
-
-        self._write_lock = asyncio.Lock()
+        self._routes = {}
+        # full event streams that want the reading to wait for them
+        self._blocked: list[EventStream] = []
+        # batch subscriptions to deliver when what was read is handled
+        self._pending_batches: list[EventBatcher] = []
+        # keys of abandoned commands, in order, to drop their late responses
+        self._tombstones: dict[protocol.MessageKey, None] = {}
+
+        # commands wait here for the writer task to send them
+        self._write_queue: Lanes[_Queued] = Lanes()
+        self._write_pending: asyncio.Event | None = None
+        self._writer_task: asyncio.Task[Any] | None = None
 
     def new_subscription_future(
         self,
@@ -78,7 +116,7 @@ class Broker:
             f"Session {session_id} is subscribing to {subscription} one time.",
         )
         if session_id not in self._subscriptions_futures:
-            self._subscriptions_futures[session_id] = {}
+            self._subscriptions_futures[session_id] = SubscriptionIndex()
         if subscription not in self._subscriptions_futures[session_id]:
             self._subscriptions_futures[session_id][subscription] = []
         future = asyncio.get_running_loop().create_future()
@@ -102,20 +140,23 @@ class Broker:
                     if not future.done():
                         _logger.debug2(f"Cancelling {future}")
                         future.cancel()
-        _logger.debug("Cancelling background tasks")
-        for task in self._background_tasks_cancellable:
-            if not task.done():
-                _logger.debug2(f"Cancelling {task}")
-                task.cancel()
-
-    def run_read_loop(self) -> None:  # noqa: C901, PLR0915 complexity
+        _logger.debug("Closing event streams")
+        for _, routed in list(self._routes.values()):
+            routed._close_streams()  # noqa: SLF001 the broker feeds them
+        _logger.debug("Cancelling writer")
+        if self._writer_task and not self._writer_task.done():
+            self._writer_task.cancel()
+        _logger.debug("Cancelling subscription callbacks")
+        self.callbacks.cancel()
+
+    def run_read_loop(self) -> None:
         def check_read_loop_error(result: asyncio.Future[Any]) -> None:
             e = result.exception()
             if e:
                 _logger.debug("Error in readloop. Will post a close() task.")
-                self._background_tasks.add(
-                    asyncio.create_task(self._browser.close()),
-                )
+                close_task = asyncio.create_task(self._browser.close())
+                self._background_tasks.add(close_task)
+                close_task.add_done_callback(self._background_tasks.discard)
                 if isinstance(e, channels.ChannelClosedError):
                     _logger.debug("PipeClosedError caught")
                     _logger.debug2("Full Error:", exc_info=e)
@@ -126,112 +167,232 @@ class Broker:
                     _logger.error("Error in run_read_loop.", exc_info=e)
                     raise e
 
-        async def read_loop() -> None:  # noqa: PLR0912, PLR0915, C901
-            loop = asyncio.get_running_loop()
-            fn = partial(self._channel.read_jsons, blocking=True)
-            responses = await loop.run_in_executor(
-                executor=None,
-                func=fn,
-            )
-            _logger.debug(f"Channel read found {len(responses)} json objects.")
-            for response in responses:
-                error = protocol.get_error_from_result(response)
-                key = protocol.calculate_message_key(response)
-                if not key and error:
-                    raise protocol.DevtoolsProtocolError(response)
-
-                # looks for event that we should handle internally
-                self._check_for_closed_session(response)
-                # surrounding lines overlap in idea
-                if protocol.is_event(response):
-                    event_session_id = response.get(
-                        "sessionId",
-                        "",
-                    )
-                    _logger.debug2(f"Is event for {event_session_id}")
-                    x = self._get_target_session_by_session_id(
-                        event_session_id,
-                    )
-                    if not x:
-                        continue
-                    _, event_session = x
-                    if not event_session:
-                        _logger.error("Found an event that returned no session.")
-                        continue
-                    _logger.debug(
-                        f"Received event {response['method']} for "
-                        f"{event_session_id} targeting {event_session}.",
-                    )
+        async def read_loop() -> None:
+            while True:
+                responses = await self._channel.read_jsons_async()
+                _logger.debug(f"Channel read found {len(responses)} json objects.")
+                for response in responses:
+                    self._handle_message(response)
+                    if self._blocked:  # a "block" event stream filled up
+                        self._flush_batches()
+                        while self._blocked:  # the rest waits for its room
+                            await self._blocked.pop().room()
+                self._flush_batches()
 
-                    session_futures = self._subscriptions_futures.get(
-                        event_session_id,
-                    )
-                    _logger.debug2(
-                        "Checking for event subscription future.",
-                    )
-                    if session_futures:
-                        for query in session_futures:
-                            match = (
-                                query.endswith("*")
-                                and response["method"].startswith(query[:-1])
-                            ) or (response["method"] == query)
-                            if match:
-                                _logger.debug2(
-                                    "Found event subscription future.",
-                                )
-                                for future in session_futures[query]:
-                                    if not future.done():
-                                        future.set_result(response)
-                                session_futures[query] = []
+        read_task = asyncio.create_task(read_loop())
+        read_task.add_done_callback(check_read_loop_error)
+        self._current_read_task = read_task
 
+    def _flush_batches(self) -> None:
+        pending = self._pending_batches
+        while pending:
+            pending.pop().flush()
+
+    def _handle_message(  # noqa: PLR0912, C901 branches, complexity
+        self,
+        response: protocol.BrowserResponse,
+    ) -> None:
+        if response.get("id", -1) >= protocol.NOTIFICATION_IDS:
+            # nobody waits for notifications' replies
+            if "error" in response:
+                _logger.debug(f"Notification failed: {response['error']}")
+            return
+        error = protocol.get_error_from_result(response)
+        key = protocol.calculate_message_key(response)
+        if not key and error:
+            raise protocol.DevtoolsProtocolError(response)
+
+        # looks for event that we should handle internally
+        self._check_for_closed_session(response)
+        # surrounding lines overlap in idea
+        if protocol.is_event(response):
+            event_session_id = response.get(
+                "sessionId",
+                "",
+            )
+            _logger.debug2(f"Is event for {event_session_id}")
+            x = self._get_target_session_by_session_id(
+                event_session_id,
+            )
+            if not x:
+                return
+            _, event_session = x
+            if not event_session:
+                _logger.error("Found an event that returned no session.")
+                return
+            _logger.debug(
+                f"Received event {response['method']} for "
+                f"{event_session_id} targeting {event_session}.",
+            )
+
+            session_futures = self._subscriptions_futures.get(
+                event_session_id,
+            )
+            _logger.debug2(
+                "Checking for event subscription future.",
+            )
+            if session_futures:
+                for query, futures in session_futures.matches(response["method"]):
                     _logger.debug2(
-                        "Checking for event subscription callback.",
-                    )
-                    for query in list(event_session.subscriptions):
-                        match = (
-                            query.endswith("*")
-                            and response["method"].startswith(query[:-1])
-                        ) or (response["method"] == query)
-                        _logger.debug2(
-                            "Found event subscription callback.",
-                        )
-                        if match:
-                            t: asyncio.Task[Any] = asyncio.create_task(
-                                event_session.subscriptions[query][0](response),
-                            )
-                            self._background_tasks_cancellable.add(t)
-                            if not event_session.subscriptions[query][1]:
-                                event_session.unsubscribe(query)
-
-                elif key:
-                    _logger.debug(f"Have a response with key {key}")
-                    if key in self.futures:
-                        _logger.debug(f"Found future for key {key}")
-                        future = self.futures.pop(key)
-                    elif "error" in response:
-                        raise protocol.DevtoolsProtocolError(response)
-                    else:
-                        raise RuntimeError(f"Couldn't find a future for key: {key}")
-                    if not future.done():
-                        future.set_result(response)
-                else:
-                    warnings.warn(
-                        f"Unhandled message type:{response!s}",
-                        UnhandledMessageWarning,
-                        stacklevel=1,
+                        "Found event subscription future.",
                     )
-            read_task = asyncio.create_task(read_loop())
-            read_task.add_done_callback(check_read_loop_error)
-            self._current_read_task = read_task
+                    for future in futures:
+                        if not future.done():
+                            future.set_result(response)
+                    del session_futures[query]
 
-        read_task = asyncio.create_task(read_loop())
-        read_task.add_done_callback(check_read_loop_error)
-        self._current_read_task = read_task
+            _logger.debug2(
+                "Checking for event subscription callback.",
+            )
+            subscriptions = event_session.subscriptions.matches(response["method"])
+            for query, (callback, repeating, serial, accept) in subscriptions:
+                _logger.debug2(
+                    "Found event subscription callback.",
+                )
+                if accept is not None and not accept(response):
+                    continue
+                self.callbacks.schedule(
+                    event_session_id,
+                    callback,
+                    response,
+                    serial=(event_session_id, query) if serial else None,
+                )
+                if not repeating:
+                    event_session.unsubscribe(query)
+
+            for _, streams in event_session.streams.matches(response["method"]):
+                for stream in streams:
+                    if stream.put(response):
+                        self._blocked.append(stream)
+
+            for _, batcher in event_session.batches.matches(response["method"]):
+                if batcher.add(response):
+                    self._pending_batches.append(batcher)
+
+        elif key:
+            _logger.debug(f"Have a response with key {key}")
+            if key in self.futures:
+                _logger.debug(f"Found future for key {key}")
+                future = self.futures.pop(key)
+            elif key in self._tombstones:
+                _logger.debug(f"Dropping late response for abandoned key {key}")
+                del self._tombstones[key]
+                return
+            else:
+                # abandoned so long ago it was forgotten, it mustn't stop the read
+                _logger.warning(f"Dropping response for unknown key {key}.")
+                return
+            if not future.done():
+                future.set_result(response)
+        else:
+            warnings.warn(
+                f"Unhandled message type:{response!s}",
+                UnhandledMessageWarning,
+                stacklevel=1,
+            )
 
     async def write_json(
         self,
         obj: protocol.BrowserCommand,
+        *,
+        timeout: float | None = None,
+        priority: str = "interactive",
     ) -> protocol.BrowserResponse:
+        """
+        Send a command and wait for its response.
+
+        Args:
+            obj: the command.
+            timeout: seconds to wait for the response, `Broker.timeout` if None.
+            priority: "control", "interactive" or "bulk", commands waiting to
+                be admitted or written go in that order.
+
+        Raises:
+            asyncio.TimeoutError: if the response doesn't come in time, it's
+                dropped if it comes later.
+
+        """
+        lane = Lanes.lane(priority)
+        key = self._check_command(obj)
+        loop = asyncio.get_running_loop()
+        if timeout is None:
+            timeout = self.timeout
+        limiter = self.limiter
+        if limiter is None:
+            return await self._send(key, obj, timeout, lane)
+        start = loop.time()
+        await asyncio.wait_for(limiter.acquire(lane), timeout)
+        if timeout is not None:
+            timeout = max(timeout - (loop.time() - start), 0)
+        latency = None
+        timed_out = False
+        try:
+            sent = loop.time()
+            response = await self._send(key, obj, timeout, lane)
+            latency = loop.time() - sent
+        except asyncio.TimeoutError:
+            timed_out = True  # as slow as it gets, whatever time was left
+            raise
+        finally:
+            limiter.release(latency, timed_out=timed_out)
+        return response
+
+    def write_jsons(
+        self,
+        objs: Sequence[protocol.BrowserCommand],
+        *,
+        timeout: float | None = None,
+        priority: str = "interactive",
+    ) -> list[Awaitable[protocol.BrowserResponse]]:
+        """
+        Send commands together, return an awaitable for each one's response.
+
+        Without a limiter, they're all queued now, so they go out in one
+        write. The awaitables must all be awaited, e.g. with `asyncio.gather()`.
+
+        Args:
+            objs: the commands.
+            timeout: seconds to wait for each response, `Broker.timeout` if None.
+            priority: "control", "interactive" or "bulk", see `write_json()`.
+
+        """
+        if self.limiter is not None:  # each has to be admitted
+            return [
+                self.write_json(obj, timeout=timeout, priority=priority) for obj in objs
+            ]
+        lane = Lanes.lane(priority)
+        keys = [self._check_command(obj) for obj in objs]
+        if timeout is None:
+            timeout = self.timeout
+        return [
+            self._response(key, self._enqueue(key, obj, lane), timeout)
+            for key, obj in zip(keys, objs)
+        ]
+
+    def notify(
+        self,
+        obj: protocol.BrowserCommand,
+        *,
+        priority: str = "interactive",
+    ) -> None:
+        """
+        Queue a command without waiting for, or keeping track of, its reply.
+
+        Its id must be at least `protocol.NOTIFICATION_IDS`, its reply is
+        dropped as it's read. It isn't held back by the limiter.
+
+        Args:
+            obj: the command.
+            priority: "control", "interactive" or "bulk", see `write_json()`.
+
+        """
+        protocol.verify_params(obj)
+        if obj["id"] < protocol.NOTIFICATION_IDS:
+            raise ValueError("Notifications' ids start at protocol.NOTIFICATION_IDS.")
+        self._write_queue.append((obj, None), Lanes.lane(priority))
+        self._wake_writer()
+
+    def _check_command(self, obj: protocol.BrowserCommand) -> protocol.MessageKey:
         protocol.verify_params(obj)
         key = protocol.calculate_message_key(obj)
         _logger.debug1(f"Broker writing {obj['method']} with key {key}")
@@ -240,36 +401,172 @@ class Broker:
                 "Message strangely formatted and "
                 "choreographer couldn't figure it out why.",
             )
+        return key
+
+    async def _send(
+        self,
+        key: protocol.MessageKey,
+        obj: protocol.BrowserCommand,
+        timeout: float | None,
+        lane: int,
+    ) -> protocol.BrowserResponse:
+        future = self._enqueue(key, obj, lane)
+        return await self._response(key, future, timeout)
+
+    def _enqueue(
+        self,
+        key: protocol.MessageKey,
+        obj: protocol.BrowserCommand,
+        lane: int,
+    ) -> asyncio.Future[protocol.BrowserResponse]:
         loop = asyncio.get_running_loop()
         future: asyncio.Future[protocol.BrowserResponse] = loop.create_future()
+        if len(self.futures) >= _MAX_FUTURES:
+            oldest = next(iter(self.futures))
+            _logger.warning(f"Too many commands waiting, abandoning {oldest}")
+            oldest_future = self.futures[oldest]
+            if not oldest_future.done():
+                oldest_future.set_exception(
+                    RuntimeError("Command abandoned, too many were waiting."),
+                )
+            self._abandon(oldest, oldest_future)
         self.futures[key] = future
         _logger.debug(f"Created future: {key} {future}")
+        self._write_queue.append((obj, future), lane)
+        self._wake_writer()
+        return future
+
+    async def _response(
+        self,
+        key: protocol.MessageKey,
+        future: asyncio.Future[protocol.BrowserResponse],
+        timeout: float | None,
+    ) -> protocol.BrowserResponse:
+        loop = asyncio.get_running_loop()
+        start = loop.time()
         try:
-            async with self._write_lock:
-                loop = asyncio.get_running_loop()
-                await loop.run_in_executor(
-                    None,
-                    self._channel.write_json,
-                    obj,
-                )
-        except BaseException as e:  # noqa: BLE001
-            future.set_exception(e)
-            del self.futures[key]
-            _logger.debug(f"Future for {key} deleted.")
-        return await future
+            response = await asyncio.wait_for(future, timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            self._abandon(key, future)
+            raise
+        elapsed = loop.time() - start
+        if self.latency is None:
+            self.latency = elapsed
+        else:
+            self.latency += _LATENCY_WEIGHT * (elapsed - self.latency)
+        return response
+
+    def _abandon(
+        self,
+        key: protocol.MessageKey,
+        future: asyncio.Future[Any],
+    ) -> None:
+        """Forget a command's future, its response will be dropped if it comes."""
+        if not future.done():
+            future.cancel()
+        if self.futures.get(key) is not future:
+            return  # it was answered
+        del self.futures[key]
+        self._tombstones[key] = None
+        if len(self._tombstones) > _MAX_TOMBSTONES:
+            del self._tombstones[next(iter(self._tombstones))]
+
+    @property
+    def closed(self) -> bool:
+        """Whether it isn't reading the browser: not started, or the channel's done."""
+        task = self._current_read_task
+        return task is None or task.done()
+
+    @property
+    def in_flight(self) -> int:
+        """The number of commands sent and not yet answered."""
+        return len(self.futures)
+
+    def _wake_writer(self) -> None:
+        pending = self._write_pending
+        if pending is None or self._writer_task is None or self._writer_task.done():
+            pending = self._write_pending = asyncio.Event()
+            self._writer_task = asyncio.create_task(self._write_loop(pending))
+        pending.set()
+
+    def _take_batch(
+        self,
+    ) -> list[_Queued]:
+        batch: list[_Queued] = []
+        queue = self._write_queue
+        while queue and len(batch) < _BATCH_MAX:
+            obj, future = queue.popleft()
+            # abandoned commands needn't go out
+            if future is None or not future.done():
+                batch.append((obj, future))
+        return batch
+
+    async def _write_loop(self, pending: asyncio.Event) -> None:
+        """
+        Drain the write queue, writing what's queued together.
+
+        Batches are taken by priority and capped, so a control command
+        queued behind a backlog goes out in the next batch.
+        """
+        while True:
+            if not self._write_queue:
+                await pending.wait()
+                pending.clear()
+            batch = self._take_batch()
+            if not batch:
+                continue
+            _logger.debug(f"Writer sending {len(batch)} messages.")
+            try:
+                await self._channel.write_jsons_async([obj for obj, _ in batch])
+            except asyncio.CancelledError:
+                self._fail_writes(batch, asyncio.CancelledError())
+                raise
+            except Exception as e:  # noqa: BLE001 it belongs to the callers
+                if len(batch) > 1 and not isinstance(e, channels.ChannelClosedError):
+                    # nothing went out, find the bad one(s) without the rest
+                    await self._write_one_by_one(batch)
+                else:
+                    self._fail_writes(batch, e)
+
+    async def _write_one_by_one(
+        self,
+        batch: list[_Queued],
+    ) -> None:
+        for obj, future in batch:
+            try:
+                await self._channel.write_json_async(obj)
+            except Exception as e:  # noqa: BLE001, PERF203 it belongs to the caller
+                self._fail_writes([(obj, future)], e)
+
+    def _fail_writes(
+        self,
+        batch: list[_Queued],
+        e: BaseException,
+    ) -> None:
+        for obj, future in batch:
+            if future is None:  # a notification, nobody to tell
+                _logger.warning(f"Couldn't send {obj['method']}: {e!r}")
+                continue
+            if not future.done():
+                future.set_exception(e)
+            key = protocol.calculate_message_key(obj)
+            if key and self.futures.get(key) is future:
+                del self.futures[key]
+                _logger.debug(f"Future for {key} deleted.")
+
+    def add_route(self, target: Target, session: Session) -> None:
+        """Route the session's events to it, see `Target._add_session()`."""
+        self._routes[session.session_id] = (target, session)
+
+    def remove_route(self, session_id: str) -> None:
+        """Stop routing a session's events, see `Target._remove_session()`."""
+        self._routes.pop(session_id, None)
 
     def _get_target_session_by_session_id(
         self,
         session_id: str,
     ) -> tuple[Target, Session] | None:
-        if session_id == "":
-            return (self._browser, self._browser.sessions[session_id])
-        for tab in self._browser.tabs.values():
-            if session_id in tab.sessions:
-                return (tab, tab.sessions[session_id])
-        if session_id in self._browser.sessions:
-            return (self._browser, self._browser.sessions[session_id])
-        return None
+        return self._routes.get(session_id)
 
     def _check_for_closed_session(self, response: protocol.BrowserResponse) -> bool:
         if "method" in response and response["method"] == "Target.detachedFromTarget":
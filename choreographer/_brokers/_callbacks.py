@@ -0,0 +1,266 @@
+"""
+Provides `CallbackScheduler`, which runs subscription callbacks for the broker.
+
+And `OffloadedCallback`, a plain function it runs in a pool.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import TYPE_CHECKING
+
+import logistro
+
+if TYPE_CHECKING:
+    from typing import Any, Callable, Coroutine, Hashable
+
+    from choreographer import protocol
+
+    _Callback = Callable[[Any], Coroutine[Any, Any, Any]]
+    _Job = Callable[[], Coroutine[Any, Any, Any]]
+
+_logger = logistro.getLogger(__name__)
+
+EXECUTORS = ("thread", "process")
+"""The pools `offload()` can make, or it's given an `Executor`."""
+
+KEPT_FUTURES = 100
+"""How many of its latest futures an `OffloadedCallback` keeps."""
+
+
+class OffloadedCallback:
+    """
+    OffloadedCallback is a plain function run in a pool, `offload()` makes it.
+
+    Each call runs the function in the pool, and its future goes in `futures`:
+    its result is what the function returned, or the exception it raised.
+    `subscribe(executor=)` returns it, so those can be read. Exceptions are
+    also logged, like an `async def` callback's.
+    """
+
+    callback: Callable[[protocol.BrowserResponse], Any]
+    """The function, it's passed the event."""
+    futures: deque[asyncio.Future[Any]]
+    """The futures of the latest `KEPT_FUTURES` calls, oldest first."""
+
+    def __init__(
+        self,
+        callback: Callable[[protocol.BrowserResponse], Any],
+        pool: Callable[[], Executor],
+    ) -> None:
+        """
+        Construct an offloaded callback.
+
+        Args:
+            callback: the function, it's passed the event.
+            pool: returns the pool to run it in, when it's called.
+
+        """
+        self.callback = callback
+        self.futures = deque(maxlen=KEPT_FUTURES)
+        self._pool = pool
+
+    @property
+    def last(self) -> asyncio.Future[Any] | None:
+        """The future of the latest call, None before the first."""
+        return self.futures[-1] if self.futures else None
+
+    async def __call__(self, event: protocol.BrowserResponse) -> Any:
+        """
+        Run the function for an event in the pool, and wait for it.
+
+        Args:
+            event: the event (or list of them), passed to the function.
+
+        """
+        future = asyncio.get_running_loop().run_in_executor(
+            self._pool(),
+            self.callback,
+            event,
+        )
+        self.futures.append(future)
+        return await future
+
+
+class CallbackScheduler:
+    """
+    CallbackScheduler runs callbacks as tasks, capping how many run at once.
+
+    Callbacks past a cap wait in order, per session and then overall.
+    Finished tasks are dropped as they finish, so nothing grows with the
+    number of events. A serial subscription's events go in a queue, drained
+    in order by one task, instead of a task each. Plain functions can be
+    `offload()`ed to a pool, their tasks wait on the pool's futures, so the
+    loop is free while they run.
+    """
+
+    max_concurrent: int | None
+    """How many callbacks can run at once, None is no limit."""
+    max_per_session: int | None
+    """How many callbacks of one session can run at once, None is no limit."""
+
+    def __init__(
+        self,
+        *,
+        max_concurrent: int | None = None,
+        max_per_session: int | None = None,
+    ) -> None:
+        """
+        Construct a scheduler.
+
+        Args:
+            max_concurrent: how many callbacks can run at once.
+            max_per_session: how many callbacks of one session can run at once.
+
+        """
+        self.max_concurrent = max_concurrent
+        self.max_per_session = max_per_session
+        self._tasks: set[asyncio.Task[Any]] = set()
+        self._per_session: dict[str, int] = {}  # running or waiting overall
+        self._session_waiting: dict[str, deque[_Job]] = {}
+        self._waiting: deque[tuple[str, _Job]] = deque()
+        self._serial: dict[Hashable, deque[Any]] = {}
+        self._pools: dict[str, Executor] = {}  # made when first used
+
+    @property
+    def running(self) -> int:
+        """How many callbacks are running."""
+        return len(self._tasks)
+
+    @property
+    def waiting(self) -> int:
+        """How many callbacks are waiting for a slot."""
+        return len(self._waiting) + sum(map(len, self._session_waiting.values()))
+
+    def offload(
+        self,
+        callback: Callable[[protocol.BrowserResponse], Any],
+        executor: str | Executor,
+    ) -> OffloadedCallback:
+        """
+        Wrap a plain function to run in a pool, as a callback `schedule()` takes.
+
+        The returned `OffloadedCallback` keeps the futures of its calls.
+
+        Args:
+            callback: the function, it's passed the event. For "process" it
+                must be picklable, a module's function.
+            executor: "thread" or "process", pools shared by this scheduler's
+                callbacks, or an `Executor` of your own (it's not shut down).
+
+        Raises:
+            ValueError: if executor isn't one of `EXECUTORS` or an `Executor`.
+
+        """
+        if not isinstance(executor, Executor) and executor not in EXECUTORS:
+            raise ValueError(
+                f"executor must be one of {EXECUTORS} or an Executor, "
+                f"not {executor!r}.",
+            )
+        if isinstance(executor, Executor):
+            return OffloadedCallback(callback, lambda: executor)
+        return OffloadedCallback(callback, lambda: self._pool(executor))
+
+    def _pool(self, kind: str) -> Executor:
+        pool = self._pools.get(kind)
+        if pool is None:
+            _logger.debug(f"Starting a {kind} pool for callbacks.")
+            pool = self._pools[kind] = (
+                ThreadPoolExecutor(thread_name_prefix="choreographer-callback")
+                if kind == "thread"
+                else ProcessPoolExecutor()
+            )
+        return pool
+
+    def schedule(
+        self,
+        session_id: str,
+        callback: _Callback,
+        event: Any,
+        *,
+        serial: Hashable | None = None,
+    ) -> None:
+        """
+        Run a callback for an event.
+
+        Args:
+            session_id: the session it's for, for the per-session cap.
+            callback: the subscription's callback.
+            event: the event, or a list of them for a batch subscription.
+            serial: if not None, a key for the subscription: its callbacks run
+                one after the other, in the order of their events.
+
+        """
+        if serial is None:
+            self._submit(session_id, lambda: callback(event))
+            return
+        queue = self._serial.get(serial)
+        if queue is not None:  # its task will get to it
+            queue.append(event)
+            return
+        self._serial[serial] = deque((event,))
+        self._submit(session_id, lambda: self._drain(serial, callback))
+
+    async def _drain(self, key: Hashable, callback: _Callback) -> None:
+        queue = self._serial[key]
+        try:
+            while queue:
+                try:
+                    await callback(queue.popleft())
+                except Exception:  # noqa: PERF203 the next event still runs
+                    _logger.exception("Error in subscription callback.")
+        finally:
+            self._serial.pop(key, None)
+
+    def _submit(self, session_id: str, job: _Job) -> None:
+        count = self._per_session.get(session_id, 0)
+        if self.max_per_session is not None and count >= self.max_per_session:
+            self._session_waiting.setdefault(session_id, deque()).append(job)
+            return
+        self._per_session[session_id] = count + 1
+        self._admit(session_id, job)
+
+    def _admit(self, session_id: str, job: _Job) -> None:
+        if self.max_concurrent is not None and len(self._tasks) >= self.max_concurrent:
+            self._waiting.append((session_id, job))
+            return
+        task = asyncio.create_task(job())
+        self._tasks.add(task)
+        task.add_done_callback(lambda t: self._finished(session_id, t))
+
+    def _finished(self, session_id: str, task: asyncio.Task[Any]) -> None:
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            _logger.error("Error in subscription callback.", exc_info=task.exception())
+        count = self._per_session[session_id] - 1
+        if count:
+            self._per_session[session_id] = count
+        else:
+            del self._per_session[session_id]
+        session_waiting = self._session_waiting.get(session_id)
+        if session_waiting:
+            job = session_waiting.popleft()
+            if not session_waiting:
+                del self._session_waiting[session_id]
+            self._per_session[session_id] = count + 1
+            self._admit(session_id, job)
+        while self._waiting and (
+            self.max_concurrent is None or len(self._tasks) < self.max_concurrent
+        ):
+            self._admit(*self._waiting.popleft())
+
+    def cancel(self) -> None:
+        """Cancel the running callbacks, forget the waiting ones, stop pools."""
+        self._waiting.clear()
+        self._session_waiting.clear()
+        self._serial.clear()
+        for task in list(self._tasks):
+            if not task.done():
+                _logger.debug2(f"Cancelling {task}")
+                task.cancel()
+        for kind, pool in self._pools.items():
+            _logger.debug(f"Shutting down the {kind} pool for callbacks.")
+            pool.shutdown(wait=False)  # what's running can't be stopped
+        self._pools.clear()
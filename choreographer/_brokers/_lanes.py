@@ -0,0 +1,77 @@
+"""Provides `Lanes`, queues by command priority."""
+
+from __future__ import annotations
+
+from collections import deque
+from typing import Generic, TypeVar
+
+_T = TypeVar("_T")
+
+PRIORITIES = ("control", "interactive", "bulk")
+"""The priorities commands can have, highest first."""
+_BULK_EVERY = 8
+"""While interactive items wait, bulk gets every this many turns anyway."""
+
+
+class Lanes(Generic[_T]):
+    """
+    Lanes queues items by priority, `popleft()` takes the highest first.
+
+    So bulk items aren't starved by a steady flow of interactive ones, one
+    in `_BULK_EVERY` turns goes to bulk if it's waiting. Control items always
+    go first, there are few of them.
+    """
+
+    __slots__ = ("_bulk_debt", "_lanes")
+
+    def __init__(self) -> None:
+        """Construct empty lanes."""
+        self._lanes: tuple[deque[_T], ...] = tuple(deque() for _ in PRIORITIES)
+        self._bulk_debt = 0
+
+    @staticmethod
+    def lane(priority: str) -> int:
+        """
+        Return the lane for a priority.
+
+        Args:
+            priority: one of `PRIORITIES`.
+
+        Raises:
+            ValueError: if it isn't one.
+
+        """
+        try:
+            return PRIORITIES.index(priority)
+        except ValueError:
+            raise ValueError(
+                f"priority must be one of {PRIORITIES}, not {priority!r}.",
+            ) from None
+
+    def append(self, item: _T, lane: int) -> None:
+        """Queue an item in a lane, see `lane()`."""
+        self._lanes[lane].append(item)
+
+    def popleft(self) -> _T:
+        """Take the next item, raises IndexError if there's none."""
+        control, interactive, bulk = self._lanes
+        if control:
+            return control.popleft()
+        if bulk and (not interactive or self._bulk_debt >= _BULK_EVERY):
+            self._bulk_debt = 0
+            return bulk.popleft()
+        if bulk:
+            self._bulk_debt += 1
+        return interactive.popleft()
+
+    def remove(self, item: _T) -> None:
+        """Remove an item, raises ValueError if it isn't queued."""
+        for queue in self._lanes:
+            if item in queue:
+                queue.remove(item)
+                return
+        raise ValueError("Item isn't queued.")
+
+    def __len__(self) -> int:
+        """Return how many items are queued."""
+        return sum(len(queue) for queue in self._lanes)
@@ -0,0 +1,158 @@
+"""Provides `Limiter`, which caps how many commands a browser works on at once."""
+
+from __future__ import annotations
+
+import asyncio
+
+import logistro
+
+from ._lanes import Lanes
+
+_logger = logistro.getLogger(__name__)
+
+_CONTROL, _INTERACTIVE = Lanes.lane("control"), Lanes.lane("interactive")
+_ADAPTIVE_START = 16
+"""Where an adaptive limit without a maximum starts."""
+_ADAPTIVE_MAX = 1024
+"""How high an adaptive limit without a maximum can grow."""
+_DECREASE = 0.7
+"""The multiplicative decrease, on a slow response."""
+_TOLERANCE = 2.0
+"""Responses slower than this times the baseline are slow."""
+_SLACK = 0.005
+"""Seconds added to what's slow, so tiny baselines don't make everything slow."""
+_BASELINE_DRIFT = 0.01
+"""How fast the baseline follows latencies above it."""
+_WAIT_WEIGHT = 0.2
+"""How much the latest admission counts in the `wait_time` moving average."""
+
+
+class Limiter:
+    """
+    Limiter admits commands while fewer than `limit` are in flight.
+
+    Commands past the limit wait, by priority. If adaptive, the limit grows by
+    about one per limit's worth of fast responses (additive increase), and
+    shrinks by a factor on a slow one (multiplicative decrease), at most once
+    per baseline latency. A response is slow if it took much longer than the
+    baseline, the fastest recent latency.
+    """
+
+    limit: float
+    """How many commands can be in flight, it's a float for additive increase."""
+    in_flight: int
+    """How many commands were admitted and haven't been released."""
+    wait_time: float
+    """A moving average of how long admitted commands waited, in seconds."""
+
+    def __init__(
+        self,
+        max_in_flight: int | None = None,
+        *,
+        adaptive: bool = False,
+    ) -> None:
+        """
+        Construct a limiter.
+
+        Args:
+            max_in_flight: the limit, if adaptive its maximum.
+            adaptive: adjust the limit by the responses' latency.
+
+        Raises:
+            ValueError: if there's no limit to start from.
+
+        """
+        if max_in_flight is None and not adaptive:
+            raise ValueError("A limiter needs a max_in_flight, or to be adaptive.")
+        if max_in_flight is not None and max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least 1.")
+        self.adaptive = adaptive
+        self.max_limit = max_in_flight or _ADAPTIVE_MAX
+        self.limit = max_in_flight or _ADAPTIVE_START
+        self.in_flight = 0
+        self.wait_time = 0.0
+        self._baseline: float | None = None
+        self._last_decrease = 0.0
+        self._waiters: Lanes[asyncio.Future[None]] = Lanes()
+
+    @property
+    def queue_depth(self) -> int:
+        """How many commands are waiting to be admitted."""
+        return len(self._waiters)
+
+    async def acquire(self, lane: int = _INTERACTIVE) -> None:
+        """
+        Wait until a command can go out.
+
+        Args:
+            lane: its priority's `Lanes.lane()`, waiters are admitted by it.
+                Control commands are admitted right away, over the limit.
+
+        """
+        loop = asyncio.get_running_loop()
+        if lane == _CONTROL or (self.in_flight < int(self.limit) and not self._waiters):
+            self.in_flight += 1
+            self.wait_time -= _WAIT_WEIGHT * self.wait_time
+            return
+        start = loop.time()
+        waiter = loop.create_future()
+        self._waiters.append(waiter, lane)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():  # admitted, pass it on
+                self.in_flight -= 1
+                self._admit()
+            else:
+                self._waiters.remove(waiter)
+            raise
+        self.wait_time += _WAIT_WEIGHT * (loop.time() - start - self.wait_time)
+
+    def release(
+        self,
+        latency: float | None = None,
+        *,
+        timed_out: bool = False,
+    ) -> None:
+        """
+        Release a command that was admitted.
+
+        Args:
+            latency: how long its response took, if it came, to adapt the limit.
+            timed_out: its response didn't come in time, the limit shrinks as
+                for a slow one.
+
+        """
+        self.in_flight -= 1
+        if self.adaptive:
+            if timed_out:
+                self._decrease("Timed out")
+            elif latency is not None:
+                self._adapt(latency)
+        self._admit()
+
+    def _adapt(self, latency: float) -> None:
+        baseline = self._baseline
+        if baseline is None or latency < baseline:
+            self._baseline = baseline = latency
+        else:
+            self._baseline = baseline + _BASELINE_DRIFT * (latency - baseline)
+        if latency <= baseline * _TOLERANCE + _SLACK:
+            self.limit = min(self.limit + 1 / self.limit, self.max_limit)
+            return
+        self._decrease(f"Slow response ({latency:.3f}s)")
+
+    def _decrease(self, reason: str) -> None:
+        now = asyncio.get_running_loop().time()
+        if now - self._last_decrease < (self._baseline or 0) + _SLACK:
+            return  # one slow period, one decrease
+        self._last_decrease = now
+        self.limit = max(self.limit * _DECREASE, 1)
+        _logger.debug(f"{reason}, limit now {self.limit:.1f}")
+
+    def _admit(self) -> None:
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
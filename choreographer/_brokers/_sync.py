@@ -10,9 +10,10 @@ from choreographer import protocol
 from choreographer.channels import ChannelClosedError
 
 if TYPE_CHECKING:
-    from typing import Any
+    from typing import Any, Callable, Sequence
 
     from choreographer.browser_sync import BrowserSync
+    from choreographer.channels import PipeHub
     from choreographer.channels._interface_type import ChannelInterface
 
 _logger = logistro.getLogger(__name__)
@@ -29,26 +30,84 @@ class BrokerSync:
     that the broker communicates on.
     """
 
-    def __init__(self, browser: BrowserSync, channel: ChannelInterface) -> None:
+    def __init__(
+        self,
+        browser: BrowserSync,
+        channel: ChannelInterface,
+        *,
+        hub: PipeHub | None = None,
+    ) -> None:
         """
         Construct a broker for a synchronous arragenment w/ both ends.
 
         Args:
             browser: The sync browser implementation.
             channel: The channel the browser uses to talk on.
+            hub: The `PipeHub` reading the channel, if any.
 
         """
         self._browser = browser
         self._channel = channel
+        self._hub = hub
+        self._listeners: list[Callable[[protocol.BrowserResponse], Any]] = []
+        self._reader: Thread | None = None
+
+    def start(self) -> None:
+        """Have the hub, if there's one, read the channel for the listeners."""
+        if self._hub is not None:
+            self._hub.add(self._channel, self._dispatch)  # type: ignore [arg-type]
+
+    def add_listener(
+        self,
+        listener: Callable[[protocol.BrowserResponse], Any],
+    ) -> None:
+        """
+        Call a listener with each message from the browser.
+
+        With a hub, the hub's thread calls it. Otherwise the first listener
+        starts a thread reading the channel, which calls them all.
+
+        Args:
+            listener: called with each message, it mustn't block.
+
+        """
+        self._listeners.append(listener)
+        if self._hub is not None or self._reader is not None:
+            return
+        self._reader = Thread(target=self._read, daemon=True)
+        self._reader.start()
+
+    def _read(self) -> None:
+        try:
+            while True:
+                self._dispatch(self._channel.read_jsons())
+        except ChannelClosedError:
+            _logger.debug("Channel closed, no more messages for listeners.")
+
+    def _dispatch(self, messages: Sequence[protocol.BrowserResponse]) -> None:
+        for message in messages:
+            for listener in self._listeners:
+                try:
+                    listener(message)
+                except Exception:  # noqa: PERF203 the next listener still runs
+                    _logger.exception("Error in message listener.")
 
     def run_output_thread(self, **kwargs: Any) -> None:
         """
         Run a thread which dumps all browser messages. kwargs is passed to print.
 
+        With a hub, the hub's thread dumps them instead.
+
         Raises:
             ChannelClosedError: When the channel is closed, this error is raised.
 
         """
+        if self._hub is not None:
+            _logger.info("Dumping output to stdout from the hub.")
+            self.add_listener(
+                lambda response: print(json.dumps(response, indent=4), **kwargs),  # noqa: T201 print is the point
+            )
+            return
 
         def run_print() -> None:
             try:
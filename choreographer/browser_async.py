@@ -14,11 +14,15 @@ import logistro
 from choreographer import protocol
 
 from ._brokers import Broker
+from ._brokers._limiter import Limiter
 from .browsers import BrowserClosedError, BrowserFailedError, Chromium
+from .browsers.remote import RemoteProcess
 from .channels import ChannelClosedError, Pipe
 from .protocol.devtools_async import Session, Target
 from .utils import TmpDirWarning
+from .utils._executor import run_blocking
 from .utils._kill import kill
+from .utils._wait import wait_process
 
 if TYPE_CHECKING:
     from pathlib import Path
@@ -50,6 +54,8 @@ class Browser(Target):
     """A mapping by target_id of ALL the targets."""
     # Don't init instance attributes with mutables
     _watch_dog_task: asyncio.Task[Any] | None = None
+    subprocess: subprocess.Popen[bytes] | RemoteProcess
+    """The browser's process, or its stand-in if we attached to a remote one."""
 
     def _make_lock(self) -> None:
         self._open_lock = Lock()
@@ -73,12 +79,18 @@ class Browser(Target):
         except RuntimeError:
             return False
 
-    def __init__(
+    def __init__(  # noqa: PLR0913 they're all options
         self,
         path: str | Path | None = None,
         *,
         browser_cls: type[BrowserImplInterface] = Chromium,
         channel_cls: type[ChannelInterface] = Pipe,
+        wire_format: str = "json",
+        command_timeout: float | None = None,
+        max_in_flight: int | None = None,
+        adaptive_in_flight: bool = False,
+        max_callbacks: int | None = None,
+        max_callbacks_per_session: int | None = None,
         **kwargs: Any,
     ) -> None:
         """
@@ -88,6 +100,17 @@ class Browser(Target):
             path: The path to the browser executable.
             browser_cls: The type of browser (default: `Chromium`).
             channel_cls: The type of channel to browser (default: `Pipe`).
+            wire_format: "json" (default) or "cbor", how the channel encodes
+                messages. With "cbor", binary data arrives as `bytes`.
+            command_timeout: The default seconds commands wait for a response,
+                None (default) waits forever.
+            max_in_flight: How many commands can wait for a response at once,
+                the rest queue. None (default) is no limit.
+            adaptive_in_flight: Adjust that limit (up to `max_in_flight`, if
+                set) by how fast the browser answers.
+            max_callbacks: How many subscription callbacks can run at once,
+                the rest wait. None (default) is no limit.
+            max_callbacks_per_session: The same, for each session.
             kwargs: The arguments that the browser_cls takes. For example,
                 headless=True/False, enable_gpu=True/False, etc.
 
@@ -98,8 +121,19 @@ class Browser(Target):
         self.targets = {}
 
         # Compose Resources
-        self._channel = channel_cls()
+        if wire_format == "json":  # channels needn't take an argument for it
+            self._channel = channel_cls()
+        else:
+            self._channel = channel_cls(wire_format=wire_format)  # type: ignore [call-arg]
         self._broker = Broker(self, self._channel)
+        self._broker.timeout = command_timeout
+        self._broker.callbacks.max_concurrent = max_callbacks
+        self._broker.callbacks.max_per_session = max_callbacks_per_session
+        if max_in_flight is not None or adaptive_in_flight:
+            self._broker.limiter = Limiter(
+                max_in_flight,
+                adaptive=adaptive_in_flight,
+            )
         self._browser_impl = browser_cls(self._channel, path, **kwargs)
         if hasattr(browser_cls, "logger_parser"):
             parser = browser_cls.logger_parser
@@ -110,6 +144,11 @@ class Browser(Target):
             parser=parser,
         )
 
+    @property
+    def limiter(self) -> Limiter | None:
+        """The `Limiter` admitting commands, see its `queue_depth` and `wait_time`."""
+        return self._broker.limiter
+
     def is_isolated(self) -> bool:
         """Return if process is isolated."""
         return self._browser_impl.is_isolated()
@@ -133,9 +172,12 @@ class Browser(Target):
                 **args,
             )
 
-        _logger.debug("Trying to open browser.")
-        loop = asyncio.get_running_loop()
-        self.subprocess = await loop.run_in_executor(None, run)
+        if hasattr(self._browser_impl, "attach"):  # it's already running elsewhere
+            _logger.debug("Trying to attach to browser.")
+            self.subprocess = self._browser_impl.attach()
+        else:
+            _logger.debug("Trying to open browser.")
+            self.subprocess = await run_blocking(run)
 
         super().__init__("0", self._broker)
         self._add_session(Session("", self._broker))
@@ -143,11 +185,22 @@ class Browser(Target):
         try:
             _logger.debug("Starting watchdog")
             self._watch_dog_task = asyncio.create_task(self._watchdog())
+            if hasattr(self._channel, "open"):  # it connects once the browser's up
+                _logger.debug("Connecting channel")
+                url = await run_blocking(
+                    self._browser_impl.get_websocket_url,  # type: ignore [attr-defined]
+                )
+                await self._channel.open(url)
             _logger.debug("Running read loop")
             self._broker.run_read_loop()
             _logger.debug("Populating Targets")
             await self.populate_targets()
-        except (BrowserClosedError, BrowserFailedError, asyncio.CancelledError) as e:
+        except (
+            BrowserClosedError,
+            BrowserFailedError,
+            ChannelClosedError,
+            asyncio.CancelledError,
+        ) as e:
             raise BrowserFailedError(
                 "The browser seemed to close immediately after starting.",
                 "You can set the `logging.Logger` level lower to see more output.",
@@ -171,28 +224,27 @@ class Browser(Target):
             _is_open = self.subprocess.poll() is None
             return not _is_open
         else:
-            try:
-                loop = asyncio.get_running_loop()
-                await loop.run_in_executor(None, self.subprocess.wait, wait)
-            except subprocess.TimeoutExpired:
-                return False
-        return True
+            return await wait_process(self.subprocess, wait)
 
     async def _close(self) -> None:
         if await self._is_closed():
             _logger.debug("No _close(), already is closed")
             return
+        if isinstance(self.subprocess, RemoteProcess):
+            _logger.debug("Detaching, the remote browser stays open")
+            self.subprocess.terminate()
+            self._channel.close()
+            return
 
         try:
             _logger.debug("Trying Browser.close")
-            await self.send_command("Browser.close")
+            await self.send_command("Browser.close", priority="control")
         except (BrowserClosedError, BrowserFailedError):
             _logger.debug("Browser is closed trying to send Browser.close")
             return
         except ChannelClosedError:
             _logger.debug("Can't send Browser.close on close channel")
-        loop = asyncio.get_running_loop()
-        await loop.run_in_executor(None, self._channel.close)
+        self._channel.close()
 
         if await self._is_closed(wait=3):
             return
@@ -201,8 +253,7 @@ class Browser(Target):
             _logger.debug("Browser is closed after closing channel")
             return
         _logger.warning("Resorting to unclean kill browser.")
-        loop = asyncio.get_running_loop()
-        await loop.run_in_executor(None, kill, self.subprocess)
+        await run_blocking(kill, self.subprocess)
         if await self._is_closed(wait=4):
             return
         else:
@@ -245,24 +296,27 @@ class Browser(Target):
         with warnings.catch_warnings():
             warnings.filterwarnings("ignore", category=TmpDirWarning)
             _logger.debug("In watchdog")
-            loop = asyncio.get_running_loop()
             _logger.debug2("Running wait.")
-            await loop.run_in_executor(None, self.subprocess.wait)
+            await wait_process(self.subprocess)
             _logger.warning("Wait expired, Browser is being closed by watchdog.")
             self._watch_dog_task = None
             await self.close()
             await asyncio.sleep(1)
-            await loop.run_in_executor(None, self._browser_impl.clean)
+            await run_blocking(self._browser_impl.clean)
 
     def _add_tab(self, tab: Tab) -> None:
         if not isinstance(tab, Tab):
             raise TypeError(f"tab must be an object of {self._tab_type}")
         self.tabs[tab.target_id] = tab
+        for session in tab.sessions.values():
+            self._broker.add_route(tab, session)
 
     def _remove_tab(self, target_id: str) -> None:
         if isinstance(target_id, Tab):
             target_id = target_id.target_id
-        del self.tabs[target_id]
+        tab = self.tabs.pop(target_id)
+        for session_id in list(tab.sessions):
+            tab._remove_session(session_id)  # noqa: SLF001 closes its streams too
 
     def get_tab(self) -> Tab | None:
         """
@@ -394,6 +448,7 @@ class Browser(Target):
         response = await self.send_command(
             command="Target.closeTarget",
             params={"targetId": target_id},
+            priority="control",
         )
         self._remove_tab(target_id)
         if "error" in response:
@@ -18,11 +18,13 @@ from .utils._kill import kill
 if TYPE_CHECKING:
     from pathlib import Path
     from types import TracebackType
-    from typing import Any, MutableMapping
+    from typing import Any, Callable, MutableMapping
 
     from typing_extensions import Self  # 3.9 needs this, could be from typing in 3.10
 
+    from . import protocol
     from .browsers._interface_type import BrowserImplInterface
+    from .channels import PipeHub
     from .channels._interface_type import ChannelInterface
 
 _logger = logistro.getLogger(__name__)
@@ -66,6 +68,7 @@ class BrowserSync(TargetSync):
         *,
         browser_cls: type[BrowserImplInterface] = Chromium,
         channel_cls: type[ChannelInterface] = Pipe,
+        hub: PipeHub | None = None,
         **kwargs: Any,
     ) -> None:
         """
@@ -75,6 +78,8 @@ class BrowserSync(TargetSync):
             path: The path to the browser executable.
             browser_cls: The type of browser (default: `Chromium`).
             channel_cls: The type of channel to browser (default: `Pipe`).
+            hub: A `PipeHub` to read the browser's pipe, with other browsers',
+                in one thread, for the listeners. See `add_listener()`.
             kwargs: The arguments that the browser_cls takes. For example,
                 headless=True/False, enable_gpu=True/False, etc.
 
@@ -86,7 +91,9 @@ class BrowserSync(TargetSync):
 
         # Compose Resources
         self._channel = channel_cls()
-        self._broker = BrokerSync(self, self._channel)
+        if hub is not None and not isinstance(self._channel, Pipe):
+            raise TypeError("A hub can only read a Pipe channel.")
+        self._broker = BrokerSync(self, self._channel, hub=hub)
         self._browser_impl = browser_cls(self._channel, path, **kwargs)
         if hasattr(browser_cls, "logger_parser"):
             parser = browser_cls.logger_parser
@@ -101,6 +108,7 @@ class BrowserSync(TargetSync):
         """Open the browser."""
         if self._is_open():
             raise RuntimeError("Can't re-open the browser")
+        self._broker.start()
         self.subprocess = subprocess.Popen(  # noqa: S603
             self._browser_impl.get_cli(),
             stderr=self._logger_pipe,
@@ -204,3 +212,18 @@ class BrowserSync(TargetSync):
 
         """
         self._broker.run_output_thread(**kwargs)
+
+    def add_listener(
+        self,
+        listener: Callable[[protocol.BrowserResponse], Any],
+    ) -> None:
+        """
+        Call a listener with each message from the browser, in another thread.
+
+        With a `PipeHub`, it's the hub's thread, shared by all its browsers.
+
+        Args:
+            listener: called with each message, it mustn't block.
+
+        """
+        self._broker.add_listener(listener)
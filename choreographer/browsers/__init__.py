@@ -2,10 +2,12 @@
 
 from ._errors import BrowserClosedError, BrowserFailedError
 from .chromium import ChromeNotFoundError, Chromium
+from .remote import RemoteChromium
 
 __all__ = [
     "BrowserClosedError",
     "BrowserFailedError",
     "ChromeNotFoundError",
     "Chromium",
+    "RemoteChromium",
 ]
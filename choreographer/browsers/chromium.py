@@ -7,6 +7,7 @@ import platform
 import re
 import subprocess
 import sys
+import time
 from pathlib import Path
 from typing import TYPE_CHECKING
 
@@ -15,10 +16,11 @@ import logistro
 if platform.system() == "Windows":
     import msvcrt
 
-from choreographer.channels import Pipe
+from choreographer.channels import Pipe, WebSocket
 from choreographer.utils import TmpDirectory, get_browser_path
 
 from ._chrome_constants import chrome_names, typical_chrome_paths
+from ._errors import BrowserFailedError
 
 if TYPE_CHECKING:
     import logging
@@ -66,6 +68,8 @@ class Chromium:
     """True if we want to avoid looking for our local download when searching path."""
     tmp_dir: TmpDirectory
     """A reference to a temporary directory object the chromium needs to store data."""
+    debugging_port: int
+    """The port to listen on with a `WebSocket` channel, 0 lets chromium pick."""
 
     @classmethod
     def logger_parser(
@@ -103,10 +107,12 @@ class Chromium:
                 sandbox_enabled (default False): Enable sandbox-
                     a persnickety thing depending on environment, OS, user, etc
                 tmp_dir (default None): Manually set the temporary directory
+                debugging_port (default 0): The port for a `WebSocket` channel,
+                    0 lets chromium pick a free one.
 
         Raises:
             RuntimeError: Too many kwargs, or browser not found.
-            NotImplementedError: Pipe is the only channel type it'll accept right now.
+            NotImplementedError: Pipe and WebSocket are the channels it accepts.
 
         """
         _logger.info(f"Chromium init'ed with kwargs {kwargs}")
@@ -115,6 +121,7 @@ class Chromium:
         self.headless = kwargs.pop("headless", True)
         self.sandbox_enabled = kwargs.pop("enable_sandbox", False)
         self._tmp_dir_path = kwargs.pop("tmp_dir", None)
+        self.debugging_port = kwargs.pop("debugging_port", 0)
         if kwargs:
             raise RuntimeError(
                 f"Chromium.get_cli() received invalid args: {kwargs.keys()}",
@@ -145,8 +152,8 @@ class Chromium:
             )
         _logger.info(f"Found chromium path: {self.path}")
         self._channel = channel
-        if not isinstance(channel, Pipe):
-            raise NotImplementedError("Websocket style channels not implemented yet.")
+        if not isinstance(channel, (Pipe, WebSocket)):
+            raise NotImplementedError("Only Pipe and WebSocket channels are supported.")
 
         self._is_isolated = "snap" in str(self.path)
 
@@ -178,6 +185,9 @@ class Chromium:
             if isinstance(self._channel, Pipe):
                 args["stdin"] = self._channel.from_choreo_to_external
                 args["stdout"] = self._channel.from_external_to_choreo
+            else:  # the wrapper's {bye} shouldn't reach our stdout
+                args["stdin"] = subprocess.DEVNULL
+                args["stdout"] = subprocess.DEVNULL
         _logger.debug(f"Returning args: {args}")
         return args
 
@@ -230,7 +240,10 @@ class Chromium:
             ],
         )
         if isinstance(self._channel, Pipe):
-            cli.append("--remote-debugging-pipe")
+            if self._channel.wire_format == "cbor":
+                cli.append("--remote-debugging-pipe=cbor")
+            else:
+                cli.append("--remote-debugging-pipe")
             if platform.system() == "Windows":
                 # its gonna read on 3
                 # its gonna write on 4
@@ -242,9 +255,40 @@ class Chromium:
                 cli += [
                     f"--remote-debugging-io-pipes={r_handle!s},{w_handle!s}",
                 ]
+        else:
+            cli.append(f"--remote-debugging-port={self.debugging_port}")
         _logger.debug(f"Returning cli: {cli}")
         return cli
 
+    def get_websocket_url(self, timeout: float = 20) -> str:
+        """
+        Wait for chromium to start listening and return its websocket url.
+
+        Chromium writes the port it picked to `DevToolsActivePort` in its
+        user data directory.
+
+        Args:
+            timeout: how long to wait for chromium, in seconds.
+
+        Raises:
+            BrowserFailedError: if chromium doesn't start listening in time.
+
+        """
+        active_port = Path(self.tmp_dir.path) / "DevToolsActivePort"
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                port, path = active_port.read_text().split()[:2]
+            except (OSError, ValueError):  # not there, or half written
+                time.sleep(0.05)
+                continue
+            url = f"ws://127.0.0.1:{port}{path}"
+            _logger.debug(f"Chromium listening on {url}")
+            return url
+        raise BrowserFailedError(
+            f"Chromium didn't write {active_port} within {timeout} seconds.",
+        )
+
     def get_env(self) -> MutableMapping[str, str]:
         """Return the env needed for chromium."""
         _logger.debug("Returning env: same env, no modification.")
@@ -0,0 +1,170 @@
+"""Provides a browser implementation that attaches to an already running browser."""
+
+from __future__ import annotations
+
+import json
+import subprocess
+import threading
+import urllib.request
+from typing import TYPE_CHECKING
+from urllib.parse import urlsplit, urlunsplit
+
+import logistro
+
+from choreographer.channels import WebSocket
+
+from ._errors import BrowserFailedError
+
+if TYPE_CHECKING:
+    from pathlib import Path
+    from typing import Any, Mapping, MutableMapping, Sequence
+
+    from choreographer.channels._interface_type import ChannelInterface
+
+_logger = logistro.getLogger(__name__)
+
+
+class RemoteProcess:
+    """
+    Stands in for the process of a browser we didn't start.
+
+    It "exits" when we detach, the remote browser keeps running.
+    """
+
+    pid = None
+
+    def __init__(self) -> None:
+        """Construct a handle that is running until `terminate()`."""
+        self._detached = threading.Event()
+
+    def poll(self) -> int | None:
+        """Return None while attached, like `Popen.poll()` while running."""
+        return 0 if self._detached.is_set() else None
+
+    def wait(self, timeout: float | None = None) -> int:
+        """
+        Wait until we detach, like `Popen.wait()`.
+
+        Args:
+            timeout: seconds to wait, None waits forever.
+
+        Raises:
+            subprocess.TimeoutExpired: if we're still attached after timeout.
+
+        """
+        if not self._detached.wait(timeout):
+            raise subprocess.TimeoutExpired("remote browser", timeout or 0)
+        return 0
+
+    def terminate(self) -> None:
+        """Detach, doesn't touch the remote browser."""
+        self._detached.set()
+
+    kill = terminate
+
+
+class RemoteChromium:
+    """
+    RemoteChromium attaches to a chromium already listening for devtools.
+
+    Use it with a `WebSocket` channel, for example:
+    `Browser(browser_cls=RemoteChromium, channel_cls=WebSocket,
+    endpoint="http://render-node:9222")`.
+
+    Closing the `Browser` only disconnects, tabs it created should be closed
+    first, and the remote browser is left running.
+    """
+
+    endpoint: str
+    """The http address of the browser's devtools, e.g. "http://host:9222"."""
+    timeout: float
+    """How long to wait for the endpoint to answer, in seconds."""
+
+    def __init__(
+        self,
+        channel: ChannelInterface,
+        path: Path | str | None = None,
+        **kwargs: Any,
+    ) -> None:
+        """
+        Construct a remote chromium browser implementation.
+
+        Args:
+            channel: the `choreographer.Channel`, it must be a `WebSocket`.
+            path: the endpoint, if `endpoint` isn't passed.
+            kwargs:
+                endpoint: The http address of the browser's devtools.
+                timeout (default 10): Seconds to wait for the endpoint.
+
+        Raises:
+            RuntimeError: Too many kwargs, or no endpoint.
+            NotImplementedError: WebSocket is the channel it accepts.
+
+        """
+        _logger.info(f"RemoteChromium init'ed with kwargs {kwargs}")
+        endpoint = kwargs.pop("endpoint", None) or path
+        self.timeout = kwargs.pop("timeout", 10)
+        if kwargs:
+            raise RuntimeError(
+                f"RemoteChromium received invalid args: {kwargs.keys()}",
+            )
+        if not endpoint:
+            raise RuntimeError("RemoteChromium needs an endpoint to attach to.")
+        self.endpoint = str(endpoint).rstrip("/")
+        if "://" not in self.endpoint:
+            self.endpoint = f"http://{self.endpoint}"
+        if not isinstance(channel, WebSocket):
+            raise NotImplementedError("Only WebSocket channels are supported.")
+        self._channel = channel
+
+    def attach(self) -> RemoteProcess:
+        """Return the stand-in for the browser's process, instead of starting it."""
+        _logger.info(f"Attaching to {self.endpoint}")
+        return RemoteProcess()
+
+    def get_websocket_url(self) -> str:
+        """
+        Ask the endpoint's `/json/version` for the browser's websocket url.
+
+        The host in the answer is what the browser thinks it is, often
+        localhost, so it's replaced by the endpoint's.
+
+        Raises:
+            BrowserFailedError: if the endpoint doesn't answer with a url.
+
+        """
+        version_url = f"{self.endpoint}/json/version"
+        try:
+            with urllib.request.urlopen(  # noqa: S310 the user chose the endpoint
+                version_url,
+                timeout=self.timeout,
+            ) as response:
+                url = json.loads(response.read())["webSocketDebuggerUrl"]
+        except (OSError, ValueError, KeyError) as e:
+            raise BrowserFailedError(
+                f"Couldn't get a websocket url from {version_url}.",
+            ) from e
+        url = urlunsplit(
+            urlsplit(url)._replace(scheme="ws", netloc=urlsplit(self.endpoint).netloc),
+        )
+        _logger.debug(f"Remote chromium listening on {url}")
+        return url
+
+    def is_isolated(self) -> bool:
+        """Return False, the remote browser's /tmp is none of our business."""
+        return False
+
+    def get_popen_args(self) -> Mapping[str, Any]:
+        """Return no arguments, nothing is started."""
+        return {}
+
+    def get_cli(self) -> Sequence[str]:
+        """Return no command line, nothing is started."""
+        return []
+
+    def get_env(self) -> MutableMapping[str, str]:
+        """Return no environment, nothing is started."""
+        return {}
+
+    def clean(self) -> None:
+        """Do nothing, the remote browser cleans up after itself."""
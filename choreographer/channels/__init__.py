@@ -6,11 +6,27 @@ This is a low-level part of the API.
 """
 
 from ._errors import BlockWarning, ChannelClosedError, JSONError
+from ._hub import PipeHub
+from ._wire import (
+    LazyMessage,
+    available_codecs,
+    encode_typed_arrays,
+    typed_array_shim,
+    use_codec,
+)
 from .pipe import Pipe
+from .websocket import WebSocket
 
 __all__ = [
     "BlockWarning",
     "ChannelClosedError",
     "JSONError",
+    "LazyMessage",
     "Pipe",
+    "PipeHub",
+    "WebSocket",
+    "available_codecs",
+    "encode_typed_arrays",
+    "typed_array_shim",
+    "use_codec",
 ]
@@ -0,0 +1,245 @@
+"""
+Provides the CBOR (de)serialization used by `--remote-debugging-pipe=cbor`.
+
+Chrome's CBOR is a small subset of RFC 8949, every message is an *envelope*
+(tag 24 around a byte string with a 4-byte length) holding an indefinite
+length map, and every map or array inside it is wrapped in an envelope too.
+Integers are 32 bit, anything bigger is a double. Binary data is tag 22
+around a byte string, and decodes to `bytes` instead of base64 text.
+Strings come as utf-8, or as utf-16le byte strings when they aren't ascii.
+"""
+
+from __future__ import annotations
+
+import math
+import struct
+from typing import TYPE_CHECKING
+
+import logistro
+
+from ._errors import JSONError
+from ._wire import _Converter
+
+if TYPE_CHECKING:
+    from typing import Any, Callable
+
+_logger = logistro.getLogger(__name__)
+
+ENVELOPE_HEADER = b"\xd8\x18\x5a"
+"""Every message starts with this, then its length as a 4-byte big-endian int."""
+ENVELOPE_HEADER_SIZE = len(ENVELOPE_HEADER) + 4
+
+_UNSIGNED, _NEGATIVE, _BYTES, _STRING, _ARRAY, _MAP, _TAG, _SIMPLE = range(8)
+_INDEFINITE = 31
+_BREAK = 0xFF
+_TAG_ENVELOPE = 24
+_TAGS_BINARY = (21, 22, 23)  # expected conversion to base64url, base64, base16
+_INT32 = 2**31
+
+_double = struct.Struct(">d")
+_single = struct.Struct(">f")
+_default = _Converter(nulls_nan=True)
+
+
+def _head(major: int, n: int, out: bytearray) -> None:
+    major <<= 5
+    if n < 24:  # noqa: PLR2004 the cbor encoding
+        out.append(major | n)
+    elif n < 2**8:
+        out += bytes((major | 24, n))
+    elif n < 2**16:
+        out.append(major | 25)
+        out += n.to_bytes(2, "big")
+    elif n < 2**32:
+        out.append(major | 26)
+        out += n.to_bytes(4, "big")
+    else:
+        out.append(major | 27)
+        out += n.to_bytes(8, "big")
+
+
+def _encode(  # noqa: C901, PLR0912 it's a type switch
+    obj: Any,
+    out: bytearray,
+    default: Callable[[Any], Any],
+) -> None:
+    if obj is None:
+        out.append(0xF6)
+    elif obj is True:
+        out.append(0xF5)
+    elif obj is False:
+        out.append(0xF4)
+    elif isinstance(obj, int) and -_INT32 <= obj < _INT32:
+        if obj >= 0:
+            _head(_UNSIGNED, obj, out)
+        else:
+            _head(_NEGATIVE, -1 - obj, out)
+    elif isinstance(obj, (int, float)):
+        if isinstance(obj, float) and not math.isfinite(obj):
+            out.append(0xF6)  # like json, NaN and Infinity are null
+        else:
+            out.append(0xFB)
+            out += _double.pack(obj)
+    elif isinstance(obj, str):
+        data = obj.encode("utf-8")
+        _head(_STRING, len(data), out)
+        out += data
+    elif isinstance(obj, (bytes, bytearray, memoryview)):
+        out.append(0xD6)  # tag 22, binary
+        _head(_BYTES, len(obj), out)
+        out += obj
+    elif isinstance(obj, dict):
+        start = _start_envelope(out, 0xBF)
+        for k, v in obj.items():
+            _encode(str(k), out, default)
+            _encode(v, out, default)
+        _end_envelope(out, start)
+    elif isinstance(obj, (list, tuple)):
+        start = _start_envelope(out, 0x9F)
+        for v in obj:
+            _encode(v, out, default)
+        _end_envelope(out, start)
+    else:
+        _encode(default(obj), out, default)
+
+
+def _start_envelope(out: bytearray, container: int) -> int:
+    out += ENVELOPE_HEADER
+    out += b"\0\0\0\0"  # length, filled in by _end_envelope()
+    start = len(out)
+    out.append(container)
+    return start
+
+
+def _end_envelope(out: bytearray, start: int) -> None:
+    out.append(_BREAK)
+    out[start - 4 : start] = (len(out) - start).to_bytes(4, "big")
+
+
+def dumps(obj: Any) -> bytes:
+    """
+    Serialize a message (a dict) to chrome's CBOR.
+
+    Values CBOR has no type for are converted like they are for json.
+
+    Args:
+        obj: the message to serialize.
+
+    """
+    out = bytearray()
+    _encode(obj, out, _default)
+    return bytes(out)
+
+
+def _argument(data: bytes, pos: int, info: int) -> tuple[int, int]:
+    if info < 24:  # noqa: PLR2004 the cbor encoding
+        return info, pos
+    size = 1 << (info - 24)  # 24-27 are 1, 2, 4 and 8 bytes
+    if size > 8:  # noqa: PLR2004 the cbor encoding
+        raise ValueError(f"Unsupported additional information {info}.")
+    end = pos + size
+    if end > len(data):
+        raise ValueError("Truncated CBOR.")
+    return int.from_bytes(data[pos:end], "big"), end
+
+
+def _byte_string(data: bytes, pos: int) -> tuple[int, int]:
+    """Return where the contents of the byte string at pos start and end."""
+    initial = data[pos]
+    if initial >> 5 != _BYTES or initial & 0x1F == _INDEFINITE:
+        raise ValueError("Expected a definite length byte string.")
+    n, pos = _argument(data, pos + 1, initial & 0x1F)
+    if pos + n > len(data):
+        raise ValueError("Truncated CBOR.")
+    return pos, pos + n
+
+
+def _decode(data: bytes, pos: int) -> tuple[Any, int]:  # noqa: C901, PLR0911, PLR0912 it's a type switch
+    initial = data[pos]
+    major, info = initial >> 5, initial & 0x1F
+    pos += 1
+    if info == _INDEFINITE and major in (_ARRAY, _MAP):
+        items: list[Any] = []
+        while data[pos] != _BREAK:
+            item, pos = _decode(data, pos)
+            items.append(item)
+        pos += 1
+        if major == _ARRAY:
+            return items, pos
+        return dict(zip(items[::2], items[1::2])), pos
+    if major == _SIMPLE:
+        return _simple(data, pos, info)
+    n, pos = _argument(data, pos, info)
+    if major == _UNSIGNED:
+        return n, pos
+    elif major == _NEGATIVE:
+        return -1 - n, pos
+    elif major in (_BYTES, _STRING):
+        end = pos + n
+        if end > len(data):
+            raise ValueError("Truncated CBOR.")
+        # a byte string that isn't tagged binary is chrome's utf-16 string
+        return data[pos:end].decode("utf-8" if major == _STRING else "utf-16-le"), end
+    elif major == _ARRAY:
+        array = []
+        for _ in range(n):
+            item, pos = _decode(data, pos)
+            array.append(item)
+        return array, pos
+    elif major == _MAP:
+        mapping = {}
+        for _ in range(n):
+            key, pos = _decode(data, pos)
+            mapping[key], pos = _decode(data, pos)
+        return mapping, pos
+    # it's a tag, n is which one
+    elif n == _TAG_ENVELOPE:
+        start, end = _byte_string(data, pos)
+        value, inner_end = _decode(data, start)
+        if inner_end != end:
+            raise ValueError("Envelope length doesn't match its contents.")
+        return value, end
+    elif n in _TAGS_BINARY:
+        start, end = _byte_string(data, pos)
+        return data[start:end], end
+    return _decode(data, pos)  # a tag we don't know, use its item as is
+
+
+def _simple(data: bytes, pos: int, info: int) -> tuple[Any, int]:
+    if info == 20:  # noqa: PLR2004 the cbor encoding
+        return False, pos
+    elif info == 21:  # noqa: PLR2004 the cbor encoding
+        return True, pos
+    elif info in (22, 23):  # null, undefined
+        return None, pos
+    elif info == 25:  # noqa: PLR2004 the cbor encoding
+        return struct.unpack(">e", data[pos : pos + 2])[0], pos + 2
+    elif info == 26:  # noqa: PLR2004 the cbor encoding
+        return _single.unpack_from(data, pos)[0], pos + 4
+    elif info == 27:  # noqa: PLR2004 the cbor encoding
+        return _double.unpack_from(data, pos)[0], pos + 8
+    raise ValueError(f"Unsupported simple value {info}.")
+
+
+def _decode_all(data: bytes) -> Any:
+    value, end = _decode(data, 0)
+    if end != len(data):
+        raise ValueError("Trailing bytes after CBOR message.")
+    return value
+
+
+def loads(message: bytes) -> Any:
+    """
+    Deserialize a message in chrome's CBOR.
+
+    Args:
+        message: the whole message, envelope included.
+
+    Raises:
+        JSONError: if it isn't valid CBOR, the name is kept for the channels.
+
+    """
+    try:
+        return _decode_all(message)
+    except (ValueError, IndexError, struct.error) as e:
+        raise JSONError from e
@@ -0,0 +1,223 @@
+"""Provides an incremental framer to split a byte stream into messages."""
+
+from __future__ import annotations
+
+import os
+import struct
+
+import logistro
+
+from ._cbor import ENVELOPE_HEADER, ENVELOPE_HEADER_SIZE
+
+try:
+    import fcntl
+    import termios
+except ImportError:  # windows
+    fcntl = None  # type: ignore [assignment]
+    termios = None  # type: ignore [assignment]
+
+_logger = logistro.getLogger(__name__)
+
+_INITIAL_SIZE = 2**16
+"""Size of a freshly allocated buffer."""
+_MIN_READ = 2**16
+"""Smallest free space we offer to a read, even if less is available."""
+_MAX_IDLE_SIZE = 2**22
+"""An empty buffer bigger than this is given back to the allocator."""
+
+_with_readv = hasattr(os, "readv")
+
+
+def bytes_available(fd: int) -> int:
+    """
+    Return how many bytes can be read from fd without blocking, 0 if unknown.
+
+    Args:
+        fd: the file descriptor to ask about.
+
+    """
+    if fcntl is None or termios is None:
+        return 0
+    try:
+        raw = fcntl.ioctl(fd, termios.FIONREAD, b"\0\0\0\0")
+    except OSError:
+        return 0
+    return int(struct.unpack("i", raw)[0])
+
+
+class NulFramer:
+    """
+    NulFramer splits a stream of bytes into NUL-delimited frames.
+
+    Incoming bytes are written directly into the tail of a growable `bytearray`.
+    Delimiters are only searched for in bytes that haven't been searched yet,
+    and a partial frame stays in place until the rest of it arrives, so every
+    byte is copied once on the way in and once on the way out.
+    """
+
+    def __init__(self, initial_size: int = _INITIAL_SIZE) -> None:
+        """
+        Construct an empty framer.
+
+        Args:
+            initial_size: how many bytes to preallocate.
+
+        """
+        self._initial_size = initial_size
+        self._buffer = bytearray(initial_size)
+        self._start = 0  # first byte not yet returned in a frame
+        self._scan = 0  # first byte not yet searched for a delimiter
+        self._end = 0  # first byte not yet filled
+
+    @property
+    def pending_size(self) -> int:
+        """The number of bytes received which aren't part of a complete frame."""
+        return self._end - self._start
+
+    def pending(self) -> bytes:
+        """Return a copy of the bytes received which aren't part of a frame yet."""
+        return bytes(self._buffer[self._start : self._end])
+
+    def get_buffer(self, sizehint: int = 0) -> memoryview:
+        """
+        Return a writable view of the free space at the end of the buffer.
+
+        The view must be released (`with` or `.release()`) before the framer
+        is used again, and `buffer_updated()` must be called with the number
+        of bytes written into it.
+
+        Args:
+            sizehint: how many bytes the caller expects to write.
+
+        """
+        self._reserve(max(sizehint, _MIN_READ))
+        return memoryview(self._buffer)[self._end :]
+
+    def buffer_updated(self, nbytes: int) -> None:
+        """
+        Mark bytes written into the view from `get_buffer()` as received.
+
+        Args:
+            nbytes: how many bytes were written.
+
+        """
+        self._end += nbytes
+
+    def feed(self, data: bytes | bytearray | memoryview) -> None:
+        """
+        Copy data into the buffer, for callers that can't read in place.
+
+        Args:
+            data: the bytes received.
+
+        """
+        n = len(data)
+        self._reserve(n)
+        self._buffer[self._end : self._end + n] = data
+        self._end += n
+
+    def read_from(self, fd: int, size: int = 0) -> int:
+        """
+        Do one `os.read` (or `readv` in place) from fd into the buffer.
+
+        Args:
+            fd: the file descriptor to read.
+            size: how many bytes to try to read, by default what's available.
+
+        Returns:
+            The number of bytes read, 0 means EOF.
+
+        Raises:
+            BlockingIOError: if the fd is non-blocking and empty.
+            OSError: anything else the read raises.
+
+        """
+        size = size or bytes_available(fd)
+        if _with_readv:
+            with self.get_buffer(size) as view:
+                n = os.readv(fd, [view])
+            self.buffer_updated(n)
+            return n
+        data = os.read(fd, max(size, _MIN_READ))
+        self.feed(data)
+        return len(data)
+
+    def frames(self) -> list[bytes]:
+        """Remove and return all complete frames, without their delimiters."""
+        frames: list[bytes] = []
+        buffer = self._buffer
+        with memoryview(buffer) as view:
+            while True:
+                nul = buffer.find(b"\0", self._scan, self._end)
+                if nul < 0:
+                    self._scan = self._end
+                    break
+                if nul > self._start:
+                    frames.append(bytes(view[self._start : nul]))
+                self._start = self._scan = nul + 1
+        if self._start == self._end:
+            self._reset()
+        return frames
+
+    def _reset(self) -> None:
+        self._start = self._scan = self._end = 0
+        if len(self._buffer) > _MAX_IDLE_SIZE:
+            _logger.debug2(f"Releasing idle buffer of {len(self._buffer)} bytes.")
+            self._buffer = bytearray(self._initial_size)
+
+    def _reserve(self, n: int) -> None:
+        size = len(self._buffer)
+        if size - self._end >= n:
+            return
+        live = self._end - self._start
+        # moving the partial frame down is cheaper than growing if it's small
+        if self._start and live <= self._start and live + n <= size:
+            self._buffer[:live] = self._buffer[self._start : self._end]
+            self._scan -= self._start
+            self._start, self._end = 0, live
+            return
+        new_size = max(size * 2, self._end + n)
+        _logger.debug2(f"Growing read buffer from {size} to {new_size} bytes.")
+        self._buffer.extend(bytes(new_size - size))
+
+
+class EnvelopeFramer(NulFramer):
+    """
+    EnvelopeFramer splits a stream of CBOR envelopes into frames.
+
+    Chrome's CBOR messages aren't delimited, each starts with a 7-byte
+    header holding its length. Frames are returned whole, header included.
+    """
+
+    def frames(self) -> list[bytes]:
+        """
+        Remove and return all complete frames.
+
+        Raises:
+            ValueError: if the stream isn't at the start of an envelope.
+
+        """
+        frames: list[bytes] = []
+        missing = 0
+        buffer = self._buffer
+        with memoryview(buffer) as view:
+            while self._end - self._start >= ENVELOPE_HEADER_SIZE:
+                start = self._start
+                if buffer[start : start + len(ENVELOPE_HEADER)] != ENVELOPE_HEADER:
+                    raise ValueError(
+                        f"Expected a CBOR envelope, got {self.pending()[:16]!r}.",
+                    )
+                size = ENVELOPE_HEADER_SIZE + int.from_bytes(
+                    buffer[start + len(ENVELOPE_HEADER) : start + ENVELOPE_HEADER_SIZE],
+                    "big",
+                )
+                if self._end - start < size:
+                    missing = size - (self._end - start)
+                    break
+                frames.append(bytes(view[start : start + size]))
+                self._start = start + size
+        if self._start == self._end:
+            self._reset()
+        elif missing:  # make room for the rest now, not by doubling as it comes
+            self._reserve(missing)
+        return frames
@@ -0,0 +1,182 @@
+"""Provides `PipeHub`, one thread reading the pipes of many browsers."""
+
+from __future__ import annotations
+
+import os
+import platform
+import selectors
+import threading
+from typing import TYPE_CHECKING
+
+import logistro
+
+if TYPE_CHECKING:
+    from types import TracebackType
+    from typing import Any, Callable, Sequence
+
+    from typing_extensions import Self  # 3.9 needs this, could be from typing in 3.10
+
+    from choreographer.protocol import BrowserResponse
+
+    from .pipe import Pipe
+
+    _Callback = Callable[[Sequence[BrowserResponse]], Any]
+
+_logger = logistro.getLogger(__name__)
+
+
+class PipeHub:
+    """
+    PipeHub reads, frames and decodes the messages of many `Pipe`s, in one thread.
+
+    Without it, each sync reader blocks a thread of its own in `read_jsons()`.
+    With it, one thread waits on all the pipes with `selectors` (epoll on
+    linux) and calls each pipe's callback with its messages, nobody else
+    reads them. Writes stay with the writers.
+
+    It's for the sync api: pass it as `BrowserSync(hub=)`, or `add()` a pipe
+    yourself. Async browsers don't need it, their event loop already reads
+    all their pipes in one thread. Pipes leave it when they close, or when
+    the browser ends them: the hub lets go at once, and leaves closing them
+    to the event loop writing for them, if there's one. It's not for
+    windows, which can't select on pipes.
+    """
+
+    def __init__(self) -> None:
+        """
+        Construct a hub, its thread starts with the first pipe.
+
+        Raises:
+            NotImplementedError: on windows.
+
+        """
+        if platform.system() == "Windows":
+            raise NotImplementedError("Windows can't select on pipes.")
+        self._selector = selectors.DefaultSelector()
+        # reentrant: a pipe that closes while the hub reads it removes itself
+        self._lock = threading.RLock()
+        self._pipes: dict[int, tuple[Pipe, _Callback]] = {}
+        self._thread: threading.Thread | None = None
+        self._closed = False
+        # written to, to get the thread out of select()
+        self._wake_read, self._wake_write = os.pipe()
+        os.set_blocking(self._wake_read, False)
+        os.set_blocking(self._wake_write, False)
+        self._selector.register(self._wake_read, selectors.EVENT_READ)
+
+    def __len__(self) -> int:
+        """Return how many pipes it reads."""
+        return len(self._pipes)
+
+    def add(self, pipe: Pipe, callback: _Callback) -> None:
+        """
+        Have the hub read a pipe, its `read_jsons()` can't be used meanwhile.
+
+        Args:
+            pipe: the pipe, not yet read from with an event loop.
+            callback: called in the hub's thread with each list of jsons the
+                pipe has. It mustn't block, the other pipes wait for it.
+
+        Raises:
+            RuntimeError: if the hub is closed.
+            ValueError: if the pipe is closed, or already read by a hub or a loop.
+
+        """
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("The hub is closed.")
+            if pipe.shutdown_lock.locked():
+                raise ValueError("The pipe is closed.")
+            if pipe._hub is not None:  # noqa: SLF001 hubs and pipes work together
+                raise ValueError("The pipe is already read by a hub.")
+            if pipe._loop is not None:  # noqa: SLF001
+                raise ValueError("The pipe is already read by an event loop.")
+            fd = pipe._read_from_browser  # noqa: SLF001
+            os.set_blocking(fd, False)
+            pipe._hub = self  # noqa: SLF001
+            self._pipes[fd] = (pipe, callback)
+            self._selector.register(fd, selectors.EVENT_READ, pipe)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run,
+                    name="choreographer-hub",
+                    daemon=True,
+                )
+                self._thread.start()
+        _logger.debug(f"Hub reading {len(self._pipes)} pipes.")
+        self._wake()
+
+    def remove(self, pipe: Pipe) -> None:
+        """
+        Stop reading a pipe, `Pipe.close()` does it before closing its fds.
+
+        Args:
+            pipe: the pipe, nothing happens if the hub isn't reading it.
+
+        """
+        with self._lock:
+            fd = pipe._read_from_browser  # noqa: SLF001 hubs and pipes work together
+            entry = self._pipes.get(fd)
+            if entry is None or entry[0] is not pipe:
+                return
+            del self._pipes[fd]
+            self._selector.unregister(fd)
+            pipe._hub_detached()  # noqa: SLF001
+        self._wake()
+
+    def _wake(self) -> None:
+        try:
+            os.write(self._wake_write, b"\0")
+        except OSError:  # full (it'll wake anyway), or closed
+            pass
+
+    def _drain_wake(self) -> None:
+        try:
+            while os.read(self._wake_read, 4096):
+                pass
+        except OSError:  # empty, BlockingIOError
+            pass
+
+    def _run(self) -> None:
+        _logger.debug("Hub thread started.")
+        while not self._closed:
+            events = self._selector.select()
+            # under the lock, so a pipe isn't read after it's removed
+            with self._lock:
+                for key, _ in events:
+                    if key.data is None:
+                        self._drain_wake()
+                        continue
+                    entry = self._pipes.get(key.fd)
+                    if entry is not None and entry[0] is key.data:
+                        pipe, callback = entry
+                        pipe._on_hub_readable(callback)  # noqa: SLF001
+        _logger.debug("Hub thread stopped.")
+
+    def close(self) -> None:
+        """Stop the thread, the pipes it was reading go back to reading alone."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            for pipe, _ in list(self._pipes.values()):
+                self.remove(pipe)
+        self._wake()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._selector.close()
+        os.close(self._wake_read)
+        os.close(self._wake_write)
+
+    def __enter__(self) -> Self:
+        """Use the hub, it's closed on exit."""
+        return self
+
+    def __exit__(
+        self,
+        type_: type[BaseException] | None,
+        value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        """Close the hub."""
+        self.close()
@@ -32,5 +32,26 @@ class ChannelInterface(Protocol):
 
         """
 
+    async def write_json_async(self, obj: Mapping[str, Any]) -> None:
+        """
+        Accept an object and send it down the channel without blocking the loop.
+
+        Args:
+            obj: the object to send to the browser.
+
+        """
+
+    async def write_jsons_async(self, objs: Sequence[Mapping[str, Any]]) -> None:
+        """
+        Accept several objects and send them down the channel together.
+
+        Args:
+            objs: the objects to send to the browser, in order.
+
+        """
+
+    async def read_jsons_async(self) -> Sequence[BrowserResponse]:
+        """Wait for jsons without blocking the loop and return the complete ones."""
+
     def close(self) -> None:
         """Close the channel."""
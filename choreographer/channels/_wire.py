@@ -1,52 +1,610 @@
+"""
+Provides the json (de)serialization used on the wire.
+
+Several json libraries can do the work, the fastest one installed is picked at
+import time. Set the `CHOREO_JSON_CODEC` environment variable or call
+`use_codec()` to choose one explicitly. They all produce the same json:
+compact separators, no ascii escaping, NaN and Infinity as `null`,
+and numpy/datetime values converted. (ujson writes some float exponents
+differently, `1e-7` instead of `1e-07`, otherwise the bytes match too.)
+
+Only orjson (3.9+) writes numeric numpy arrays straight from their buffers,
+the speedup is only there: the other codecs convert arrays to lists first.
+"""
+
 from __future__ import annotations
 
-from typing import TYPE_CHECKING
+import base64
+import json
+import math
+import os
+import re
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, MutableMapping
 
 import logistro
-import simplejson
-from simplejson.errors import JSONDecodeError
 
 from ._errors import JSONError
 
 if TYPE_CHECKING:
-    from typing import Any
+    from _collections_abc import dict_items, dict_values
+    from typing import Callable, Iterator, Sequence
 
 _logger = logistro.getLogger(__name__)
 
+_separators = (",", ":")
+
+_typed_array_dtypes = frozenset(
+    ("i1", "u1", "i2", "u2", "i4", "u4", "i8", "u8", "f4", "f8"),
+)
+"""The numpy dtypes, as kind and size, that have a javascript typed array."""
+
+_typed_array_shim = (
+    Path(__file__).resolve().parent.parent / "resources" / "typed_arrays.js"
+)
+
+
+def _isoformat(obj: Any) -> Any:
+    return obj.isoformat()
+
+
+def _unknown(obj: Any) -> Any:
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class _Converter:
+    """
+    Convert the types json libraries don't know about, or raise TypeError.
+
+    How to convert is decided once per type and kept in a table, so the
+    `hasattr()` checks don't run for every object.
+    """
+
+    def __init__(
+        self,
+        *,
+        nulls_nan: bool = False,
+        numeric_array: Callable[[Any], Any] | None = None,
+    ) -> None:
+        """
+        Construct a converter for one codec.
+
+        Args:
+            nulls_nan: the codec writes NaN and Infinity as null itself.
+            numeric_array: converts a contiguous numeric array to something
+                the codec embeds directly, if it has a faster route than lists.
+
+        """
+        self._nulls_nan = nulls_nan
+        self._numeric_array = numeric_array
+        self._handlers: MutableMapping[type, Callable[[Any], Any]] = {}
+
+    def __call__(self, obj: Any) -> Any:
+        cls = type(obj)
+        handler = self._handlers.get(cls)
+        if handler is None:
+            handler = self._handlers[cls] = self._find_handler(cls)
+        return handler(obj)
+
+    def _find_handler(self, cls: type) -> Callable[[Any], Any]:
+        if cls is _Body:  # a LazyMessage's, read by a codec from its storage
+            return _Body.parse
+        elif issubclass(cls, MutableMapping):
+            return dict
+        elif hasattr(cls, "dtype") and hasattr(cls, "shape"):
+            if hasattr(cls, "to_numpy"):  # pandas Series and Index
+                return self._pandas
+            return self._array
+        elif hasattr(cls, "isoformat"):
+            return _isoformat
+        return _unknown
 
-class MultiEncoder(simplejson.JSONEncoder):
-    """Special json encoder for numpy types."""
+    def _pandas(self, obj: Any) -> Any:
+        return self._array(obj.to_numpy())
 
-    def default(self, obj: Any) -> Any:
-        if hasattr(obj, "dtype") and obj.dtype.kind == "i" and obj.shape == ():
+    def _scalar(self, obj: Any) -> Any:
+        kind = obj.dtype.kind
+        if kind in "iu":
             return int(obj)
-        elif hasattr(obj, "dtype") and obj.dtype.kind == "f" and obj.shape == ():
+        elif kind == "f":
             return float(obj)
-        elif hasattr(obj, "dtype") and obj.shape != ():
-            return obj.tolist()
+        elif kind == "b":
+            return bool(obj)
         elif hasattr(obj, "isoformat"):
             return obj.isoformat()
-        return simplejson.JSONEncoder.default(self, obj)
+        return _unknown(obj)
 
+    def _array(self, arr: Any) -> Any:
+        if arr.shape == ():  # numpy scalars, 0-d arrays
+            return self._scalar(arr)
+        dtype = arr.dtype
+        kind = dtype.kind
+        # float32 and float16 go by lists: as doubles, they print like the
+        # other codecs print them
+        if self._numeric_array and (kind in "iub" or dtype.str[1:] == "f8"):
+            if not dtype.isnative:  # orjson only reads native byte order
+                arr = arr.astype(dtype.newbyteorder("="))
+            if not arr.flags.c_contiguous:
+                arr = arr.copy(order="C")
+            return self._numeric_array(arr)
+        elif kind == "f" and not self._nulls_nan:
+            return _floats_to_list(arr)
+        elif kind == "M":
+            return _datetimes_to_list(arr)
+        return arr.tolist()
 
-def serialize(obj: Any) -> bytes:
-    try:
-        message = simplejson.dumps(
-            obj,
+
+def _floats_to_list(arr: Any) -> list[Any]:
+    """Convert a float array to a list, with NaN and Infinity masked to None."""
+    import numpy as np  # noqa: PLC0415 we were given an array, so it's there
+
+    return _masked_list(arr.tolist(), ~np.isfinite(arr))
+
+
+def _datetimes_to_list(arr: Any) -> list[Any]:
+    """Convert a datetime64 array to a list of iso strings, with NaT as None."""
+    import numpy as np  # noqa: PLC0415 we were given an array, so it's there
+
+    return _masked_list(np.datetime_as_string(arr).tolist(), np.isnat(arr))
+
+
+def _masked_list(nested: Any, mask: Any) -> list[Any]:
+    """
+    Set a `tolist()`'s items to None where the mask is True.
+
+    Only those items are touched, there's no copy of the array as objects.
+    """
+    if mask.any():
+        for *outer, last in zip(*mask.nonzero()):
+            row = nested
+            for i in outer:
+                row = row[i]
+            row[last] = None
+    return nested  # type: ignore [no-any-return]
+
+
+def _sanitize(obj: Any, default: Callable[[Any], Any]) -> Any:
+    """Return a copy of obj with everything converted and non-finite floats None."""
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    elif isinstance(obj, (str, int)) or obj is None:
+        return obj
+    elif isinstance(obj, dict):
+        return {k: _sanitize(v, default) for k, v in obj.items()}
+    elif isinstance(obj, (list, tuple)):
+        return [_sanitize(v, default) for v in obj]
+    return _sanitize(default(obj), default)
+
+
+class Codec:
+    """Codec is the json library interface, the base is built on the stdlib."""
+
+    name = "json"
+
+    def __init__(self) -> None:
+        """Construct the codec."""
+        self._default = _Converter()
+
+    def dumps(self, obj: Any) -> bytes:
+        """
+        Serialize obj to utf-8 json.
+
+        Args:
+            obj: the object to serialize.
+
+        """
+        try:
+            message = json.dumps(
+                obj,
+                ensure_ascii=False,
+                allow_nan=False,
+                separators=_separators,
+                default=self._default,
+            )
+        except ValueError:  # NaN or Infinity, the stdlib can't null them
+            message = json.dumps(
+                _sanitize(obj, self._default),
+                ensure_ascii=False,
+                allow_nan=False,
+                separators=_separators,
+            )
+        return message.encode("utf-8")
+
+    def loads(self, message: str | bytes) -> Any:
+        """
+        Deserialize json.
+
+        Args:
+            message: the json to deserialize.
+
+        """
+        return json.loads(message)
+
+
+class SimplejsonCodec(Codec):
+    """A codec using simplejson."""
+
+    name = "simplejson"
+
+    def __init__(self) -> None:
+        """Construct the codec, raises ImportError if simplejson is missing."""
+        import simplejson  # noqa: PLC0415 optional dependency
+
+        self._simplejson = simplejson
+        self._default = _Converter(nulls_nan=True)
+        self._encoder = simplejson.JSONEncoder(
             ensure_ascii=False,
             ignore_nan=True,
-            cls=MultiEncoder,
+            separators=_separators,
+            default=self._default,
         )
-    except JSONDecodeError as e:
-        raise JSONError from e
-    _logger.debug(f"Serialized: {message[:15]}...{message[-15:]}, size: {len(message)}")
-    _logger.debug2(f"Whole message: {message}")
 
-    return message.encode("utf-8")
+    def dumps(self, obj: Any) -> bytes:
+        return self._encoder.encode(obj).encode("utf-8")
+
+    def loads(self, message: str | bytes) -> Any:
+        return self._simplejson.loads(message)
+
+
+class UjsonCodec(Codec):
+    """A codec using ujson, it falls back to the stdlib for NaN and Infinity."""
+
+    name = "ujson"
+
+    def __init__(self) -> None:
+        """Construct the codec, raises ImportError if ujson is missing."""
+        import ujson  # noqa: PLC0415 optional dependency
+
+        self._ujson = ujson
+        self._default = _Converter()
+
+    def dumps(self, obj: Any) -> bytes:
+        try:
+            message = self._ujson.dumps(
+                obj,
+                ensure_ascii=False,
+                escape_forward_slashes=False,
+                allow_nan=False,
+                default=self._default,
+            )
+        except (OverflowError, ValueError):  # NaN, Infinity, or a bigint
+            return super().dumps(obj)
+        return message.encode("utf-8")  # type: ignore [no-any-return]
+
+    def loads(self, message: str | bytes) -> Any:
+        return self._ujson.loads(message)
+
+
+class OrjsonCodec(Codec):
+    """
+    A codec using orjson.
+
+    Where orjson can embed pre-serialized json (`orjson.Fragment`, 3.9+),
+    integer, boolean and float64 numpy arrays are serialized straight from
+    their buffers. Datetime arrays never take that route: some orjson
+    versions crash on NaT.
+    """
+
+    name = "orjson"
+
+    def __init__(self) -> None:
+        """Construct the codec, raises ImportError if orjson is missing."""
+        import orjson  # noqa: PLC0415 optional dependency
+
+        self._orjson = orjson
+        self._fragment = getattr(orjson, "Fragment", None)
+        self._default = _Converter(
+            nulls_nan=True,
+            numeric_array=self._numeric_array if self._fragment else None,
+        )
+        self._options = orjson.OPT_NON_STR_KEYS
+        self._stdlib = Codec()  # for what orjson can't do, it can't take fragments
+
+    def _numeric_array(self, arr: Any) -> Any:
+        return self._fragment(  # type: ignore [misc]
+            self._orjson.dumps(arr, option=self._orjson.OPT_SERIALIZE_NUMPY),
+        )
+
+    def dumps(self, obj: Any) -> bytes:
+        try:
+            return self._orjson.dumps(  # type: ignore [no-any-return]
+                obj,
+                default=self._default,
+                option=self._options,
+            )
+        except self._orjson.JSONEncodeError:  # a bigint, for example
+            return self._stdlib.dumps(obj)
+
+    def loads(self, message: str | bytes) -> Any:
+        return self._orjson.loads(message)
+
 
+_registry: MutableMapping[str, Callable[[], Codec]] = {
+    "orjson": OrjsonCodec,
+    "ujson": UjsonCodec,
+    "simplejson": SimplejsonCodec,
+    "json": Codec,
+}
+"""All known codecs, fastest first."""
 
-def deserialize(message: str) -> Any:
+
+def register_codec(name: str, factory: Callable[[], Codec]) -> None:
+    """
+    Make a codec available to `use_codec()`.
+
+    Args:
+        name: the name to use it by.
+        factory: called without arguments to build the codec, may raise ImportError.
+
+    """
+    _registry[name] = factory
+
+
+def available_codecs() -> Sequence[str]:
+    """Return the names of the codecs that can be used here, fastest first."""
+    names = []
+    for name, factory in _registry.items():
+        try:
+            factory()
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+
+def use_codec(name: str | None = None) -> Codec:
+    """
+    Choose the json library used to (de)serialize messages.
+
+    Args:
+        name: one of `available_codecs()`, None picks the fastest.
+
+    Returns:
+        The codec now in use.
+
+    """
+    global _codec  # noqa: PLW0603 it's the module's setting
+    if name:
+        if name not in _registry:
+            raise ValueError(f"Unknown codec {name}, choose from {list(_registry)}.")
+        _codec = _registry[name]()
+    else:
+        _codec = _registry[available_codecs()[0]]()
+    _logger.debug(f"Using {_codec.name} to (de)serialize.")
+    return _codec
+
+
+def get_codec() -> Codec:
+    """Return the codec in use."""
+    return _codec
+
+
+_codec: Codec
+use_codec(os.environ.get("CHOREO_JSON_CODEC"))
+
+
+def encode_typed_arrays(obj: Any) -> Any:
+    """
+    Return a copy of obj with its numeric arrays replaced by typed-array blobs.
+
+    A blob is `{"dtype": "f8", "bdata": <base64>, "shape": [rows, ...]}`, the
+    array's little-endian bytes. It's around 60% the size of the json text of
+    floats, and the page rebuilds it as a typed array with no number parsing,
+    see `typed_array_shim()`. Arrays javascript has no typed array for are
+    left to the usual conversion.
+
+    Args:
+        obj: the params (or any part of a message) to encode.
+
+    """
+    if isinstance(obj, dict):
+        return {k: encode_typed_arrays(v) for k, v in obj.items()}
+    elif isinstance(obj, (list, tuple)):
+        return [encode_typed_arrays(v) for v in obj]
+    elif not (hasattr(obj, "dtype") and hasattr(obj, "shape")):
+        return obj
+    if hasattr(obj, "to_numpy"):  # pandas Series and Index
+        obj = obj.to_numpy()
+    dtype = f"{obj.dtype.kind}{obj.dtype.itemsize}"
+    if obj.shape == () or dtype not in _typed_array_dtypes:
+        return obj
+    little = obj.astype(obj.dtype.newbyteorder("<"), order="C", copy=False)
+    return {
+        "dtype": dtype,
+        "bdata": base64.b64encode(little.data).decode("ascii"),
+        "shape": list(obj.shape),
+    }
+
+
+def typed_array_shim() -> str:
+    """
+    Return the javascript that rebuilds typed-array blobs in the page.
+
+    Evaluating it defines `choreoDecodeTypedArrays(obj)`, which returns obj with
+    the blobs made by `encode_typed_arrays()` replaced by typed arrays.
+    """
+    return _typed_array_shim.read_text()
+
+
+def serialize(obj: Any) -> bytes:
+    message = _codec.dumps(obj)
+    _logger.debug(
+        f"Serialized: {message[:15]!r}...{message[-15:]!r}, size: {len(message)}",
+    )
+    if _logger.isEnabledFor(logistro.DEBUG2):
+        _logger.debug2(f"Whole message: {message!r}")
+    return message
+
+
+def deserialize(message: str | bytes) -> Any:
     try:
-        return simplejson.loads(message)
-    except simplejson.errors.JSONDecodeError as e:
+        return _codec.loads(message)
+    except ValueError as e:  # all their decode errors are ValueErrors
         raise JSONError from e
+
+
+# Chrome writes every message in one of two shapes, keys in this order:
+# {"id":N,"result"|"error":{...}[,"sessionId":"..."]}
+# {"method":"...","params":{...}[,"sessionId":"..."]}
+# Plain bytes methods find them faster than regular expressions do.
+_response_head = re.compile(rb'\{"id":(\d+),"(result|error)":')
+_event_head = b'{"method":"'
+_event_body = b'","params":'
+_session_tail = b',"sessionId":"'
+_session_tail_max = 128
+
+
+class _Body:
+    """Stands in for a `LazyMessage`'s body until it's parsed."""
+
+    __slots__ = ("key", "raw")
+
+    def __init__(self, key: str, raw: bytes) -> None:
+        self.key = key
+        self.raw = raw
+
+    def parse(self) -> Any:
+        return deserialize(self.raw)[self.key]
+
+
+class LazyMessage(Dict[str, Any]):
+    """
+    A message from the browser, a dict whose body is only parsed when it's read.
+
+    The envelope (`id` or `method`, and `sessionId`) is read without parsing,
+    `result`, `error`, or `params` are parsed the first time one is accessed,
+    or the values are read in any other way (`items()`, `==`, `dict()`,
+    `json.dumps()`). Serializers that read a dict's storage directly, like
+    orjson, get the body parsed by the `default` function, as choreographer's
+    codecs do.
+    """
+
+    __slots__ = ("_body_key",)
+
+    def __init__(self, envelope: dict[str, Any], body_key: str, raw: bytes) -> None:
+        """
+        Construct a message from its envelope and raw json.
+
+        Args:
+            envelope: the message's keys other than the body.
+            body_key: the key the body is under.
+            raw: the whole message.
+
+        """
+        items = list(envelope.items())
+        items.insert(1, (body_key, _Body(body_key, raw)))  # chrome's order
+        super().__init__(items)
+        self._body_key = body_key
+
+    @property
+    def parsed(self) -> bool:
+        """Return True if the body has been parsed."""
+        return type(dict.get(self, self._body_key)) is not _Body
+
+    def _parse(self) -> None:
+        body = dict.get(self, self._body_key)
+        if type(body) is _Body:
+            dict.__setitem__(self, self._body_key, body.parse())
+
+    def __getitem__(self, key: str) -> Any:
+        value = dict.__getitem__(self, key)
+        if type(value) is _Body:
+            self._parse()
+            return dict.__getitem__(self, key)
+        return value
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value = dict.get(self, key, default)
+        if type(value) is _Body:
+            self._parse()
+            return dict.__getitem__(self, key)
+        return value
+
+    # the rest parse first, then the dict's own methods see the whole message
+
+    def __iter__(self) -> Iterator[str]:
+        # not dict's, so dict(message) and {**message} use the methods here
+        return dict.__iter__(self)
+
+    def items(self) -> dict_items[str, Any]:
+        self._parse()
+        return dict.items(self)
+
+    def values(self) -> dict_values[str, Any]:
+        self._parse()
+        return dict.values(self)
+
+    def copy(self) -> dict[str, Any]:
+        self._parse()
+        return dict(dict.items(self))
+
+    def pop(self, key: str, *default: Any) -> Any:
+        self._parse()
+        return dict.pop(self, key, *default)
+
+    def popitem(self) -> tuple[str, Any]:
+        self._parse()
+        return dict.popitem(self)
+
+    def setdefault(self, key: str, default: Any = None) -> Any:
+        self._parse()
+        return dict.setdefault(self, key, default)
+
+    def __eq__(self, other: object) -> bool:
+        self._parse()
+        if isinstance(other, LazyMessage):
+            other._parse()
+        return dict.__eq__(self, other)
+
+    def __ne__(self, other: object) -> bool:
+        return not self == other
+
+    __hash__ = None  # type: ignore [assignment]
+
+    def __repr__(self) -> str:
+        self._parse()
+        return dict.__repr__(self)
+
+    def __reduce__(self) -> tuple[Any, ...]:
+        # pickle and copy get a plain dict
+        return (dict, (self.copy(),))
+
+
+def deserialize_lazy(message: bytes) -> Any:
+    """
+    Deserialize a message from the browser, leaving its body for later.
+
+    Messages that aren't in chrome's usual shape are deserialized right away.
+
+    Args:
+        message: the json to deserialize.
+
+    Returns:
+        A `LazyMessage`, or whatever `deserialize()` returns.
+
+    """
+    if message.startswith(_event_head):
+        end = message.find(b'"', len(_event_head))
+        method = message[len(_event_head) : end]
+        if not message.startswith(_event_body, end) or b"\\" in method:
+            return deserialize(message)
+        envelope: dict[str, Any] = {"method": method.decode()}
+        body_key = "params"
+    else:
+        head = _response_head.match(message)
+        if not head:
+            return deserialize(message)
+        envelope = {"id": int(head.group(1))}
+        body_key = "result" if head.group(2) == b"result" else "error"
+    tail = message.rfind(_session_tail, max(0, len(message) - _session_tail_max))
+    session_id = message[tail + len(_session_tail) : -2]
+    if (
+        tail != -1
+        and message.endswith(b'"}')
+        and b'"' not in session_id
+        and b"\\" not in session_id
+    ):
+        envelope["sessionId"] = session_id.decode()
+    elif b'"sessionId"' in message:  # can't tell if it's at the top
+        return deserialize(message)
+    return LazyMessage(envelope, body_key, message)
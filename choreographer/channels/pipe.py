@@ -2,28 +2,67 @@
 
 from __future__ import annotations
 
+import asyncio
 import os
 import platform
+import select
 import sys
 import warnings
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from threading import Lock
 from typing import TYPE_CHECKING
 
 import logistro
 
+from choreographer.utils._executor import run_blocking
+
+from . import _cbor as cbor
 from . import _wire as wire
 from ._errors import BlockWarning, ChannelClosedError, JSONError
+from ._framing import EnvelopeFramer, NulFramer
 
 if TYPE_CHECKING:
-    from typing import Any, Mapping, Sequence
+    from typing import Any, Callable, Mapping, Sequence
 
     from choreographer.protocol import BrowserResponse
 
+    from ._hub import PipeHub
+
 _with_block = bool(sys.version_info[:3] >= (3, 12) or platform.system() != "Windows")
+# windows event loops can't watch pipes, they'll use the executor instead
+_with_loop_io = platform.system() != "Windows"
+
+_with_writev = hasattr(os, "writev")
+try:
+    _iov_max = os.sysconf("SC_IOV_MAX") if _with_writev else 1
+except (ValueError, OSError):
+    _iov_max = 1024
+if _iov_max <= 0:
+    _iov_max = 1024
+
+_bye = b"{bye}\n"
+
+_wire_formats = ("json", "cbor")
 
 _logger = logistro.getLogger(__name__)
 
 
+def _drop_written(
+    buffers: list[bytes | memoryview],
+    n: int,
+) -> list[bytes | memoryview]:
+    """Return what's left of buffers after n bytes of them have been written."""
+    i = 0
+    while n and n >= len(buffers[i]):
+        n -= len(buffers[i])
+        i += 1
+    rest = buffers[i:]
+    if n:
+        rest[0] = memoryview(rest[0])[n:]
+    return rest
+
+
 # if we're a pipe we expect these public attributes
 class Pipe:
     """Defines an operating system pipe."""
@@ -34,9 +73,24 @@ class Pipe:
     """Consumers needs this, it is the channel choreo writes to the browser on."""
     shutdown_lock: Lock
     """Once this is locked, the pipe is closed and can't be reopened."""
+    wire_format: str
+    """How messages are encoded, "json" (NUL-delimited) or "cbor" (enveloped)."""
 
-    def __init__(self) -> None:
-        """Construct a pipe using os functions."""
+    def __init__(self, wire_format: str = "json") -> None:
+        """
+        Construct a pipe using os functions.
+
+        Args:
+            wire_format: "json", or "cbor" to exchange chrome's binary format,
+                which carries binary data (screenshots, pdfs) as bytes, not base64.
+
+        """
+        if wire_format not in _wire_formats:
+            raise ValueError(
+                f"Unknown wire_format {wire_format}, choose from {_wire_formats}.",
+            )
+        self.wire_format = wire_format
+        self._cbor = wire_format == "cbor"
         # This is where pipe listens (from browser)
         # So pass the write to browser
         self._read_from_browser, self._write_from_browser = list(os.pipe())
@@ -58,6 +112,21 @@ class Pipe:
         # this is just a convenience to prevent multiple shutdowns
         self.shutdown_lock = Lock()  # should be private
 
+        # holds what we've read but haven't returned yet
+        self._framer = EnvelopeFramer() if self._cbor else NulFramer()
+
+        # only used once an event loop starts doing our i/o, see _attach()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._ready_frames: list[bytes] = []
+        self._read_waiter: asyncio.Future[None] | None = None
+        self._read_error: BaseException | None = None
+        self._write_waiter: asyncio.Future[None] | None = None
+        # where the loop can't watch pipes, reads block a thread of their own
+        self._read_thread: ThreadPoolExecutor | None = None
+
+        # only set while a PipeHub reads for us, see _on_hub_readable()
+        self._hub: PipeHub | None = None
+
     def write_json(self, obj: Mapping[str, Any]) -> None:
         """
         Send one json down the pipe.
@@ -68,26 +137,43 @@ class Pipe:
         """
         if self.shutdown_lock.locked():
             raise ChannelClosedError
-        encoded_message = wire.serialize(obj) + b"\0"
+        self._write_all(self._encode([obj]))
+
+    def _encode(self, objs: Sequence[Mapping[str, Any]]) -> list[bytes | memoryview]:
+        buffers: list[bytes | memoryview] = []
+        for obj in objs:
+            if self._cbor:  # envelopes carry their length, no delimiter
+                buffers.append(cbor.dumps(obj))
+            else:
+                buffers.append(wire.serialize(obj))
+                buffers.append(b"\0")
+        if not _with_writev:
+            buffers = [b"".join(buffers)]
         _logger.debug(
-            f"Writing message {encoded_message[:15]!r}...{encoded_message[-15:]!r}, "
-            f"size: {len(encoded_message)}.",
+            f"Writing {len(objs)} messages, size: {sum(len(b) for b in buffers)}.",
         )
-        _logger.debug2(f"Full Message: {encoded_message!r}")
+        return buffers
+
+    def _write_some(self, buffers: Sequence[bytes | memoryview]) -> int:
+        if _with_writev:
+            return os.writev(self._write_to_browser, buffers[:_iov_max])
+        return os.write(self._write_to_browser, buffers[0])
+
+    def _write_all(self, buffers: list[bytes | memoryview]) -> None:
         try:
-            ret = os.write(self._write_to_browser, encoded_message)
-            _logger.debug(
-                f"***Wrote {ret}/{len(encoded_message)}***",
-            )
-            if ret != len(encoded_message):
-                _logger.critical(
-                    f"***Did not write entire message. {ret}/{len(encoded_message)}***",
-                )
+            while buffers:
+                try:
+                    n = self._write_some(buffers)
+                except BlockingIOError:  # fd belongs to an event loop
+                    select.select([], [self._write_to_browser], [])
+                    continue
+                _logger.debug2(f"Wrote {n} bytes.")
+                buffers = _drop_written(buffers, n)
         except OSError as e:
             self.close()
             raise ChannelClosedError from e
 
-    def read_jsons(  # noqa: PLR0912, PLR0915, C901 branches, complexity
+    def read_jsons(  # noqa: C901 complexity
         self,
         *,
         blocking: bool = True,
@@ -95,80 +181,365 @@ class Pipe:
         """
         Read from the pipe and return one or more jsons in a list.
 
+        Messages are returned as soon as they are complete, a partial message
+        is kept and finished on the next call.
+
         Args:
             blocking: The read option can be set to block or not.
 
         Returns:
             A list of jsons.
 
+        Raises:
+            RuntimeError: if a `PipeHub` reads the pipe, its callback gets them.
+
         """
         if self.shutdown_lock.locked():
             raise ChannelClosedError
+        if self._hub is not None:
+            raise RuntimeError("A hub reads the pipe, its callback gets the jsons.")
         if not _with_block and not blocking:
             warnings.warn(  # noqa: B028
                 "Windows python version < 3.12 does not support non-blocking",
                 BlockWarning,
             )
-        jsons: list[BrowserResponse] = []
         try:
             if _with_block:
                 os.set_blocking(self._read_from_browser, blocking)
         except OSError as e:
             self.close()
             raise ChannelClosedError from e
+        loop_count = 0
         try:
-            loop_count = 1
-            raw_buffer = None  # if we fail in read, we already defined
-            raw_buffer = os.read(
-                self._read_from_browser,
-                10000,
-            )  # 10MB buffer, nbd, doesn't matter w/ this
-            _logger.debug(
-                f"First read in loop: {raw_buffer[:15]!r}...{raw_buffer[-15:]!r}. "
-                f"size: {len(raw_buffer)}.",
-            )
-            _logger.debug2(f"Whole buffer: {raw_buffer!r}")
-            if not raw_buffer or raw_buffer == b"{bye}\n":
-                if raw_buffer:
-                    _logger.debug(f"Received {raw_buffer!r}. is bye?")
-                # we seem to need {bye} even if chrome closes NOTE
-                self.close()
-                raise ChannelClosedError
-            while raw_buffer[-1] != 0:
-                _logger.debug("Partial message from browser received.")
+            frames = self._take_frames()
+            while not frames:
+                self._check_for_bye()
                 loop_count += 1
-                if _with_block:
-                    os.set_blocking(self._read_from_browser, True)
-                raw_buffer += os.read(self._read_from_browser, 10000)
+                self._read_more()
+                frames = self._take_frames()
+                if not frames and self._framer.pending_size:
+                    _logger.debug("Partial message from browser received.")
+                    # finish the message we started
+                    if _with_block and not blocking:
+                        os.set_blocking(self._read_from_browser, True)
         except BlockingIOError:
             _logger.debug("BlockingIOError")
-            return jsons
+            return []
+        except ChannelClosedError:
+            self.close()
+            raise
         except OSError as e:
             _logger.debug("OSError")
             self.close()
-            if not raw_buffer or raw_buffer == b"{bye}\n":
-                raise ChannelClosedError from e
-            # this could be hard to test as it is a real OS corner case
+            raise ChannelClosedError from e
         finally:
             _logger.debug(
                 f"Total loops: {loop_count}, "
-                f"Final size: {len(raw_buffer) if raw_buffer else 0}.",
+                f"Carrying over: {self._framer.pending_size} bytes.",
             )
-            _logger.debug2(f"Whole buffer: {raw_buffer!r}")
-        decoded_buffer = raw_buffer.decode("utf-8")
-        raw_messages = decoded_buffer.split("\0")
-        _logger.debug(f"Received {len(raw_messages)} raw_messages.")
-        for raw_message in raw_messages:
-            if raw_message:
-                try:
-                    jsons.append(wire.deserialize(raw_message))
-                except JSONError:
-                    _logger.exception("JSONError decoding message. Ignoring")
-                except:
-                    _logger.exception("Error in trying to decode JSON off our read.")
-                    raise
+        _logger.debug(f"Received {len(frames)} raw_messages.")
+        return self._decode_frames(frames)
+
+    # these raise ChannelClosedError, the caller closes, on its side
+
+    def _read_more(self) -> None:
+        if not self._framer.read_from(self._read_from_browser):
+            _logger.debug("Read EOF from browser.")
+            raise ChannelClosedError
+
+    def _take_frames(self) -> list[bytes]:
+        try:
+            return self._framer.frames()
+        except ValueError as e:  # lost track of where messages start
+            _logger.exception("Couldn't frame messages from browser.")
+            raise ChannelClosedError from e
+
+    def _check_for_bye(self) -> None:
+        # the wrapper prints {bye} when chrome closes without closing the pipe
+        if self._framer.pending_size == len(_bye) and self._framer.pending() == _bye:
+            _logger.debug(f"Received {_bye!r}. is bye?")
+            raise ChannelClosedError
+
+    def _decode_frames(
+        self,
+        frames: Sequence[bytes],
+        *,
+        lazy: bool = False,
+    ) -> list[BrowserResponse]:
+        if self._cbor:
+            deserialize = cbor.loads
+        else:
+            deserialize = wire.deserialize_lazy if lazy else wire.deserialize
+        jsons: list[BrowserResponse] = []
+        for frame in frames:
+            _logger.debug2(f"Whole message: {frame!r}")
+            try:
+                jsons.append(deserialize(frame))
+            except JSONError:
+                _logger.exception("JSONError decoding message. Ignoring")
+            except:
+                _logger.exception("Error in trying to decode JSON off our read.")
+                raise
         return jsons
 
+    def _attach(self, loop: asyncio.AbstractEventLoop) -> bool:
+        """Have the loop watch our fds, returns False if it can't."""
+        if self._loop is loop:
+            return True
+        if self._loop is not None or not _with_loop_io:
+            return False
+        try:
+            os.set_blocking(self._read_from_browser, False)
+            os.set_blocking(self._write_to_browser, False)
+            if self._hub is None:  # otherwise the loop only waits to write
+                loop.add_reader(self._read_from_browser, self._on_readable)
+        except NotImplementedError:
+            _logger.debug("Event loop can't watch pipes, falling back to executor.")
+            os.set_blocking(self._read_from_browser, True)
+            os.set_blocking(self._write_to_browser, True)
+            return False
+        self._loop = loop
+        _logger.debug("Pipe attached to event loop.")
+        return True
+
+    def _on_readable(self) -> None:
+        try:
+            self._read_more()
+        except BlockingIOError:
+            return
+        except BaseException as e:  # noqa: BLE001 we hand it to the reader
+            self._fail_reader(e)
+            return
+        try:
+            frames = self._take_frames()
+        except ChannelClosedError as e:
+            self._fail_reader(e)
+            return
+        if frames:
+            self._ready_frames.extend(frames)
+            self._wake_reader()
+        elif self._framer.pending_size:
+            _logger.debug("Partial message from browser received.")
+        try:
+            self._check_for_bye()
+        except ChannelClosedError as e:
+            self._fail_reader(e)
+
+    def _on_hub_readable(
+        self,
+        callback: Callable[[Sequence[BrowserResponse]], Any],
+    ) -> None:
+        """Read what's there and call back with the jsons, in the hub's thread."""
+        try:
+            self._read_more()
+            frames = self._take_frames()
+        except BlockingIOError:
+            return
+        except BaseException as e:  # noqa: BLE001 the hub thread goes on
+            self._fail_hub_read(e)
+            return
+        if frames:
+            _logger.debug(f"Received {len(frames)} raw_messages.")
+            jsons = self._decode_frames(frames)
+            try:
+                callback(jsons)
+            except Exception:
+                _logger.exception("Error in hub callback.")
+        elif self._framer.pending_size:
+            _logger.debug("Partial message from browser received.")
+        try:
+            self._check_for_bye()
+        except ChannelClosedError as e:
+            self._fail_hub_read(e)
+
+    def _fail_hub_read(self, e: BaseException) -> None:
+        """Leave the hub, and have whoever owns our fds close them."""
+        _logger.debug(f"Error reading pipe in hub: {e!r}")
+        if not isinstance(e, ChannelClosedError):
+            e = ChannelClosedError(e)
+        self._read_error = e
+        if self._hub is not None:
+            self._hub.remove(self)  # the hub stops watching now
+        loop = self._loop
+        if loop is not None:  # it writes for us, and may be watching our fds
+            try:
+                loop.call_soon_threadsafe(self.close)
+            except RuntimeError:  # it's closed, nothing's registered
+                pass
+            else:
+                return
+        self.close()  # nothing else has our fds, the hub thread can close them
+
+    def _hub_detached(self) -> None:
+        """Go back to reading alone, the hub lets go of us."""
+        self._hub = None
+        loop = self._loop
+        if (
+            loop is not None
+            and not self.shutdown_lock.locked()
+            and not self._read_error
+        ):
+            # the loop was only writing, now it reads too
+            loop.call_soon_threadsafe(
+                loop.add_reader,
+                self._read_from_browser,
+                self._on_readable,
+            )
+
+    def _fail_reader(self, e: BaseException) -> None:
+        _logger.debug(f"Error reading pipe on event loop: {e!r}")
+        self.close()
+        if not isinstance(e, ChannelClosedError):
+            e = ChannelClosedError(e)
+        self._read_error = e
+        self._wake_reader()
+
+    def _wake_reader(self) -> None:
+        if self._read_waiter and not self._read_waiter.done():
+            self._read_waiter.set_result(None)
+
+    async def read_jsons_async(self) -> Sequence[BrowserResponse]:
+        """
+        Wait for one or more jsons from the pipe without blocking the event loop.
+
+        The pipe is read by the event loop itself, so there is no thread
+        involved unless the loop can't watch pipes (windows). Only the envelope
+        of each message is parsed, its body is parsed when first read, see
+        `LazyMessage`.
+
+        Returns:
+            A list of jsons.
+
+        Raises:
+            RuntimeError: if a `PipeHub` reads the pipe, its callback gets them.
+
+        """
+        if self.shutdown_lock.locked() and not self._ready_frames:
+            raise ChannelClosedError
+        if self._hub is not None:
+            raise RuntimeError("A hub reads the pipe, its callback gets the jsons.")
+        loop = asyncio.get_running_loop()
+        if not self._attach(loop):
+            if self._read_thread is None:
+                self._read_thread = ThreadPoolExecutor(
+                    max_workers=1,
+                    thread_name_prefix="choreographer-pipe",
+                )
+            return await loop.run_in_executor(
+                self._read_thread,
+                partial(self.read_jsons, blocking=True),
+            )
+        while not self._ready_frames:
+            if self._read_error:
+                raise self._read_error
+            self._read_waiter = loop.create_future()
+            try:
+                await self._read_waiter
+            finally:
+                self._read_waiter = None
+        frames, self._ready_frames = self._ready_frames, []
+        _logger.debug(f"Received {len(frames)} raw_messages.")
+        return self._decode_frames(frames, lazy=True)
+
+    async def write_json_async(self, obj: Mapping[str, Any]) -> None:
+        """
+        Send one json down the pipe without blocking the event loop.
+
+        Args:
+            obj: any python object that serializes to json.
+
+        """
+        await self.write_jsons_async([obj])
+
+    async def write_jsons_async(self, objs: Sequence[Mapping[str, Any]]) -> None:
+        """
+        Send several jsons down the pipe, together, without blocking the event loop.
+
+        All messages go out in as few `writev` calls as possible, and partial
+        writes are finished by waiting on the event loop until the pipe has room.
+        It is not safe to call concurrently, callers need to take turns.
+
+        Args:
+            objs: python objects that serialize to json.
+
+        """
+        if self.shutdown_lock.locked():
+            raise ChannelClosedError
+        loop = asyncio.get_running_loop()
+        if not self._attach(loop):
+            await run_blocking(self._write_all, self._encode(objs))
+            return
+        buffers = self._encode(objs)
+        while buffers:
+            try:
+                n = self._write_some(buffers)
+            except BlockingIOError:  # only when the pipe is full
+                await self._wait_writable(loop)
+                continue
+            except OSError as e:
+                self.close()
+                raise ChannelClosedError from e
+            _logger.debug2(f"Wrote {n} bytes.")
+            buffers = _drop_written(buffers, n)
+
+    async def _wait_writable(self, loop: asyncio.AbstractEventLoop) -> None:
+        if self.shutdown_lock.locked():
+            raise ChannelClosedError
+        self._write_waiter = loop.create_future()
+        loop.add_writer(self._write_to_browser, self._wake_writer)
+        try:
+            await self._write_waiter
+        finally:
+            self._write_waiter = None
+            if not self.shutdown_lock.locked():
+                loop.remove_writer(self._write_to_browser)
+
+    def _wake_writer(self) -> None:
+        if self._write_waiter and not self._write_waiter.done():
+            self._write_waiter.set_result(None)
+
+    def _detach(self) -> bool:
+        """
+        Remove our fds from the loop before they're closed, and wake waiters.
+
+        Returns:
+            True if the loop will close the fds. Off its thread, it has to: the
+            fds' numbers could be reused once they're closed, and the loop
+            would then remove somebody else's fd.
+
+        """
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return False
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is not loop and loop.is_running():
+            try:
+                loop.call_soon_threadsafe(self._detach_and_close_fds)
+            except RuntimeError:  # closed meanwhile, so nothing is registered
+                return False
+            return True
+        self._detach_on_loop()  # its thread, or it's stopped and isn't watching
+        return False
+
+    def _detach_and_close_fds(self) -> None:
+        self._detach_on_loop()
+        self._close_fds()
+
+    def _detach_on_loop(self) -> None:
+        loop = self._loop
+        if loop is None:
+            return
+        loop.remove_reader(self._read_from_browser)
+        loop.remove_writer(self._write_to_browser)
+        if not self._read_error:
+            self._read_error = ChannelClosedError()
+        self._wake_reader()
+        if self._write_waiter and not self._write_waiter.done():
+            self._write_waiter.set_exception(ChannelClosedError())
+
     def _unblock_fd(self, fd: int) -> None:
         try:
             if _with_block:
@@ -192,13 +563,21 @@ class Pipe:
     def close(self) -> None:
         """Close the pipe."""
         if self.shutdown_lock.acquire(blocking=False):
-            if platform.system() == "Windows":
-                self._fake_bye()
-            self._unblock_fd(self._write_from_browser)
-            self._unblock_fd(self._read_from_browser)
-            self._unblock_fd(self._write_to_browser)
-            self._unblock_fd(self._read_to_browser)
-            self._close_fd(self._write_to_browser)  # no more writes
-            self._close_fd(self._write_from_browser)  # we're done with writes
-            self._close_fd(self._read_from_browser)  # no more attempts at read
-            self._close_fd(self._read_to_browser)
+            if self._hub is not None:
+                self._hub.remove(self)  # before the fds close
+            if not self._detach():
+                self._close_fds()
+
+    def _close_fds(self) -> None:
+        if platform.system() == "Windows":
+            self._fake_bye()
+        self._unblock_fd(self._write_from_browser)
+        self._unblock_fd(self._read_from_browser)
+        self._unblock_fd(self._write_to_browser)
+        self._unblock_fd(self._read_to_browser)
+        self._close_fd(self._write_to_browser)  # no more writes
+        self._close_fd(self._write_from_browser)  # we're done with writes
+        self._close_fd(self._read_from_browser)  # no more attempts at read
+        self._close_fd(self._read_to_browser)
+        if self._read_thread is not None:
+            self._read_thread.shutdown(wait=False)  # its read ends with the fds
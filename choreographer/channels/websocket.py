@@ -0,0 +1,557 @@
+"""Provides a channel based on a websocket, for browsers listening on a port."""
+
+from __future__ import annotations
+
+import asyncio
+import base64
+import hashlib
+import os
+import select
+import socket
+import zlib
+from threading import Lock
+from typing import TYPE_CHECKING
+from urllib.parse import urlsplit
+
+import logistro
+
+from . import _wire as wire
+from ._errors import ChannelClosedError, JSONError
+from ._framing import NulFramer
+
+if TYPE_CHECKING:
+    from typing import Any, Mapping, Sequence
+
+    from choreographer.protocol import BrowserResponse
+
+_logger = logistro.getLogger(__name__)
+
+_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+_OP_CONTINUATION, _OP_TEXT, _OP_BINARY = 0x0, 0x1, 0x2
+_OP_CLOSE, _OP_PING, _OP_PONG = 0x8, 0x9, 0xA
+
+_FRAGMENT_SIZE = 2**20
+"""Messages bigger than this are sent as several frames."""
+_COMPRESS_MIN = 512
+"""Messages smaller than this aren't worth compressing."""
+_DEFLATE_TAIL = b"\0\0\xff\xff"
+_MAX_HEADERS_SIZE = 2**16
+
+
+def _mask(payload: bytes | memoryview, key: bytes) -> bytes:
+    """XOR payload with the 4-byte key, as one big integer, not byte by byte."""
+    n = len(payload)
+    if not n:
+        return b""
+    repeated = (key * (n // 4 + 1))[:n]
+    return (
+        int.from_bytes(payload, "little") ^ int.from_bytes(repeated, "little")
+    ).to_bytes(n, "little")
+
+
+def _frame(
+    opcode: int,
+    payload: bytes | memoryview,
+    *,
+    fin: bool = True,
+    rsv1: bool = False,
+) -> list[bytes]:
+    """Return a client frame (masked, as clients must) as header and payload."""
+    n = len(payload)
+    header = bytearray(((0x80 if fin else 0) | (0x40 if rsv1 else 0) | opcode,))
+    if n < 126:  # noqa: PLR2004 the websocket encoding
+        header.append(0x80 | n)
+    elif n < 2**16:
+        header.append(0x80 | 126)
+        header += n.to_bytes(2, "big")
+    else:
+        header.append(0x80 | 127)
+        header += n.to_bytes(8, "big")
+    key = os.urandom(4)
+    header += key
+    return [bytes(header), _mask(payload, key)]
+
+
+def _message_frames(
+    opcode: int,
+    payload: bytes,
+    *,
+    rsv1: bool = False,
+) -> list[bytes]:
+    """Return a message's frames, split so a big one streams out in pieces."""
+    if len(payload) <= _FRAGMENT_SIZE:
+        return _frame(opcode, payload, rsv1=rsv1)
+    frames: list[bytes] = []
+    with memoryview(payload) as view:
+        for start in range(0, len(payload), _FRAGMENT_SIZE):
+            frames += _frame(
+                opcode if not start else _OP_CONTINUATION,
+                view[start : start + _FRAGMENT_SIZE],
+                fin=start + _FRAGMENT_SIZE >= len(payload),
+                rsv1=rsv1 and not start,
+            )
+    return frames
+
+
+class _Deflate:
+    """The permessage-deflate extension (RFC 7692), as negotiated."""
+
+    def __init__(self, params: Mapping[str, str | None]) -> None:
+        self._client_context = "client_no_context_takeover" not in params
+        self._server_context = "server_no_context_takeover" not in params
+        # zlib can't compress with 8 bits, 9 is compatible
+        self._client_bits = max(int(params.get("client_max_window_bits") or 15), 9)
+        self._server_bits = int(params.get("server_max_window_bits") or 15)
+        self._compressor: Any = None
+        self._decompressor: Any = None
+
+    def compress(self, data: bytes) -> bytes:
+        if self._compressor is None or not self._client_context:
+            self._compressor = zlib.compressobj(
+                zlib.Z_DEFAULT_COMPRESSION,
+                zlib.DEFLATED,
+                -self._client_bits,
+            )
+        compressed = self._compressor.compress(data)
+        compressed += self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        return compressed[: -len(_DEFLATE_TAIL)]  # type: ignore [no-any-return]
+
+    def decompress(self, data: bytes) -> bytes:
+        if self._decompressor is None or not self._server_context:
+            self._decompressor = zlib.decompressobj(-self._server_bits)
+        return self._decompressor.decompress(data + _DEFLATE_TAIL)  # type: ignore [no-any-return]
+
+
+def _parse_extensions(header: str) -> Mapping[str, Mapping[str, str | None]]:
+    extensions: dict[str, dict[str, str | None]] = {}
+    for extension in header.split(","):
+        name, *params = (p.strip() for p in extension.split(";"))
+        if not name:
+            continue
+        extensions[name] = {}
+        for param in params:
+            key, _, value = param.partition("=")
+            extensions[name][key.strip()] = value.strip().strip('"') or None
+    return extensions
+
+
+class _WebSocketFramer(NulFramer):
+    """
+    _WebSocketFramer splits a stream of websocket frames into messages.
+
+    `frames()` returns whole data messages, reassembled from fragments and
+    decompressed. Control frames are kept in `control` for the channel.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.deflate: _Deflate | None = None
+        self.control: list[tuple[int, bytes]] = []
+        self._fragments: list[bytes] = []
+        self._compressed = False
+
+    def frames(self) -> list[bytes]:  # noqa: C901, PLR0912 it's the frame format
+        messages: list[bytes] = []
+        missing = 0
+        buffer = self._buffer
+        with memoryview(buffer) as view:
+            while self._end - self._start >= 2:  # noqa: PLR2004 smallest header
+                start = self._start
+                first, second = buffer[start], buffer[start + 1]
+                n = second & 0x7F
+                pos = start + 2
+                if n >= 126:  # noqa: PLR2004 the websocket encoding
+                    size = 2 if n == 126 else 8  # noqa: PLR2004 the websocket encoding
+                    if self._end - pos < size:
+                        break
+                    n = int.from_bytes(buffer[pos : pos + size], "big")
+                    pos += size
+                key = None
+                if second & 0x80:
+                    if self._end - pos < 4:  # noqa: PLR2004 mask size
+                        break
+                    key = bytes(buffer[pos : pos + 4])
+                    pos += 4
+                if self._end - pos < n:
+                    missing = n - (self._end - pos)
+                    break
+                payload = bytes(view[pos : pos + n])
+                if key:
+                    payload = _mask(payload, key)
+                self._start = pos + n
+                opcode = first & 0x0F
+                if opcode >= _OP_CLOSE:
+                    self.control.append((opcode, payload))
+                    continue
+                if opcode != _OP_CONTINUATION:
+                    self._fragments = []
+                    self._compressed = bool(first & 0x40)
+                elif not self._fragments:
+                    raise ValueError("Continuation frame without a message.")
+                self._fragments.append(payload)
+                if first & 0x80:  # fin
+                    message = b"".join(self._fragments)
+                    self._fragments = []
+                    if self._compressed:
+                        if not self.deflate:
+                            raise ValueError("Compressed frame wasn't negotiated.")
+                        message = self.deflate.decompress(message)
+                    messages.append(message)
+        if self._start == self._end:
+            self._reset()
+        elif missing:  # make room for the rest now, not by doubling as it comes
+            self._reserve(missing)
+        return messages
+
+
+class WebSocket:
+    """
+    Defines a websocket connection to a browser's devtools endpoint.
+
+    It's constructed unconnected: the browser implementation knows the url
+    once the browser has started, then `open()` (or `connect()`) is called.
+    """
+
+    url: str | None
+    """The url connected to, None until connected."""
+    shutdown_lock: Lock
+    """Once this is locked, the websocket is closed and can't be reopened."""
+
+    def __init__(self, *, compression: bool = True) -> None:
+        """
+        Construct an unconnected websocket.
+
+        Args:
+            compression: offer permessage-deflate to the server.
+
+        """
+        self.url = None
+        self.shutdown_lock = Lock()
+        self._compression = compression
+        self._sock: socket.socket | None = None
+        self._framer = _WebSocketFramer()
+        self._reading = False
+        self._write_lock: asyncio.Lock | None = None
+        self._control_tasks: set[asyncio.Task[Any]] = set()
+
+    def _handshake_request(self, url: str) -> tuple[tuple[str, int], bytes, bytes]:
+        parts = urlsplit(url)
+        if parts.scheme != "ws":
+            raise ValueError(f"Only ws:// urls are supported, not {url}.")
+        host, port = parts.hostname or "127.0.0.1", parts.port or 80
+        path = parts.path or "/"
+        if parts.query:
+            path += f"?{parts.query}"
+        key = base64.b64encode(os.urandom(16))
+        lines = [
+            f"GET {path} HTTP/1.1",
+            f"Host: {f'[{host}]' if ':' in host else host}:{port}",  # ipv6 in []
+            "Upgrade: websocket",
+            "Connection: Upgrade",
+            f"Sec-WebSocket-Key: {key.decode()}",
+            "Sec-WebSocket-Version: 13",
+        ]
+        if self._compression:
+            lines.append(
+                "Sec-WebSocket-Extensions: permessage-deflate; client_max_window_bits",
+            )
+        request = ("\r\n".join(lines) + "\r\n\r\n").encode()
+        return (host, port), request, key
+
+    def _handshake_response(self, response: bytes, key: bytes) -> None:
+        head, end, rest = response.partition(b"\r\n\r\n")
+        if not end:
+            raise ChannelClosedError("Websocket closed during handshake.")
+        status, *lines = head.decode("latin-1").split("\r\n")
+        if status.split(" ", 2)[1:2] != ["101"]:
+            raise ChannelClosedError(f"Websocket handshake refused: {status}")
+        headers = {}
+        for line in lines:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        accept = base64.b64encode(hashlib.sha1(key + _GUID).digest()).decode()  # noqa: S324 the protocol says sha1
+        if headers.get("sec-websocket-accept") != accept:
+            raise ChannelClosedError("Websocket handshake: bad Sec-WebSocket-Accept.")
+        extensions = _parse_extensions(headers.get("sec-websocket-extensions", ""))
+        if "permessage-deflate" in extensions:
+            _logger.debug("Websocket using permessage-deflate.")
+            self._framer.deflate = _Deflate(extensions["permessage-deflate"])
+        if rest:
+            self._framer.feed(rest)
+
+    async def open(self, url: str) -> None:
+        """
+        Connect to the websocket url without blocking the event loop.
+
+        Args:
+            url: the `ws://` url of the devtools endpoint.
+
+        """
+        loop = asyncio.get_running_loop()
+        address, request, key = self._handshake_request(url)
+        try:
+            infos = await loop.getaddrinfo(*address, type=socket.SOCK_STREAM)
+            family, type_, proto, _, sockaddr = infos[0]
+            sock = socket.socket(family, type_, proto)
+            sock.setblocking(False)  # noqa: FBT003 the socket api
+            self._sock = sock
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            await loop.sock_connect(sock, sockaddr)
+            await loop.sock_sendall(sock, request)
+            response = b""
+            while b"\r\n\r\n" not in response:
+                data = await loop.sock_recv(sock, _MAX_HEADERS_SIZE)
+                if not data or len(response) > _MAX_HEADERS_SIZE:
+                    break  # it's refused below
+                response += data
+            self._handshake_response(response, key)
+        except BaseException as e:
+            self.close()  # a failed or cancelled handshake leaves no socket
+            if isinstance(e, OSError) and not isinstance(e, ChannelClosedError):
+                raise ChannelClosedError from e
+            raise
+        self.url = url
+        _logger.debug(f"Websocket connected to {url}.")
+
+    def connect(self, url: str) -> None:
+        """
+        Connect to the websocket url, blocking.
+
+        Args:
+            url: the `ws://` url of the devtools endpoint.
+
+        """
+        address, request, key = self._handshake_request(url)
+        try:
+            sock = socket.create_connection(address)
+            self._sock = sock
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.sendall(request)
+            response = b""
+            while b"\r\n\r\n" not in response:
+                data = sock.recv(_MAX_HEADERS_SIZE)
+                if not data or len(response) > _MAX_HEADERS_SIZE:
+                    break  # it's refused below
+                response += data
+            sock.setblocking(False)  # noqa: FBT003 the socket api
+            self._handshake_response(response, key)
+        except BaseException as e:
+            self.close()  # a failed handshake leaves no socket
+            if isinstance(e, OSError) and not isinstance(e, ChannelClosedError):
+                raise ChannelClosedError from e
+            raise
+        self.url = url
+        _logger.debug(f"Websocket connected to {url}.")
+
+    def _check_open(self) -> socket.socket:
+        if self.shutdown_lock.locked() or self._sock is None:
+            raise ChannelClosedError
+        return self._sock
+
+    def _encode(self, objs: Sequence[Mapping[str, Any]]) -> list[bytes]:
+        buffers: list[bytes] = []
+        deflate = self._framer.deflate
+        for obj in objs:
+            message = wire.serialize(obj)
+            if deflate and len(message) >= _COMPRESS_MIN:
+                buffers += _message_frames(
+                    _OP_TEXT,
+                    deflate.compress(message),
+                    rsv1=True,
+                )
+            else:
+                buffers += _message_frames(_OP_TEXT, message)
+        return buffers
+
+    def _take_messages(self) -> list[bytes]:
+        try:
+            messages = self._framer.frames()
+        except (ValueError, zlib.error) as e:
+            _logger.exception("Couldn't read frames from websocket.")
+            self.close()
+            raise ChannelClosedError from e
+        control, self._framer.control = self._framer.control, []
+        for opcode, payload in control:
+            if opcode == _OP_CLOSE:
+                _logger.debug("Websocket closed by browser.")
+                self.close()
+                if not messages:
+                    raise ChannelClosedError
+            elif opcode == _OP_PING:
+                self._send_control(_frame(_OP_PONG, payload))
+        return messages
+
+    def _decode(
+        self,
+        messages: Sequence[bytes],
+        *,
+        lazy: bool = False,
+    ) -> list[BrowserResponse]:
+        deserialize = wire.deserialize_lazy if lazy else wire.deserialize
+        jsons: list[BrowserResponse] = []
+        for message in messages:
+            _logger.debug2(f"Whole message: {message!r}")
+            try:
+                jsons.append(deserialize(message))
+            except JSONError:
+                _logger.exception("JSONError decoding message. Ignoring")
+        return jsons
+
+    def write_json(self, obj: Mapping[str, Any]) -> None:
+        """
+        Send one json down the websocket.
+
+        Args:
+            obj: any python object that serializes to json.
+
+        """
+        self._send_sync(self._encode([obj]))
+
+    def _send_sync(self, buffers: Sequence[bytes]) -> None:
+        sock = self._check_open()
+        try:
+            for buffer in buffers:
+                with memoryview(buffer) as view:
+                    sent = 0
+                    while sent < len(view):
+                        try:
+                            sent += sock.send(view[sent:])
+                        except BlockingIOError:  # noqa: PERF203 only when full
+                            select.select([], [sock], [])
+        except OSError as e:
+            self.close()
+            raise ChannelClosedError from e
+
+    def read_jsons(self, *, blocking: bool = True) -> Sequence[BrowserResponse]:
+        """
+        Read from the websocket and return one or more jsons in a list.
+
+        Args:
+            blocking: The read option can be set to block or not.
+
+        Returns:
+            A list of jsons.
+
+        """
+        sock = self._check_open()
+        while True:
+            messages = self._take_messages()
+            if messages:
+                return self._decode(messages)
+            readable, _, _ = select.select([sock], [], [], None if blocking else 0)
+            if not readable:
+                return []
+            try:
+                with self._framer.get_buffer() as view:
+                    n = sock.recv_into(view)
+            except BlockingIOError:
+                continue
+            except OSError as e:
+                self.close()
+                raise ChannelClosedError from e
+            if not n:
+                self.close()
+                raise ChannelClosedError
+            self._framer.buffer_updated(n)
+
+    def _get_write_lock(self) -> asyncio.Lock:
+        # made here so it belongs to the running loop
+        if self._write_lock is None:
+            self._write_lock = asyncio.Lock()
+        return self._write_lock
+
+    def _send_control(self, buffers: list[bytes]) -> None:
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            self._send_sync(buffers)
+            return
+        task = asyncio.create_task(self._send_async(buffers))
+        self._control_tasks.add(task)
+        task.add_done_callback(self._control_tasks.discard)
+
+    async def _send_async(self, buffers: Sequence[bytes]) -> None:
+        sock = self._check_open()
+        loop = asyncio.get_running_loop()
+        async with self._get_write_lock():
+            try:
+                for buffer in buffers:
+                    await loop.sock_sendall(sock, buffer)
+            except OSError as e:
+                self.close()
+                raise ChannelClosedError from e
+
+    async def write_json_async(self, obj: Mapping[str, Any]) -> None:
+        """
+        Send one json down the websocket without blocking the event loop.
+
+        Args:
+            obj: any python object that serializes to json.
+
+        """
+        await self.write_jsons_async([obj])
+
+    async def write_jsons_async(self, objs: Sequence[Mapping[str, Any]]) -> None:
+        """
+        Send several jsons down the websocket without blocking the event loop.
+
+        Big messages go out as several frames, one piece at a time.
+
+        Args:
+            objs: python objects that serialize to json.
+
+        """
+        self._check_open()
+        await self._send_async(self._encode(objs))
+
+    async def read_jsons_async(self) -> Sequence[BrowserResponse]:
+        """
+        Wait for one or more jsons from the websocket without blocking the loop.
+
+        Returns:
+            A list of jsons, their bodies are parsed when first read.
+
+        """
+        sock = self._check_open()
+        loop = asyncio.get_running_loop()
+        while True:
+            messages = self._take_messages()
+            if messages:
+                return self._decode(messages, lazy=True)
+            self._reading = True
+            try:
+                with self._framer.get_buffer() as view:
+                    n = await loop.sock_recv_into(sock, view)
+            except OSError as e:
+                self.close()
+                raise ChannelClosedError from e
+            finally:
+                self._reading = False
+                if self.shutdown_lock.locked():
+                    sock.close()  # close() left it to us, see there
+            if not n or self.shutdown_lock.locked():
+                self.close()
+                raise ChannelClosedError
+            self._framer.buffer_updated(n)
+
+    def close(self) -> None:
+        """Close the websocket."""
+        if not self.shutdown_lock.acquire(blocking=False):
+            return
+        sock = self._sock
+        if sock is None:
+            return
+        _logger.debug("Closing websocket.")
+        try:
+            if self.url is not None:  # not before the handshake's done
+                sock.send(b"".join(_frame(_OP_CLOSE, (1000).to_bytes(2, "big"))))
+        except OSError:
+            pass
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        # a read waiting on the loop is woken by the shutdown, it closes the
+        # socket itself: closing under the loop's feet would leave it waiting
+        if not self._reading:
+            sock.close()
@@ -17,6 +17,9 @@ BrowserCommand = NewType("BrowserCommand", MutableMapping[str, Any])
 MessageKey = NewType("MessageKey", Tuple[str, Optional[int]])
 """The type for id'ing a message/response. It is `tuple(session_id, message_id)`."""
 
+NOTIFICATION_IDS = 2**30
+"""Commands sent with `notify()` have ids from here up, their replies are dropped."""
+
 
 class Ecode(Enum):
     """Ecodes are a list of possible error codes chrome returns."""
@@ -159,8 +162,8 @@ def match_message_key(response: BrowserResponse, key: MessageKey) -> bool:
 
 def is_event(response: BrowserResponse) -> bool:
     """Return true if the browser response is an event notification."""
-    required_keys = {"method", "params"}
-    return required_keys <= response.keys() and "id" not in response
+    # no .keys(), it would parse a lazy message's body
+    return "method" in response and "params" in response and "id" not in response
 
 
 def get_target_id_from_result(response: BrowserResponse) -> str | None:
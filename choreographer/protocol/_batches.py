@@ -0,0 +1,117 @@
+"""Provides `EventBatcher`, which collects events to call a callback with a list."""
+
+from __future__ import annotations
+
+import asyncio
+from typing import TYPE_CHECKING
+
+import logistro
+
+if TYPE_CHECKING:
+    from typing import Any, Callable, Coroutine
+
+    from choreographer import protocol
+
+    from .devtools_async import Session
+
+_logger = logistro.getLogger(__name__)
+
+
+class EventBatcher:
+    """
+    EventBatcher collects the events matching a subscription into lists.
+
+    A list goes to the callback when it has `max_batch` events, and when the
+    broker is done with what it read from the browser at once, or, with a
+    `max_delay`, that many seconds after its first event instead. The lists
+    are delivered in order, one callback at a time, so a subscriber gets one
+    task per list instead of one per event.
+    """
+
+    pattern: str
+    """The subscription, an event name or a prefix ending with "*"."""
+    max_batch: int
+    """How many events a list can have."""
+    max_delay: float | None
+    """How long an event can wait for more, None is until the read is done."""
+
+    def __init__(
+        self,
+        session: Session,
+        pattern: str,
+        callback: Callable[[list[protocol.BrowserResponse]], Coroutine[Any, Any, Any]],
+        *,
+        max_batch: int = 100,
+        max_delay: float | None = None,
+    ) -> None:
+        """
+        Construct a batcher, `Session.subscribe_batch()` does and subscribes it.
+
+        Args:
+            session: the session whose events it gets.
+            pattern: the event name, can use * wildcard at the end.
+            callback: called with each list of events.
+            max_batch: how many events a list can have.
+            max_delay: how many seconds an event can wait for more.
+
+        Raises:
+            ValueError: if max_batch or max_delay aren't valid.
+
+        """
+        if max_batch < 1:
+            raise ValueError("max_batch must be at least 1.")
+        if max_delay is not None and max_delay < 0:
+            raise ValueError("max_delay can't be negative.")
+        self._session = session
+        self.pattern = pattern
+        self.callback = callback
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._events: list[protocol.BrowserResponse] = []
+        self._timer: asyncio.TimerHandle | None = None
+
+    def add(self, event: protocol.BrowserResponse) -> bool:
+        """
+        Collect an event, the broker calls it.
+
+        Returns:
+            True if the broker should `flush()` it when it's done reading.
+
+        """
+        events = self._events
+        events.append(event)
+        if len(events) >= self.max_batch:
+            self.flush()
+            return False
+        if len(events) > 1:
+            return False
+        if self.max_delay is None:
+            return True
+        self._timer = asyncio.get_running_loop().call_later(
+            self.max_delay,
+            self.flush,
+        )
+        return False
+
+    def flush(self) -> None:
+        """Call the callback with the events collected, if there are any."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._events:
+            return
+        events, self._events = self._events, []
+        _logger.debug2(f"Delivering {len(events)} events for {self.pattern}.")
+        self._session._broker.callbacks.schedule(  # noqa: SLF001 it's the session's
+            self._session.session_id,
+            self.callback,
+            events,
+            serial=self,
+        )
+
+    def cancel(self) -> None:
+        """Drop the events collected, the subscription is going away."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._events.clear()
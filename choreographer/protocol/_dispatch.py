@@ -0,0 +1,193 @@
+"""Provides `SubscriptionIndex` and `EventFilter`, for dispatching events."""
+
+from __future__ import annotations
+
+import time
+from typing import TYPE_CHECKING, MutableMapping, TypeVar
+
+import logistro
+
+if TYPE_CHECKING:
+    from typing import Callable, Iterator
+
+    from choreographer import protocol
+
+_logger = logistro.getLogger(__name__)
+
+_V = TypeVar("_V")
+
+
+class _Node:
+    __slots__ = ("children", "pattern")
+
+    def __init__(self) -> None:
+        self.children: dict[str, _Node] = {}
+        self.pattern: str | None = None  # the wildcard pattern ending here
+
+
+class SubscriptionIndex(MutableMapping[str, _V]):
+    """
+    A mapping of subscription to value, indexed by what events they match.
+
+    Subscriptions are event names, or prefixes ending with a "*" wildcard.
+    Names are kept in a dict and prefixes in a trie, so `matches()` costs a
+    lookup and a walk down the trie, however many subscriptions there are.
+    """
+
+    __slots__ = ("_counter", "_exact", "_items", "_trie")
+
+    def __init__(self) -> None:
+        """Construct an empty index."""
+        self._items: dict[str, tuple[int, _V]] = {}  # with insertion number
+        self._exact: set[str] = set()
+        self._trie = _Node()
+        self._counter = 0
+
+    def __getitem__(self, pattern: str) -> _V:
+        """Return the value for a subscription."""
+        return self._items[pattern][1]
+
+    def __setitem__(self, pattern: str, value: _V) -> None:
+        """Add a subscription, or replace the value of one."""
+        if pattern in self._items:
+            self._items[pattern] = (self._items[pattern][0], value)
+            return
+        self._items[pattern] = (self._counter, value)
+        self._counter += 1
+        if not pattern.endswith("*"):
+            self._exact.add(pattern)
+            return
+        node = self._trie
+        for char in pattern[:-1]:
+            node = node.children.setdefault(char, _Node())
+        node.pattern = pattern
+
+    def __delitem__(self, pattern: str) -> None:
+        """Remove a subscription."""
+        del self._items[pattern]
+        if not pattern.endswith("*"):
+            self._exact.discard(pattern)
+            return
+        path = [self._trie]
+        for char in pattern[:-1]:
+            path.append(path[-1].children[char])
+        path[-1].pattern = None
+        # prune the branch the pattern leaves empty
+        for i in range(len(path) - 1, 0, -1):
+            if path[i].children or path[i].pattern is not None:
+                break
+            del path[i - 1].children[pattern[i - 1]]
+
+    def __iter__(self) -> Iterator[str]:
+        """Iterate over the subscriptions, in the order they were made."""
+        return iter(self._items)
+
+    def __len__(self) -> int:
+        """Return the number of subscriptions."""
+        return len(self._items)
+
+    def __contains__(self, pattern: object) -> bool:
+        """Return if there's a subscription, without the Mapping's try/except."""
+        return pattern in self._items
+
+    def __repr__(self) -> str:
+        """Show the subscriptions like a dict."""
+        return f"{type(self).__name__}({dict(self.items())!r})"
+
+    def matches(self, method: str) -> list[tuple[str, _V]]:
+        """
+        Return the subscriptions an event matches, in the order they were made.
+
+        Args:
+            method: the event's name, e.g. "Page.loadEventFired".
+
+        """
+        found = [method] if method in self._exact else []
+        node = self._trie
+        for char in method:
+            if node.pattern is not None:
+                found.append(node.pattern)
+            child = node.children.get(char)
+            if child is None:
+                break
+            node = child
+        else:
+            if node.pattern is not None:
+                found.append(node.pattern)
+        items = self._items
+        if len(found) > 1:
+            found.sort(key=lambda pattern: items[pattern][0])
+        return [(pattern, items[pattern][1]) for pattern in found]
+
+
+class EventFilter:
+    """
+    EventFilter decides which of a subscription's events get a callback.
+
+    The broker calls it as it dispatches, so the events it rejects cost no
+    task. An event passes if the `predicate` accepts it, it's the
+    `sample_every`th to, and it's not sooner than `1 / max_rate` seconds
+    after the last one passed. Only the predicate looks at the event, so a
+    predicate that only reads `method` or `sessionId` leaves the rest of a
+    lazily parsed event unparsed.
+    """
+
+    __slots__ = (
+        "_count",
+        "_interval",
+        "_last",
+        "max_rate",
+        "predicate",
+        "sample_every",
+    )
+
+    def __init__(
+        self,
+        *,
+        predicate: Callable[[protocol.BrowserResponse], bool] | None = None,
+        sample_every: int | None = None,
+        max_rate: float | None = None,
+    ) -> None:
+        """
+        Construct a filter.
+
+        Args:
+            predicate: an event passes only if it returns True.
+            sample_every: pass one in every this many events.
+            max_rate: pass at most this many events a second.
+
+        Raises:
+            ValueError: if sample_every or max_rate aren't valid.
+
+        """
+        if sample_every is not None and sample_every < 1:
+            raise ValueError("sample_every must be at least 1.")
+        if max_rate is not None and max_rate <= 0:
+            raise ValueError("max_rate must be positive.")
+        self.predicate = predicate
+        self.sample_every = sample_every
+        self.max_rate = max_rate
+        self._interval = 1 / max_rate if max_rate else 0.0
+        self._count = 0
+        self._last: float | None = None
+
+    def __call__(self, event: protocol.BrowserResponse) -> bool:
+        """Return True if the event passes, and count it if it does."""
+        if self.predicate is not None:
+            try:
+                if not self.predicate(event):
+                    return False
+            except Exception:
+                _logger.exception("Error in subscription predicate, event dropped.")
+                return False
+        if self.sample_every is not None:
+            self._count += 1
+            if self._count < self.sample_every:
+                return False
+            self._count = 0
+        if self.max_rate is not None:
+            now = time.monotonic()
+            if self._last is not None and now - self._last < self._interval:
+                return False
+            self._last = now
+        return True
@@ -0,0 +1,165 @@
+"""Provides `EventStream`, a bounded queue of events to `async for` over."""
+
+from __future__ import annotations
+
+import asyncio
+from collections import deque
+from typing import TYPE_CHECKING
+
+import logistro
+
+if TYPE_CHECKING:
+    from types import TracebackType
+
+    from typing_extensions import Self  # 3.9 needs this, could be from typing in 3.10
+
+    from choreographer import protocol
+
+    from .devtools_async import Session
+
+_logger = logistro.getLogger(__name__)
+
+OVERFLOWS = ("drop_oldest", "block", "coalesce")
+"""What a full stream can do with a new event."""
+
+
+class EventStream:
+    """
+    EventStream queues the events matching a subscription, up to `maxsize`.
+
+    `async for` over it to get them, `async with` it (or `close()` it) to
+    stop the subscription. When it's full, a new event is handled by the
+    `overflow` policy:
+
+    - "drop_oldest": the oldest queued event is dropped.
+    - "block": it never drops, and never holds more than `maxsize`: once
+      it's full, the broker handles nothing else from the browser (responses
+      too, even the rest of a read) until there's room, so everything waits
+      on this stream's consumer.
+    - "coalesce": it replaces the newest queued event with the same method,
+      or if there's none, the oldest event is dropped.
+
+    Dropped events are counted in `dropped`.
+    """
+
+    pattern: str
+    """The subscription, an event name or a prefix ending with "*"."""
+    maxsize: int
+    """How many events can be queued."""
+    overflow: str
+    """What to do with a new event when it's full, see `OVERFLOWS`."""
+    dropped: int
+    """How many events were dropped (or coalesced away)."""
+
+    def __init__(
+        self,
+        session: Session,
+        pattern: str,
+        *,
+        maxsize: int = 1000,
+        overflow: str = "drop_oldest",
+    ) -> None:
+        """
+        Construct a stream, `Session.events()` does and subscribes it.
+
+        Args:
+            session: the session whose events it gets.
+            pattern: the event name, can use * wildcard at the end.
+            maxsize: how many events can be queued.
+            overflow: "drop_oldest" (default), "block" or "coalesce".
+
+        Raises:
+            ValueError: if maxsize or overflow aren't valid.
+
+        """
+        if overflow not in OVERFLOWS:
+            raise ValueError(f"overflow must be one of {OVERFLOWS}, not {overflow!r}.")
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1.")
+        self._session = session
+        self.pattern = pattern
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.dropped = 0
+        self.closed = False
+        self._queue: deque[protocol.BrowserResponse] = deque()
+        self._ready: asyncio.Future[None] | None = None  # the consumer waits
+        self._room: asyncio.Future[None] | None = None  # the broker waits
+
+    def put(self, event: protocol.BrowserResponse) -> bool:
+        """
+        Queue an event, the broker calls it.
+
+        Returns:
+            True if it's "block" and now full: the broker must wait for
+            `room()` before handling another message.
+
+        """
+        queue = self._queue
+        if len(queue) >= self.maxsize and self.overflow != "block":
+            self.dropped += 1
+            if self.overflow == "coalesce":
+                method = event["method"]
+                for i in range(len(queue) - 1, -1, -1):
+                    if queue[i]["method"] == method:
+                        queue[i] = event
+                        return False
+            queue.popleft()
+        queue.append(event)
+        self._wake()
+        return self.overflow == "block" and len(queue) >= self.maxsize
+
+    async def room(self) -> None:
+        """Wait until the stream isn't full, or is closed."""
+        while len(self._queue) >= self.maxsize and not self.closed:
+            if self._room is None or self._room.done():
+                self._room = asyncio.get_running_loop().create_future()
+            await self._room
+
+    def _wake(self) -> None:
+        if self._ready is not None and not self._ready.done():
+            self._ready.set_result(None)
+
+    def close(self) -> None:
+        """Stop the subscription, `async for` ends once the queue is empty."""
+        if self.closed:
+            return
+        self.closed = True
+        self._session._remove_stream(self)  # noqa: SLF001 it's the session's
+        self._wake()
+        if self._room is not None and not self._room.done():
+            self._room.set_result(None)
+
+    def __aiter__(self) -> Self:
+        """Iterate over the events as they come."""
+        return self
+
+    async def __anext__(self) -> protocol.BrowserResponse:
+        """Return the next event, waiting for it."""
+        while not self._queue:
+            if self.closed:
+                raise StopAsyncIteration
+            if self._ready is None or self._ready.done():
+                self._ready = asyncio.get_running_loop().create_future()
+            await self._ready
+        event = self._queue.popleft()
+        if (
+            self._room is not None
+            and not self._room.done()
+            and len(self._queue) < self.maxsize
+        ):
+            self._room.set_result(None)
+        return event
+
+    async def __aenter__(self) -> Self:
+        """Use the stream, it's closed on exit."""
+        return self
+
+    async def __aexit__(
+        self,
+        type_: type[BaseException] | None,
+        value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        """Close the stream."""
+        self.close()
@@ -2,21 +2,54 @@
 
 from __future__ import annotations
 
+import asyncio
 import inspect
 from typing import TYPE_CHECKING
 
 import logistro
 
 from choreographer import protocol
+from choreographer.channels import encode_typed_arrays
+
+from ._batches import EventBatcher
+from ._dispatch import EventFilter, SubscriptionIndex
+from ._streams import EventStream
 
 if TYPE_CHECKING:
-    import asyncio
-    from typing import Any, Callable, Coroutine, MutableMapping
+    from typing import (
+        Any,
+        AsyncIterator,
+        Awaitable,
+        Callable,
+        Coroutine,
+        Iterable,
+        MutableMapping,
+        Tuple,
+        Union,
+    )
+
+    Command = Union[str, Tuple[str, Union[MutableMapping[str, Any], None]]]
+    """A command's name, or its name and params, for `send_commands()`."""
+
+    from concurrent.futures import Executor
 
     from choreographer._brokers import Broker
+    from choreographer._brokers._callbacks import OffloadedCallback
 
 _logger = logistro.getLogger(__name__)
 
+_MAX_ID = 2**31 - 1
+
+
+def _domain(string: str) -> str:
+    domain, dot, _ = string.partition(".")
+    if not dot or not domain or "*" in domain:
+        raise ValueError(
+            f"Can't tell the domain to enable from {string!r}, "
+            "it needs to be like 'Network.*'.",
+        )
+    return domain
+
 
 class Session:
     """A session is a single conversation with a single target."""
@@ -24,14 +57,25 @@ class Session:
     session_id: str
     """The id of the session given by the browser."""
     message_id: int
-    """All messages are counted per session and this is the current message id."""
-    subscriptions: MutableMapping[
-        str,
+    """
+    All messages are counted per session and this is the current message id.
+    It wraps to 0 below `protocol.NOTIFICATION_IDS`.
+    """
+    subscriptions: SubscriptionIndex[
         tuple[
             Callable[[protocol.BrowserResponse], Coroutine[Any, Any, Any]],
             bool,
-        ],
+            bool,
+            EventFilter | None,
+        ]
     ]
+    """A mapping of subscription: (callback, repeating, serial, filter), indexed."""
+    streams: SubscriptionIndex[list[EventStream]]
+    """A mapping of subscription: the open `events()` streams for it."""
+    batches: SubscriptionIndex[EventBatcher]
+    """A mapping of subscription: its `subscribe_batch()` batcher."""
+    domains: dict[str, int]
+    """The domains subscriptions enabled: how many subscriptions hold each."""
 
     def __init__(self, session_id: str, broker: Broker) -> None:
         """
@@ -54,12 +98,22 @@ class Session:
         self.session_id = session_id
         _logger.debug(f"New session: {session_id}")
         self.message_id = 0
-        self.subscriptions = {}
+        self._notification_id = protocol.NOTIFICATION_IDS
+        self.subscriptions = SubscriptionIndex()
+        self.streams = SubscriptionIndex()
+        self.batches = SubscriptionIndex()
+        self.domains = {}
+        self._domain_holders: dict[tuple[str, str], str] = {}
+        self._enabling: set[asyncio.Task[None]] = set()  # kept till they're done
 
     async def send_command(
         self,
         command: str,
         params: MutableMapping[str, Any] | None = None,
+        *,
+        typed_arrays: bool = False,
+        timeout: float | None = None,
+        priority: str = "interactive",
     ) -> protocol.BrowserResponse:
         """
         Send a devtools command on the session.
@@ -69,13 +123,46 @@ class Session:
         Args:
             command: devtools command to send
             params: the parameters to send
+            typed_arrays: send numeric numpy arrays in params as base64 blobs,
+                the page must decode them, see `channels.typed_array_shim()`
+            timeout: seconds to wait for the response, if None the broker's
+                default (which is forever, unless the `Browser` set one)
+            priority: "control", "interactive" (default) or "bulk". Queued
+                commands go out by priority, and control ones skip the
+                `Browser(max_in_flight=)` limit. Bulk ones still get a turn.
 
         Returns:
             A message key (session, message id) tuple or None
 
+        Raises:
+            asyncio.TimeoutError: if the response didn't come in time.
+
         """
-        current_id = self.message_id
-        self.message_id += 1
+        json_command = self._make_command(command, params, typed_arrays=typed_arrays)
+        return await self._broker.write_json(
+            json_command,
+            timeout=timeout,
+            priority=priority,
+        )
+
+    def _make_command(
+        self,
+        command: str,
+        params: MutableMapping[str, Any] | None,
+        *,
+        typed_arrays: bool,
+        notification: bool = False,
+    ) -> protocol.BrowserCommand:
+        if notification:
+            current_id = self._notification_id
+            # chrome's ids are 32 bit
+            self._notification_id = (
+                current_id + 1 if current_id < _MAX_ID else protocol.NOTIFICATION_IDS
+            )
+        else:
+            current_id = self.message_id
+            # wraps before the notifications' ids, or its reply would be dropped
+            self.message_id = (current_id + 1) % protocol.NOTIFICATION_IDS
         json_command = protocol.BrowserCommand(
             {
                 "id": current_id,
@@ -86,21 +173,147 @@ class Session:
         if self.session_id:
             json_command["sessionId"] = self.session_id
         if params:
-            json_command["params"] = params
+            json_command["params"] = (
+                encode_typed_arrays(params) if typed_arrays else params
+            )
         _logger.debug(
             f"Cmd '{command}', param keys '{params.keys() if params else ''}', "
             f"sessionId '{self.session_id}'",
         )
         _logger.debug2(f"Full params: {str(params).replace('%', '%%')}")
-        return await self._broker.write_json(json_command)
+        return json_command
+
+    def notify(
+        self,
+        command: str,
+        params: MutableMapping[str, Any] | None = None,
+        *,
+        typed_arrays: bool = False,
+        priority: str = "interactive",
+    ) -> None:
+        """
+        Send a devtools command for its effect, without waiting for the reply.
+
+        Nothing is kept to match the reply, which is dropped when it comes,
+        errors included. Use it for frequent commands like
+        `Page.screencastFrameAck` or `Input.dispatchMouseEvent`.
+
+        Args:
+            command: devtools command to send
+            params: the parameters to send
+            typed_arrays: like `send_command()`
+            priority: like `send_command()`
+
+        """
+        self._broker.notify(
+            self._make_command(
+                command,
+                params,
+                typed_arrays=typed_arrays,
+                notification=True,
+            ),
+            priority=priority,
+        )
+
+    def _send_commands(
+        self,
+        commands: Iterable[Command],
+        *,
+        typed_arrays: bool,
+        timeout: float | None,
+        priority: str,
+    ) -> list[Awaitable[protocol.BrowserResponse]]:
+        json_commands = [
+            self._make_command(
+                *((command, None) if isinstance(command, str) else command),
+                typed_arrays=typed_arrays,
+            )
+            for command in commands
+        ]
+        return self._broker.write_jsons(
+            json_commands,
+            timeout=timeout,
+            priority=priority,
+        )
+
+    async def send_commands(
+        self,
+        commands: Iterable[Command],
+        *,
+        typed_arrays: bool = False,
+        timeout: float | None = None,
+        priority: str = "interactive",
+    ) -> list[protocol.BrowserResponse]:
+        """
+        Send several commands at once, and return their responses in order.
+
+        The commands are numbered and queued together, so they go out in one
+        write instead of one round trip each.
+
+        Args:
+            commands: a command's name, or a (name, params) tuple, for each.
+            typed_arrays: like `send_command()`, for all of them.
+            timeout: like `send_command()`, for each of them.
+            priority: like `send_command()`, for all of them.
+
+        Raises:
+            asyncio.TimeoutError: if a response didn't come in time.
+
+        """
+        return list(
+            await asyncio.gather(
+                *self._send_commands(
+                    commands,
+                    typed_arrays=typed_arrays,
+                    timeout=timeout,
+                    priority=priority,
+                ),
+            ),
+        )
+
+    async def send_commands_as_completed(
+        self,
+        commands: Iterable[Command],
+        *,
+        typed_arrays: bool = False,
+        timeout: float | None = None,
+        priority: str = "interactive",
+    ) -> AsyncIterator[protocol.BrowserResponse]:
+        """
+        Send several commands at once, and yield their responses as they come.
 
-    def subscribe(
+        Like `send_commands()`, match the responses by their "id".
+
+        Args:
+            commands: a command's name, or a (name, params) tuple, for each.
+            typed_arrays: like `send_command()`, for all of them.
+            timeout: like `send_command()`, for each of them.
+            priority: like `send_command()`, for all of them.
+
+        """
+        for response in asyncio.as_completed(
+            self._send_commands(
+                commands,
+                typed_arrays=typed_arrays,
+                timeout=timeout,
+                priority=priority,
+            ),
+        ):
+            yield await response
+
+    def subscribe(  # noqa: PLR0913 they're all options
         self,
         string: str,
-        callback: Callable[[protocol.BrowserResponse], Coroutine[Any, Any, Any]],
+        callback: Callable[[protocol.BrowserResponse], Any],
         *,
         repeating: bool = True,
-    ) -> None:
+        serial: bool = False,
+        executor: str | Executor | None = None,
+        enable: bool = False,
+        predicate: Callable[[protocol.BrowserResponse], bool] | None = None,
+        sample_every: int | None = None,
+        max_rate: float | None = None,
+    ) -> OffloadedCallback | None:
         """
         Subscribe to an event on this session.
 
@@ -108,9 +321,43 @@ class Session:
             string: the name of the event. Can use * wildcard at the end.
             callback: the callback (which takes a message dict and returns nothing)
             repeating: default True, should the callback execute more than once
+            serial: default False, run the callbacks one at a time, in the
+                order of the events, instead of concurrently
+            executor: default None, "thread", "process", or an `Executor`: the
+                callback is a plain function, run in that pool so it doesn't
+                hold up the event loop. Its exceptions are logged like an
+                `async def` callback's, and also kept, see Returns.
+            enable: default False, enable the event's domain (`Network.enable`
+                for "Network.*") while it's subscribed to, see `domains`. The
+                enable is a control priority command, an error is logged.
+            predicate: default None, a function of the event: the callback
+                only runs if it returns True. It runs as the event is read, so
+                it should be quick, and reading only `method` or `sessionId`
+                leaves the params unparsed.
+            sample_every: default None, only run the callback for one in this
+                many events (that the predicate passes).
+            max_rate: default None, run the callback at most this many times a
+                second, dropping the events in between.
+
+        Returns:
+            With an executor, the `OffloadedCallback`: its `futures` hold the
+            latest calls' results or exceptions. Otherwise None.
+
+        Raises:
+            TypeError: if the callback is `async def` with an executor, or
+                isn't without one.
+            ValueError: if already subscribed, the executor or filters aren't
+                valid, or there's no domain to enable.
 
         """
-        if not inspect.iscoroutinefunction(callback):
+        offloaded = None
+        if executor is not None:
+            if inspect.iscoroutinefunction(callback):
+                raise TypeError(
+                    "Call back must be a plain function to run in an executor.",
+                )
+            callback = offloaded = self._broker.callbacks.offload(callback, executor)
+        elif not inspect.iscoroutinefunction(callback):
             raise TypeError(
                 "Call back must be be `async def` type function.",
             )
@@ -120,9 +367,74 @@ class Session:
                 "duplicate subscriptions are not allowed.",
             )
         else:
+            domain = _domain(string) if enable else None
+            accept = (
+                EventFilter(
+                    predicate=predicate,
+                    sample_every=sample_every,
+                    max_rate=max_rate,
+                )
+                if (predicate, sample_every, max_rate) != (None, None, None)
+                else None
+            )
             # so this should be per session
             # and that means we need a list of all sessions
-            self.subscriptions[string] = (callback, repeating)
+            self.subscriptions[string] = (callback, repeating, serial, accept)
+            if domain:
+                self._hold_domain(domain, ("subscription", string))
+            return offloaded
+
+    def subscribe_batch(
+        self,
+        string: str,
+        callback: Callable[[list[protocol.BrowserResponse]], Coroutine[Any, Any, Any]],
+        *,
+        max_batch: int = 100,
+        max_delay: float | None = None,
+        enable: bool = False,
+    ) -> None:
+        """
+        Subscribe to an event on this session, to get the events in lists.
+
+        Events collect until there are `max_batch`, or until the broker is done
+        with what it read from the browser at once, or, with a `max_delay`,
+        until that many seconds after the first. The lists are delivered in
+        order, one callback at a time. It's for events that come by the
+        thousand, like `Network.dataReceived`.
+
+        Args:
+            string: the name of the event. Can use * wildcard at the end.
+            callback: the callback (which takes a list of message dicts)
+            max_batch: default 100, the most events a list can have
+            max_delay: default None, how many seconds to wait for more events
+            enable: default False, enable the event's domain while it's
+                subscribed to, like `subscribe()`
+
+        Raises:
+            TypeError: if the callback isn't `async def`.
+            ValueError: if already batch subscribed, the limits aren't valid,
+                or there's no domain to enable.
+
+        """
+        if not inspect.iscoroutinefunction(callback):
+            raise TypeError(
+                "Call back must be be `async def` type function.",
+            )
+        if string in self.batches:
+            raise ValueError(
+                "You are already batch subscribed to this string, "
+                "duplicate subscriptions are not allowed.",
+            )
+        domain = _domain(string) if enable else None
+        self.batches[string] = EventBatcher(
+            self,
+            string,
+            callback,
+            max_batch=max_batch,
+            max_delay=max_delay,
+        )
+        if domain:
+            self._hold_domain(domain, ("batch", string))
 
     def unsubscribe(self, string: str) -> None:
         """
@@ -135,6 +447,54 @@ class Session:
         if string not in self.subscriptions:
             return
         del self.subscriptions[string]
+        self._drop_domain(("subscription", string))
+
+    def unsubscribe_batch(self, string: str) -> None:
+        """
+        Remove a batch subscription, the events it has collected are delivered.
+
+        Args:
+            string: the batch subscription to remove.
+
+        """
+        if string not in self.batches:
+            return
+        self.batches.pop(string).flush()
+        self._drop_domain(("batch", string))
+
+    def _hold_domain(self, domain: str, holder: tuple[str, str]) -> None:
+        self._domain_holders[holder] = domain
+        count = self.domains.get(domain, 0)
+        self.domains[domain] = count + 1
+        if not count:
+            _logger.debug(f"Enabling {domain} on {self.session_id}")
+            task = asyncio.get_running_loop().create_task(self._enable(domain))
+            self._enabling.add(task)
+            task.add_done_callback(self._enabling.discard)
+
+    async def _enable(self, domain: str) -> None:
+        # a command, not a notification: if it fails, the events won't come
+        try:
+            response = await self.send_command(f"{domain}.enable", priority="control")
+        except Exception:
+            _logger.exception(f"Couldn't enable {domain} on '{self.session_id}'.")
+            return
+        if "error" in response:
+            _logger.error(
+                f"Couldn't enable {domain} on '{self.session_id}': {response['error']}",
+            )
+
+    def _drop_domain(self, holder: tuple[str, str]) -> None:
+        domain = self._domain_holders.pop(holder, None)
+        if domain is None:
+            return
+        count = self.domains[domain] - 1
+        if count:
+            self.domains[domain] = count
+            return
+        del self.domains[domain]
+        _logger.debug(f"Disabling {domain} on {self.session_id}")
+        self.notify(f"{domain}.disable", priority="control")  # no one's listening
 
     def subscribe_once(self, string: str) -> asyncio.Future[Any]:
         """
@@ -154,6 +514,49 @@ class Session:
         """
         return self._broker.new_subscription_future(self.session_id, string)
 
+    def events(
+        self,
+        string: str,
+        *,
+        maxsize: int = 1000,
+        overflow: str = "drop_oldest",
+    ) -> EventStream:
+        """
+        Return a stream of browser events, to `async for` over.
+
+        It's fed by the broker as events are read, and holds at most
+        `maxsize`. `async with` it, or `close()` it, to stop it.
+
+        Args:
+            string: the event to subscribe to, can use * wildcard at the end.
+            maxsize: how many events the stream holds.
+            overflow: what to do with an event when it's full: "drop_oldest"
+                (default), "block" (stop reading from the browser until there's
+                room), or "coalesce" (replace the newest with the same method).
+
+        """
+        stream = EventStream(self, string, maxsize=maxsize, overflow=overflow)
+        if string in self.streams:
+            self.streams[string].append(stream)
+        else:
+            self.streams[string] = [stream]
+        return stream
+
+    def _remove_stream(self, stream: EventStream) -> None:
+        streams = self.streams.get(stream.pattern, [])
+        if stream in streams:
+            streams.remove(stream)
+            if not streams:
+                del self.streams[stream.pattern]
+
+    def _close_streams(self) -> None:
+        for streams in list(self.streams.values()):
+            for stream in list(streams):
+                stream.close()
+        for batcher in self.batches.values():
+            batcher.cancel()
+        self.batches.clear()
+
 
 class Target:
     """A target like a browser, tab, or others. It sends commands. It has sessions."""
@@ -186,11 +589,15 @@ class Target:
         if not isinstance(session, Session):
             raise TypeError("session must be a session type class")
         self.sessions[session.session_id] = session
+        self._broker.add_route(self, session)
 
     def _remove_session(self, session_id: str) -> None:
         if isinstance(session_id, Session):
             session_id = session_id.session_id
-        _ = self.sessions.pop(session_id, None)
+        session = self.sessions.pop(session_id, None)
+        if session:
+            self._broker.remove_route(session_id)
+            session._close_streams()  # noqa: SLF001 it's done
 
     def get_session(self) -> Session:
         """Retrieve the first session of the target, if it exists."""
@@ -205,6 +612,10 @@ class Target:
         self,
         command: str,
         params: MutableMapping[str, Any] | None = None,
+        *,
+        typed_arrays: bool = False,
+        timeout: float | None = None,
+        priority: str = "interactive",
     ) -> protocol.BrowserResponse:
         """
         Send a command to the first session in a target.
@@ -214,12 +625,102 @@ class Target:
         Args:
             command: devtools command to send
             params: the parameters to send
+            typed_arrays: send numeric numpy arrays in params as base64 blobs
+            timeout: seconds to wait for the response, if None the default
+            priority: "control", "interactive" (default) or "bulk"
 
         """
         if not self.sessions.values():
             raise RuntimeError("Cannot send_command without at least one valid session")
         session = self.get_session()
-        return await session.send_command(command, params)
+        return await session.send_command(
+            command,
+            params,
+            typed_arrays=typed_arrays,
+            timeout=timeout,
+            priority=priority,
+        )
+
+    async def send_commands(
+        self,
+        commands: Iterable[Command],
+        *,
+        typed_arrays: bool = False,
+        timeout: float | None = None,
+        priority: str = "interactive",
+    ) -> list[protocol.BrowserResponse]:
+        """
+        Send several commands to the first session, return responses in order.
+
+        See `Session.send_commands()`.
+
+        Args:
+            commands: a command's name, or a (name, params) tuple, for each.
+            typed_arrays: like `send_command()`, for all of them.
+            timeout: like `send_command()`, for each of them.
+            priority: like `send_command()`, for all of them.
+
+        """
+        return await self.get_session().send_commands(
+            commands,
+            typed_arrays=typed_arrays,
+            timeout=timeout,
+            priority=priority,
+        )
+
+    def send_commands_as_completed(
+        self,
+        commands: Iterable[Command],
+        *,
+        typed_arrays: bool = False,
+        timeout: float | None = None,
+        priority: str = "interactive",
+    ) -> AsyncIterator[protocol.BrowserResponse]:
+        """
+        Send several commands to the first session, yield responses as they come.
+
+        See `Session.send_commands_as_completed()`.
+
+        Args:
+            commands: a command's name, or a (name, params) tuple, for each.
+            typed_arrays: like `send_command()`, for all of them.
+            timeout: like `send_command()`, for each of them.
+            priority: like `send_command()`, for all of them.
+
+        """
+        return self.get_session().send_commands_as_completed(
+            commands,
+            typed_arrays=typed_arrays,
+            timeout=timeout,
+            priority=priority,
+        )
+
+    def notify(
+        self,
+        command: str,
+        params: MutableMapping[str, Any] | None = None,
+        *,
+        typed_arrays: bool = False,
+        priority: str = "interactive",
+    ) -> None:
+        """
+        Send a command to the first session, without waiting for the reply.
+
+        See `Session.notify()`.
+
+        Args:
+            command: devtools command to send
+            params: the parameters to send
+            typed_arrays: like `send_command()`
+            priority: like `send_command()`
+
+        """
+        self.get_session().notify(
+            command,
+            params,
+            typed_arrays=typed_arrays,
+            priority=priority,
+        )
 
     async def create_session(self) -> Session:
         """Create a new session on this target."""
@@ -255,6 +756,7 @@ class Target:
         response = await self._broker._browser.send_command(  # noqa: SLF001 we need browser
             command="Target.detachFromTarget",
             params={"sessionId": session_id},
+            priority="control",
         )
 
         self._remove_session(session_id)
@@ -268,13 +770,19 @@ class Target:
         return response
         # kinda hate, why do we need this again?
 
-    def subscribe(
+    def subscribe(  # noqa: PLR0913 they're all options
         self,
         string: str,
-        callback: Callable[[protocol.BrowserResponse], Coroutine[Any, Any, Any]],
+        callback: Callable[[protocol.BrowserResponse], Any],
         *,
         repeating: bool = True,
-    ) -> None:
+        serial: bool = False,
+        executor: str | Executor | None = None,
+        enable: bool = False,
+        predicate: Callable[[protocol.BrowserResponse], bool] | None = None,
+        sample_every: int | None = None,
+        max_rate: float | None = None,
+    ) -> OffloadedCallback | None:
         """
         Subscribe to an event on the main session of this target.
 
@@ -282,10 +790,60 @@ class Target:
             string: the name of the event. Can use * wildcard at the end.
             callback: the callback (which takes a message dict and returns nothing)
             repeating: default True, should the callback execute more than once
+            serial: default False, run the callbacks one at a time, in order
+            executor: default None, "thread", "process", or an `Executor` to
+                run a plain function callback in, off the event loop
+            enable: default False, enable the event's domain while subscribed
+            predicate: default None, the callback only runs if it returns True
+            sample_every: default None, run the callback for one in this many
+            max_rate: default None, run the callback at most this many times a
+                second
+
+        Returns:
+            With an executor, the `OffloadedCallback` keeping its futures.
+
+        """
+        session = self.get_session()
+        return session.subscribe(
+            string,
+            callback,
+            repeating=repeating,
+            serial=serial,
+            executor=executor,
+            enable=enable,
+            predicate=predicate,
+            sample_every=sample_every,
+            max_rate=max_rate,
+        )
+
+    def subscribe_batch(
+        self,
+        string: str,
+        callback: Callable[[list[protocol.BrowserResponse]], Coroutine[Any, Any, Any]],
+        *,
+        max_batch: int = 100,
+        max_delay: float | None = None,
+        enable: bool = False,
+    ) -> None:
+        """
+        Subscribe to an event on the main session of this target, in lists.
+
+        Args:
+            string: the name of the event. Can use * wildcard at the end.
+            callback: the callback (which takes a list of message dicts)
+            max_batch: default 100, the most events a list can have
+            max_delay: default None, how many seconds to wait for more events
+            enable: default False, enable the event's domain while subscribed
 
         """
         session = self.get_session()
-        session.subscribe(string, callback, repeating=repeating)
+        session.subscribe_batch(
+            string,
+            callback,
+            max_batch=max_batch,
+            max_delay=max_delay,
+            enable=enable,
+        )
 
     def unsubscribe(self, string: str) -> None:
         """
@@ -298,6 +856,17 @@ class Target:
         session = self.get_session()
         session.unsubscribe(string)
 
+    def unsubscribe_batch(self, string: str) -> None:
+        """
+        Remove a batch subscription, the events it has collected are delivered.
+
+        Args:
+            string: the batch subscription to remove.
+
+        """
+        session = self.get_session()
+        session.unsubscribe_batch(string)
+
     def subscribe_once(self, string: str) -> asyncio.Future[Any]:
         """
         Return a future for a browser event for the first session of this target.
@@ -316,3 +885,23 @@ class Target:
         """
         session = self.get_session()
         return session.subscribe_once(string)
+
+    def events(
+        self,
+        string: str,
+        *,
+        maxsize: int = 1000,
+        overflow: str = "drop_oldest",
+    ) -> EventStream:
+        """
+        Return a stream of browser events for the first session of this target.
+
+        See `Session.events()`.
+
+        Args:
+            string: the event to subscribe to, can use * wildcard at the end.
+            maxsize: how many events the stream holds.
+            overflow: "drop_oldest" (default), "block" or "coalesce".
+
+        """
+        return self.get_session().events(string, maxsize=maxsize, overflow=overflow)
@@ -0,0 +1,67 @@
+// Rebuilds the typed-array blobs choreographer sends with `typed_arrays=True`.
+//
+// Evaluate this once in the page, then call `choreoDecodeTypedArrays(obj)`:
+// it returns `obj` with every `{dtype, bdata, shape}` blob replaced by a typed
+// array, nested plain arrays of typed-array views if it has several dimensions.
+(() => {
+  const constructors = {
+    i1: Int8Array,
+    u1: Uint8Array,
+    i2: Int16Array,
+    u2: Uint16Array,
+    i4: Int32Array,
+    u4: Uint32Array,
+    i8: BigInt64Array,
+    u8: BigUint64Array,
+    f4: Float32Array,
+    f8: Float64Array,
+  };
+
+  const fromBase64 = (text) => {
+    if (Uint8Array.fromBase64) {
+      return Uint8Array.fromBase64(text).buffer;
+    }
+    const raw = atob(text);
+    const bytes = new Uint8Array(raw.length);
+    for (let i = 0; i < raw.length; i++) {
+      bytes[i] = raw.charCodeAt(i);
+    }
+    return bytes.buffer;
+  };
+
+  const reshape = (flat, shape) => {
+    if (shape.length <= 1) {
+      return flat;
+    }
+    const step = shape.slice(1).reduce((a, b) => a * b, 1);
+    const rows = [];
+    for (let i = 0; i < shape[0]; i++) {
+      rows.push(reshape(flat.subarray(i * step, (i + 1) * step), shape.slice(1)));
+    }
+    return rows;
+  };
+
+  const isBlob = (obj) =>
+    typeof obj.bdata === "string" &&
+    Object.hasOwn(constructors, obj.dtype) &&
+    Array.isArray(obj.shape);
+
+  const decode = (obj) => {
+    if (Array.isArray(obj)) {
+      return obj.map(decode);
+    }
+    if (obj === null || typeof obj !== "object") {
+      return obj;
+    }
+    if (isBlob(obj)) {
+      return reshape(new constructors[obj.dtype](fromBase64(obj.bdata)), obj.shape);
+    }
+    const out = {};
+    for (const [key, value] of Object.entries(obj)) {
+      out[key] = decode(value);
+    }
+    return out;
+  };
+
+  globalThis.choreoDecodeTypedArrays = decode;
+})();
@@ -0,0 +1,143 @@
+"""Provides `Scheduler`, which spreads jobs over several remote browsers."""
+
+from __future__ import annotations
+
+import asyncio
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING, TypeVar
+
+import logistro
+
+from .browser_async import Browser
+from .browsers import BrowserClosedError
+from .browsers.remote import RemoteChromium
+from .channels import WebSocket
+
+if TYPE_CHECKING:
+    from types import TracebackType
+    from typing import Any, AsyncIterator, Awaitable, Callable, Sequence
+
+    from typing_extensions import Self  # 3.9 needs this, could be from typing in 3.10
+
+    from .browsers._interface_type import BrowserImplInterface
+    from .channels._interface_type import ChannelInterface
+
+_logger = logistro.getLogger(__name__)
+
+_T = TypeVar("_T")
+
+_MIN_LATENCY = 0.001
+"""Latencies below this (or not measured yet) count as this, in seconds."""
+
+
+class Scheduler:
+    """
+    Scheduler attaches a `Browser` to each endpoint and routes jobs to them.
+
+    Each job goes to the least loaded browser: the one with the fewest jobs
+    and unanswered commands, weighed by its moving average latency.
+    """
+
+    browsers: list[Browser]
+    """A browser for each endpoint, in the order they were given."""
+
+    def __init__(
+        self,
+        endpoints: Sequence[str],
+        *,
+        browser_cls: type[BrowserImplInterface] = RemoteChromium,
+        channel_cls: type[ChannelInterface] = WebSocket,
+        **kwargs: Any,
+    ) -> None:
+        """
+        Construct a scheduler, `open()` attaches to the endpoints.
+
+        Args:
+            endpoints: The http addresses of the browsers' devtools,
+                e.g. "http://render-node:9222".
+            browser_cls: The type of browser (default: `RemoteChromium`).
+            channel_cls: The type of channel to browser (default: `WebSocket`).
+            kwargs: The other arguments for each `Browser`.
+
+        Raises:
+            ValueError: if there are no endpoints.
+
+        """
+        if not endpoints:
+            raise ValueError("Scheduler needs at least one endpoint.")
+        self.browsers = [
+            Browser(
+                browser_cls=browser_cls,
+                channel_cls=channel_cls,
+                endpoint=endpoint,
+                **kwargs,
+            )
+            for endpoint in endpoints
+        ]
+        self._jobs = [0] * len(self.browsers)
+
+    async def open(self) -> None:
+        """Attach to every endpoint."""
+        _logger.info(f"Attaching to {len(self.browsers)} browsers.")
+        await asyncio.gather(*(browser.open() for browser in self.browsers))
+
+    async def close(self) -> None:
+        """Detach from every endpoint."""
+        _logger.info("Closing scheduler.")
+        await asyncio.gather(*(browser.close() for browser in self.browsers))
+
+    async def __aenter__(self) -> Self:
+        """Attach to the endpoints on entry, detach on exit."""
+        await self.open()
+        return self
+
+    async def __aexit__(
+        self,
+        type_: type[BaseException] | None,
+        value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        """Detach from the endpoints."""
+        await self.close()
+
+    def _load(self, i: int) -> float:
+        broker = self.browsers[i]._broker  # noqa: SLF001 scheduler is its friend
+        latency = max(broker.latency or 0, _MIN_LATENCY)
+        return (self._jobs[i] + broker.in_flight + 1) * latency
+
+    def _pick(self) -> int:
+        alive = [  # opened, and its channel still read: pipe or websocket
+            i
+            for i, browser in enumerate(self.browsers)
+            if not browser._broker.closed  # noqa: SLF001 scheduler is its friend
+        ]
+        if not alive:
+            raise BrowserClosedError("No endpoint is connected.")
+        return min(alive, key=self._load)
+
+    def pick(self) -> Browser:
+        """Return the least loaded browser, without reserving it."""
+        return self.browsers[self._pick()]
+
+    @asynccontextmanager
+    async def reserve(self) -> AsyncIterator[Browser]:
+        """Use the least loaded browser for a job, `async with` the job."""
+        i = self._pick()
+        _logger.debug(f"Job going to endpoint {i}")
+        self._jobs[i] += 1
+        try:
+            yield self.browsers[i]
+        finally:
+            self._jobs[i] -= 1
+
+    async def run(self, job: Callable[[Browser], Awaitable[_T]]) -> _T:
+        """
+        Run a job on the least loaded browser.
+
+        Args:
+            job: an async function taking the `Browser`, e.g. one that makes
+                a tab, renders in it, and closes it.
+
+        """
+        async with self.reserve() as browser:
+            return await job(browser)
@@ -0,0 +1,58 @@
+"""Provides the thread pool choreographer runs its few blocking calls in."""
+
+from __future__ import annotations
+
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import TYPE_CHECKING, TypeVar
+
+import logistro
+
+if TYPE_CHECKING:
+    from typing import Any, Callable
+
+_logger = logistro.getLogger(__name__)
+
+_T = TypeVar("_T")
+
+MAX_WORKERS = 16
+"""
+The pool's size. Its calls are short (starting, killing, cleaning up after a
+browser), nothing waits in it for a browser's lifetime, so it needn't grow
+with the number of browsers.
+"""
+
+_executor: ThreadPoolExecutor | None = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Return choreographer's thread pool, apart from asyncio's default one."""
+    global _executor  # noqa: PLW0603 one pool per process
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _logger.debug(f"Starting a pool of {MAX_WORKERS} threads.")
+                _executor = ThreadPoolExecutor(
+                    max_workers=MAX_WORKERS,
+                    thread_name_prefix="choreographer",
+                )
+    return _executor
+
+
+async def run_blocking(func: Callable[..., _T], *args: Any, **kwargs: Any) -> _T:
+    """
+    Run a blocking call in choreographer's pool, without blocking the loop.
+
+    Args:
+        func: the function.
+        args: its positional arguments.
+        kwargs: its keyword arguments.
+
+    """
+    return await asyncio.get_running_loop().run_in_executor(
+        get_executor(),
+        partial(func, *args, **kwargs),
+    )
@@ -0,0 +1,86 @@
+"""Provides `wait_process()`, to wait for a process to exit without a thread."""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import subprocess
+from typing import TYPE_CHECKING
+
+import logistro
+
+if TYPE_CHECKING:
+    from typing import Protocol
+
+    class _Process(Protocol):
+        def poll(self) -> int | None: ...
+
+
+_logger = logistro.getLogger(__name__)
+
+_POLL_MIN = 0.001
+"""Where there's no pidfd, we poll, first after this many seconds."""
+_POLL_MAX = 0.1
+"""And backing off to this many."""
+
+
+async def wait_process(process: _Process, timeout: float | None = None) -> bool:
+    """
+    Wait for a process to exit, watched by the event loop instead of a thread.
+
+    On linux the loop watches a pidfd, elsewhere (or for stand-ins like
+    `RemoteProcess`) the process is polled, backing off to every `_POLL_MAX`.
+
+    Args:
+        process: a `Popen`, or anything with its `poll()`.
+        timeout: seconds to wait, None waits until it exits.
+
+    Returns:
+        True if it exited, False if it's still running after the timeout.
+
+    """
+    if process.poll() is not None:
+        return True
+    try:
+        await asyncio.wait_for(_wait(process), timeout)
+    except asyncio.TimeoutError:
+        return process.poll() is not None
+    return True
+
+
+async def _wait(process: _Process) -> None:
+    if isinstance(process, subprocess.Popen) and hasattr(os, "pidfd_open"):
+        try:
+            fd = os.pidfd_open(process.pid)
+        except OSError as e:  # an old kernel, or it's gone already
+            _logger.debug2(f"No pidfd: {e!r}")
+        else:
+            if await _wait_pidfd(fd):
+                process.poll()  # reaps it, it's exited so this won't block
+                return
+    delay = _POLL_MIN
+    while process.poll() is None:
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, _POLL_MAX)
+
+
+async def _wait_pidfd(fd: int) -> bool:
+    """Wait until a pidfd is readable, returns False if the loop can't watch it."""
+    loop = asyncio.get_running_loop()
+    exited: asyncio.Future[None] = loop.create_future()
+
+    def on_exit() -> None:
+        if not exited.done():
+            exited.set_result(None)
+
+    try:
+        loop.add_reader(fd, on_exit)
+    except NotImplementedError:
+        os.close(fd)
+        return False
+    try:
+        await exited
+    finally:
+        loop.remove_reader(fd)
+        os.close(fd)
+    return True
@@ -0,0 +1,55 @@
+"""
+Compare the per-message cost of each json codec.
+
+Run with `python tests/bench_wire.py`, it isn't collected by pytest.
+"""
+
+import timeit
+
+import numpy as np
+
+import choreographer.channels._wire as wire
+
+_messages = {
+    "command": {
+        "id": 1234,
+        "method": "Runtime.evaluate",
+        "params": {"expression": "document.title", "returnByValue": True},
+        "sessionId": "AB3C5E7F9A1B3C5D7E9F1A3B5C7D9E1F",
+    },
+    "figure": {
+        "id": 1235,
+        "method": "Runtime.callFunctionOn",
+        "params": {
+            "arguments": [
+                {
+                    "value": {
+                        "x": np.arange(10_000),
+                        "y": np.random.default_rng().random(10_000),
+                    }
+                }
+            ],
+        },
+    },
+    "screenshot": {"id": 1236, "result": {"data": "iVBORw0KGgo" * 100_000}},
+}
+
+
+def main():
+    for name, message in _messages.items():
+        print(f"{name}:")
+        timings = {}
+        for codec_name in wire.available_codecs():
+            codec = wire.use_codec(codec_name)
+            number, total = timeit.Timer(
+                lambda: codec.loads(codec.dumps(message)),  # noqa: B023 used now
+            ).autorange()
+            timings[codec_name] = total / number
+        baseline = timings.get("simplejson")  # the old default
+        for codec_name, per_message in timings.items():
+            speedup = f"{baseline / per_message:5.1f}x simplejson" if baseline else ""
+            print(f"    {codec_name:>10}: {per_message * 1e6:10.1f} us {speedup}")
+
+
+if __name__ == "__main__":
+    main()
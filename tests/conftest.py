@@ -1,5 +1,8 @@
 import asyncio
+import json
 import logging
+import os
+import threading
 
 import logistro
 import pytest
@@ -7,6 +10,9 @@ import pytest_asyncio
 
 import choreographer as choreo
 from choreographer import errors
+from choreographer._brokers import Broker
+from choreographer.channels import Pipe
+from choreographer.protocol.devtools_async import Session, Target
 
 _logger = logistro.getLogger(__name__)
 
@@ -54,6 +60,80 @@ async def browser(request):
         )
 
 
+class BrokerPeer:
+    """The browser's end of a `Broker`'s pipe: reads what it writes, answers."""
+
+    def __init__(self):
+        self.pipe = Pipe()
+        self.broker = Broker(None, self.pipe)  # the browser is only needed for events
+        self._written = b""
+        self._cond = threading.Condition()
+        self._reader = threading.Thread(target=self._drain, daemon=True)
+        self._reader.start()
+
+    def _drain(self):
+        while True:
+            try:
+                data = os.read(self.pipe.from_choreo_to_external, 2**16)
+            except OSError:
+                return
+            if not data:
+                return
+            with self._cond:
+                self._written += data
+                self._cond.notify_all()
+
+    def target(self, target_id="0", session_id=""):
+        """Return a target with a session the broker routes events to."""
+        target = Target(target_id, self.broker)
+        target._add_session(Session(session_id, self.broker))  # noqa: SLF001
+        return target
+
+    @property
+    def messages(self):
+        """Everything the broker wrote so far, decoded."""
+        with self._cond:
+            written = self._written
+        return [json.loads(m) for m in written.split(b"\0")[:-1]]
+
+    def _wait(self, count, timeout):
+        with self._cond:
+            self._cond.wait_for(lambda: self._written.count(b"\0") >= count, timeout)
+
+    async def written(self, count, timeout=5):
+        """Wait until the broker wrote count messages, and return them all."""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._wait, count, timeout)
+        return self.messages
+
+    def clear(self):
+        with self._cond:
+            self._written = b""
+
+    def send(self, *messages):
+        """Write messages to the broker, as the browser would."""
+        os.write(
+            self.pipe.from_external_to_choreo,
+            b"".join(
+                (m if isinstance(m, bytes) else json.dumps(m).encode()) + b"\0"
+                for m in messages
+            ),
+        )
+
+    def close(self):
+        self.broker.clean()
+        self.pipe.close()
+        self._reader.join(5)
+
+
+# peer fixture supplies a broker on a pipe, and the browser's end of it
+@pytest_asyncio.fixture(scope="function", loop_scope="function")
+async def peer():
+    peer = BrokerPeer()
+    yield peer
+    peer.close()
+
+
 # add a timeout if tests requests browser
 # but if tests creates their own browser they are responsible
 # a fixture can be used to specify the timeout: timeout=10
@@ -0,0 +1,572 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import logistro
+import pytest
+
+from choreographer import Browser, Tab, protocol
+from choreographer._brokers import _async
+from choreographer._brokers._callbacks import CallbackScheduler
+from choreographer._brokers._limiter import Limiter
+from choreographer.channels._wire import deserialize_lazy
+from choreographer.protocol.devtools_async import Session
+
+# allows to create a browser pool for tests
+pytestmark = pytest.mark.asyncio(loop_scope="function")
+
+_logger = logistro.getLogger(__name__)
+
+
+@pytest.mark.asyncio
+async def test_broker_writes_in_order(peer):
+    _logger.info("testing...")
+    broker = peer.broker
+    big = "x" * 2**20  # bigger than a pipe's buffer, forces partial writes
+    tasks = [
+        asyncio.create_task(
+            broker.write_json(
+                {"id": i, "method": "Runtime.evaluate", "params": {"e": big}},
+            ),
+        )
+        for i in range(5)
+    ]
+    tasks += [
+        asyncio.create_task(broker.write_json({"id": i, "method": "Page.enable"}))
+        for i in range(5, 200)
+    ]
+    broker.run_read_loop()
+    messages = await peer.written(200)
+    peer.send(*({"id": i, "result": {}} for i in range(200)))
+    results = await asyncio.wait_for(asyncio.gather(*tasks), 5)
+    assert [r["id"] for r in results] == list(range(200))
+    assert [m["id"] for m in messages] == list(range(200))
+    assert messages[0]["params"]["e"] == big
+
+
+@pytest.mark.asyncio
+async def test_broker_dispatches_events(peer):
+    _logger.info("testing...")
+    session = peer.target().get_session()  # routed to by the broker
+    received = []
+
+    async def callback(event):
+        received.append(event["method"])
+
+    session.subscribe("Page.*", callback)
+    session.subscribe("Page.frameNavigated", callback, repeating=False)
+    once = session.subscribe_once("Page.load*")
+    for method in ["Page.loadEventFired", "Network.dataReceived"] + [
+        "Page.frameNavigated",
+    ] * 2:
+        peer.broker._handle_message({"method": method, "params": {}})  # noqa: SLF001
+    await asyncio.sleep(0)
+    assert (await once)["method"] == "Page.loadEventFired"
+    assert received == [
+        "Page.loadEventFired",
+        "Page.frameNavigated",
+        "Page.frameNavigated",
+        "Page.frameNavigated",
+    ]
+    assert list(session.subscriptions) == ["Page.*"]
+
+
+@pytest.mark.asyncio
+async def test_broker_routes_sessions(peer):
+    _logger.info("testing...")
+    broker = peer.broker
+    tabs = [peer.target(f"T{i}", f"S{i}") for i in range(100)]
+    route = broker._get_target_session_by_session_id("S42")  # noqa: SLF001
+    assert route[0] is tabs[42]
+    assert route[1] is tabs[42].sessions["S42"]
+
+    broker._handle_message(  # noqa: SLF001
+        {"method": "Target.detachedFromTarget", "params": {"sessionId": "S42"}},
+    )
+    assert "S42" not in tabs[42].sessions
+    assert broker._get_target_session_by_session_id("S42") is None  # noqa: SLF001
+    tabs[7]._remove_session("S7")  # noqa: SLF001
+    assert broker._get_target_session_by_session_id("S7") is None  # noqa: SLF001
+    assert broker._get_target_session_by_session_id("S8")[0] is tabs[8]  # noqa: SLF001
+
+
+@pytest.mark.asyncio
+async def test_broker_command_timeout(peer):
+    _logger.info("testing...")
+    broker = peer.broker
+    broker.run_read_loop()
+    with pytest.raises(asyncio.TimeoutError):
+        await broker.write_json({"id": 0, "method": "Page.enable"}, timeout=0.05)
+    assert not broker.futures
+
+    broker.timeout = 0.05  # the default
+    task = asyncio.create_task(broker.write_json({"id": 1, "method": "Page.enable"}))
+    await asyncio.sleep(0)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert not broker.futures
+
+    # late replies are dropped, and don't stop the read loop
+    broker.timeout = None
+    peer.send({"id": 0, "result": {}}, {"id": 1, "error": {"code": 1}})
+    task = asyncio.create_task(broker.write_json({"id": 2, "method": "Page.enable"}))
+    await peer.written(3)
+    peer.send({"id": 2, "result": {"ok": 1}})
+    assert (await asyncio.wait_for(task, 5))["result"] == {"ok": 1}
+    assert not broker._current_read_task.done()  # noqa: SLF001
+
+
+@pytest.mark.asyncio
+async def test_forgotten_late_reply(peer, monkeypatch):
+    _logger.info("testing...")
+    monkeypatch.setattr(_async, "_MAX_TOMBSTONES", 1)
+    broker = peer.broker
+    broker.run_read_loop()
+    for i in range(2):  # the second evicts the first's tombstone
+        with pytest.raises(asyncio.TimeoutError):
+            await broker.write_json({"id": i, "method": "Page.enable"}, timeout=0.01)
+    assert list(broker._tombstones) == [("", 1)]  # noqa: SLF001
+    peer.send({"id": 0, "result": {}}, {"id": 0, "error": {"code": 1}})
+    task = asyncio.create_task(broker.write_json({"id": 2, "method": "Page.enable"}))
+    await peer.written(3)
+    peer.send({"id": 2, "result": {"ok": 1}})
+    assert (await asyncio.wait_for(task, 5))["result"] == {"ok": 1}
+    assert not broker._current_read_task.done()  # noqa: SLF001
+
+
+@pytest.mark.asyncio
+async def test_limiter():
+    _logger.info("testing...")
+    limiter = Limiter(2)
+    await limiter.acquire()
+    await limiter.acquire()
+    waiting = [asyncio.create_task(limiter.acquire()) for _ in range(2)]
+    await asyncio.sleep(0)
+    assert limiter.queue_depth == 2  # noqa: PLR2004
+    waiting[0].cancel()
+    limiter.release()
+    await asyncio.sleep(0)
+    assert waiting[1].done()
+    assert limiter.in_flight == 2  # noqa: PLR2004
+    assert limiter.queue_depth == 0
+
+    adaptive = Limiter(adaptive=True)
+    start = adaptive.limit
+    for _ in range(100):
+        await adaptive.acquire()
+        adaptive.release(0.01)
+    assert adaptive.limit > start
+    grown = adaptive.limit
+    await adaptive.acquire()
+    adaptive.release(1)  # much slower than the baseline
+    assert adaptive.limit < grown
+
+
+@pytest.mark.asyncio
+async def test_timeout_shrinks_limit(peer):
+    _logger.info("testing...")
+    broker = peer.broker
+    broker.limiter = Limiter(4, adaptive=True)
+    with pytest.raises(asyncio.TimeoutError):
+        await broker.write_json({"id": 0, "method": "Page.enable"}, timeout=0.02)
+    assert broker.limiter.limit < 4  # noqa: PLR2004
+    assert broker.limiter.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_broker_limits_in_flight(peer):
+    _logger.info("testing...")
+    broker = peer.broker
+    broker.limiter = Limiter(2)
+    broker.run_read_loop()
+    tasks = [
+        asyncio.create_task(broker.write_json({"id": i, "method": "Page.enable"}))
+        for i in range(5)
+    ]
+    await peer.written(2)
+    await asyncio.sleep(0.05)  # and no more
+    assert len(peer.messages) == 2  # noqa: PLR2004
+    assert broker.limiter.queue_depth == 3  # noqa: PLR2004
+    for i in range(5):
+        await peer.written(i + 1)
+        peer.send({"id": i, "result": {}})
+    await asyncio.wait_for(asyncio.gather(*tasks), 5)
+    assert len(peer.messages) == 5  # noqa: PLR2004
+    assert broker.limiter.in_flight == 0
+    assert broker.limiter.wait_time > 0
+
+
+@pytest.mark.asyncio
+async def test_broker_control_priority(peer):
+    _logger.info("testing...")
+    broker = peer.broker
+    broker.limiter = Limiter(1)
+    tasks = [
+        asyncio.create_task(
+            broker.write_json(
+                {"id": i, "method": "Runtime.evaluate"},
+                priority="bulk",
+            ),
+        )
+        for i in range(100)
+    ]
+    await asyncio.sleep(0)  # one is admitted, the rest wait for it
+    tasks.append(
+        asyncio.create_task(
+            broker.write_json(
+                {"id": 100, "method": "Browser.close"},
+                priority="control",
+            ),
+        ),
+    )
+    try:
+        written = await peer.written(2)
+        assert written[1]["method"] == "Browser.close"  # it skipped the limit, queue
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_session_send_commands(peer):
+    _logger.info("testing...")
+    session = Session("S", peer.broker)
+
+    async def answer(ids):
+        await peer.written(len(ids))
+        peer.send(*({"id": i, "sessionId": "S", "result": {"n": i}} for i in ids))
+        peer.clear()
+
+    peer.broker.run_read_loop()
+    commands = ["Page.enable", ("Runtime.addBinding", {"name": "x"})]
+    commands += [("Emulation.setScriptExecutionDisabled", {"value": False})]
+    task = asyncio.create_task(session.send_commands(commands))
+    await answer([2, 0, 1])  # out of order
+    responses = await asyncio.wait_for(task, 5)
+    assert [r["result"]["n"] for r in responses] == [0, 1, 2]
+
+    async def collect():
+        return [r["id"] async for r in session.send_commands_as_completed(commands)]
+
+    task = asyncio.create_task(collect())
+    await answer([5, 3, 4])
+    assert await asyncio.wait_for(task, 5) == [5, 3, 4]
+
+
+@pytest.mark.asyncio
+async def test_session_notify(peer):
+    _logger.info("testing...")
+    broker = peer.broker
+    session = Session("S", broker)
+    broker.run_read_loop()
+    session.notify("Page.screencastFrameAck", {"sessionId": 1})
+    session.notify("Input.dispatchMouseEvent", {"type": "mouseMoved"})
+    assert not broker.futures
+    ids = [m["id"] for m in await peer.written(2)]
+    assert ids == [protocol.NOTIFICATION_IDS, protocol.NOTIFICATION_IDS + 1]
+    peer.send(
+        {"id": ids[0], "sessionId": "S", "result": {}},
+        {"id": ids[1], "sessionId": "S", "error": {"code": 1}},
+    )
+    # normal commands are unaffected, their ids wrap before the range
+    session.message_id = protocol.NOTIFICATION_IDS - 1
+    for n, expected in enumerate((protocol.NOTIFICATION_IDS - 1, 0)):
+        task = asyncio.create_task(session.send_command("Page.enable"))
+        await peer.written(3 + n)
+        peer.send({"id": expected, "sessionId": "S"})
+        assert (await asyncio.wait_for(task, 5))["id"] == expected
+    assert not broker._current_read_task.done()  # noqa: SLF001
+
+
+def _event(method, n):
+    return {"method": method, "params": {"n": n}}
+
+
+@pytest.mark.asyncio
+async def test_event_streams_overflow(peer):
+    _logger.info("testing...")
+    browser = peer.target()
+    oldest = browser.events("Page.*", maxsize=2)
+    coalesce = browser.events("Page.*", maxsize=2, overflow="coalesce")
+    events = [
+        _event("Page.a", 0),
+        _event("Page.b", 1),
+        _event("Network.c", 2),
+        _event("Page.a", 3),
+    ]
+    for event in events:
+        peer.broker._handle_message(event)  # noqa: SLF001
+    oldest.close()
+    assert [e["params"]["n"] async for e in oldest] == [1, 3]
+    assert oldest.dropped == 1
+    async with coalesce:
+        assert [(await coalesce.__anext__())["params"]["n"] for _ in range(2)] == [
+            3,
+            1,
+        ]
+    assert not browser.get_session().streams
+    with pytest.raises(ValueError, match="overflow"):
+        browser.events("Page.*", overflow="grow")
+
+
+@pytest.mark.asyncio
+async def test_event_stream_blocks_reading(peer):
+    _logger.info("testing...")
+    browser = peer.target()
+    stream = browser.events("Page.*", maxsize=1, overflow="block")
+    peer.broker.run_read_loop()
+    command = asyncio.create_task(browser.send_command("Page.enable"))
+    await peer.written(1)
+    peer.send(  # one read, the stream fills in the middle of it
+        {"method": "Page.a", "params": {}},
+        {"method": "Page.b", "params": {}},
+        {"id": 0, "result": {}},
+    )
+    for method in ("Page.a", "Page.b"):
+        await asyncio.sleep(0.05)
+        assert len(stream._queue) == 1  # noqa: SLF001 never past maxsize
+        assert not command.done()  # the rest of the read waits for the stream
+        assert (await stream.__anext__())["method"] == method
+    await asyncio.wait_for(command, 5)
+    peer.broker.clean()
+    assert [e async for e in stream] == []  # closed with the broker
+
+
+@pytest.mark.asyncio
+async def test_callback_scheduler_caps():
+    _logger.info("testing...")
+    scheduler = CallbackScheduler(max_concurrent=3, max_per_session=2)
+    go = asyncio.Event()
+    done = []
+
+    async def callback(event):
+        await go.wait()
+        done.append(event["n"])
+
+    for n in range(4):
+        scheduler.schedule("A", callback, {"n": n})
+    scheduler.schedule("B", callback, {"n": 4})
+    scheduler.schedule("B", callback, {"n": 5})
+    await asyncio.sleep(0)
+    assert scheduler.running == 3  # noqa: PLR2004 two of A, one of B
+    assert scheduler.waiting == 3  # noqa: PLR2004
+    go.set()
+    for _ in range(10):
+        await asyncio.sleep(0)
+    assert sorted(done) == list(range(6))
+    assert scheduler.running == scheduler.waiting == 0
+    assert not scheduler._per_session  # noqa: SLF001 nothing left behind
+
+
+@pytest.mark.asyncio
+async def test_serial_subscription(peer):
+    _logger.info("testing...")
+    broker = peer.broker
+    browser = peer.target()
+    seen = []
+    all_seen = asyncio.Event()
+
+    async def callback(event):
+        await asyncio.sleep(0.01 * (event["params"]["n"] % 3))
+        seen.append(event["params"]["n"])
+        if len(seen) == 10:  # noqa: PLR2004
+            all_seen.set()
+
+    browser.subscribe("Page.*", callback, serial=True)
+    for n in range(10):
+        broker._handle_message(_event("Page.a", n))  # noqa: SLF001
+    assert broker.callbacks.running == 1  # one task for all of them
+    await asyncio.wait_for(all_seen.wait(), 5)
+    await asyncio.sleep(0)
+    assert seen == list(range(10))
+    assert broker.callbacks.running == 0
+
+
+@pytest.mark.asyncio
+async def test_executor_subscription(peer):
+    _logger.info("testing...")
+    broker = peer.broker
+    browser = peer.target()
+    pool = ThreadPoolExecutor(1)
+    try:
+        with pytest.raises(ValueError, match="executor must be"):
+            browser.subscribe("Page.x", print, executor="fiber")
+        with pytest.raises(TypeError):
+            browser.subscribe("Page.x", asyncio.sleep, executor="thread")
+
+        async def callback(_event):
+            pass
+
+        assert browser.subscribe("Page.c", callback) is None
+
+        def work(event):
+            time.sleep(0.05)  # it would hold up the loop
+            if event["method"] == "Page.b":
+                raise RuntimeError("logged, and kept in the future")
+            return threading.get_ident()
+
+        a = browser.subscribe("Page.a", work, executor="thread")
+        b = browser.subscribe("Page.b", work, executor=pool)
+        assert a.last is None
+        start = time.perf_counter()
+        broker._handle_message(_event("Page.a", 0))  # noqa: SLF001
+        broker._handle_message(_event("Page.b", 0))  # noqa: SLF001
+        broker._handle_message(_event("Page.a", 1))  # noqa: SLF001
+        await asyncio.sleep(0)
+        assert time.perf_counter() - start < 0.05  # noqa: PLR2004
+        await asyncio.wait_for(asyncio.wait([*a.futures, *b.futures]), 5)
+        assert len(a.futures) == 2  # noqa: PLR2004
+        assert threading.get_ident() not in {f.result() for f in a.futures}
+        with pytest.raises(RuntimeError, match="kept in the future"):
+            b.last.result()
+    finally:
+        pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_batch_subscription(peer):
+    _logger.info("testing...")
+    broker = peer.broker
+    browser = peer.target()
+    batches = []
+
+    async def callback(events):
+        batches.append([e["params"]["n"] for e in events])
+
+    browser.subscribe_batch("Network.*", callback, max_batch=4)
+    browser.subscribe_batch("Tracing.data", callback, max_delay=0.05)
+    with pytest.raises(ValueError, match="already"):
+        browser.subscribe_batch("Network.*", callback)
+    for n in range(6):
+        broker._handle_message(_event("Network.data", n))  # noqa: SLF001
+        broker._handle_message(_event("Tracing.data", n + 10))  # noqa: SLF001
+    broker._flush_batches()  # noqa: SLF001 as at the end of a read
+    await asyncio.sleep(0.01)
+    assert batches == [[0, 1, 2, 3], [4, 5]]
+    await asyncio.sleep(0.1)
+    assert batches[2] == list(range(10, 16))
+    broker._handle_message(_event("Network.data", 6))  # noqa: SLF001
+    browser.unsubscribe_batch("Network.*")  # delivers what it has
+    await asyncio.sleep(0.01)
+    assert batches[3] == [6]
+    assert broker.callbacks.running == 0
+
+
+@pytest.mark.asyncio
+async def test_subscription_domains(peer, caplog):
+    _logger.info("testing...")
+    session = Session("S", peer.broker)
+    peer.broker.run_read_loop()
+
+    async def callback(_):
+        pass
+
+    with pytest.raises(ValueError, match="domain"):
+        session.subscribe("Net*", callback, enable=True)
+    assert "Net*" not in session.subscriptions
+    session.subscribe("Network.*", callback, enable=True)
+    session.subscribe("Network.dataReceived", callback, enable=True)
+    session.subscribe_batch("Network.*", callback, enable=True)
+    session.subscribe("Page.*", callback)  # not managed
+    assert session.domains == {"Network": 3}
+    [enable] = await peer.written(1)
+    assert enable["method"] == "Network.enable"
+    assert enable["id"] < protocol.NOTIFICATION_IDS  # a command, its reply is read
+    peer.send({"id": enable["id"], "sessionId": "S", "error": {"message": "no"}})
+    await asyncio.wait_for(asyncio.gather(*session._enabling), 5)  # noqa: SLF001
+    assert "Couldn't enable Network on 'S'" in caplog.text
+    session.unsubscribe("Network.*")
+    session.unsubscribe_batch("Network.*")
+    session.unsubscribe("Page.*")
+    assert session.domains == {"Network": 1}
+    session.unsubscribe("Network.dataReceived")
+    assert not session.domains
+    written = await peer.written(2)
+    assert [m["method"] for m in written] == ["Network.enable", "Network.disable"]
+    assert all(m["sessionId"] == "S" for m in written)
+
+
+@pytest.mark.asyncio
+async def test_subscription_filters(peer):
+    _logger.info("testing...")
+    broker = peer.broker
+    browser = peer.target()
+    seen = {"frames": [], "responses": [], "rated": []}
+
+    def collect(key):
+        async def callback(event):
+            seen[key].append(event["params"]["n"])
+
+        return callback
+
+    with pytest.raises(ValueError, match="sample_every"):
+        browser.subscribe("Page.x", collect("frames"), sample_every=0)
+    browser.subscribe("Page.frame", collect("frames"), sample_every=3)
+    browser.subscribe(
+        "Network.*",
+        collect("responses"),
+        predicate=lambda e: e["params"]["n"] % 2 == 0,
+        repeating=False,
+    )
+    browser.subscribe("Log.*", collect("rated"), max_rate=1)
+    events = [
+        deserialize_lazy(b'{"method":"Page.frame","params":{"n":%d}}' % n)
+        for n in range(7)
+    ]
+    for event in events:
+        broker._handle_message(event)  # noqa: SLF001
+    for n in (1, 2, 3):
+        broker._handle_message(_event("Network.response", n))  # noqa: SLF001
+        broker._handle_message(_event("Log.entry", n))  # noqa: SLF001
+    await asyncio.sleep(0.01)
+    assert seen == {"frames": [2, 5], "responses": [2], "rated": [1]}
+    # the dropped frames weren't parsed
+    assert [e.parsed for e in events] == [False, False, True] * 2 + [False]
+    assert "Network.*" not in browser.get_session().subscriptions
+
+
+@pytest.mark.asyncio
+async def test_one_shot_beside_batch(peer):
+    _logger.info("testing...")
+    broker = peer.broker
+    browser = peer.target()
+    once, batches = [], []
+
+    async def one_shot(event):
+        once.append(event["params"]["n"])
+
+    async def batch(events):
+        batches.append([e["params"]["n"] for e in events])
+
+    browser.subscribe("Page.*", one_shot, repeating=False)
+    browser.subscribe_batch("Page.*", batch)
+    broker._handle_message(_event("Page.a", 0))  # noqa: SLF001
+    broker._handle_message(_event("Page.a", 1))  # noqa: SLF001
+    broker._flush_batches()  # noqa: SLF001 as at the end of a read
+    await asyncio.sleep(0.01)
+    assert once == [0]
+    assert batches == [[0, 1]]
+    session = browser.get_session()
+    assert "Page.*" not in session.subscriptions
+    assert "Page.*" in session.batches
+
+
+@pytest.mark.asyncio
+async def test_removed_tab_closes_streams(peer):
+    _logger.info("testing...")
+    broker = peer.broker
+    tab = Tab("T", broker)
+    tab._add_session(Session("S", broker))  # noqa: SLF001
+    browser = SimpleNamespace(tabs={"T": tab}, _broker=broker)
+    stream = tab.events("Page.*")
+    Browser._remove_tab(browser, "T")  # noqa: SLF001 as close_tab() does
+    broker._handle_message(  # noqa: SLF001
+        {"method": "Target.detachedFromTarget", "params": {"sessionId": "S"}},
+    )
+    broker.clean()
+    assert stream.closed
+    assert [e async for e in stream] == []
+    assert not tab.sessions
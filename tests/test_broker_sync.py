@@ -0,0 +1,70 @@
+import os
+import platform
+import queue
+import threading
+
+import logistro
+import pytest
+
+from choreographer._brokers import BrokerSync
+from choreographer._brokers._lanes import Lanes
+from choreographer.channels import Pipe, PipeHub
+
+_logger = logistro.getLogger(__name__)
+
+
+def test_lanes_priority_and_starvation():
+    _logger.info("testing...")
+    lanes = Lanes()
+    control, interactive, bulk = (
+        Lanes.lane(p) for p in ("control", "interactive", "bulk")
+    )
+    for i in range(20):
+        lanes.append(f"i{i}", interactive)
+    for i in range(3):
+        lanes.append(f"b{i}", bulk)
+    lanes.append("c0", control)
+    order = [lanes.popleft() for _ in range(len(lanes))]
+    assert order[0] == "c0"
+    # bulk gets a turn while interactive ones still wait
+    assert order.index("b0") < order.index("i19")
+    assert [x for x in order if x[0] == "i"] == [f"i{i}" for i in range(20)]
+    assert not lanes
+    with pytest.raises(ValueError, match="priority"):
+        Lanes.lane("urgent")
+
+
+@pytest.mark.skipif(
+    platform.system() == "Windows",
+    reason="Windows can't select on pipes.",
+)
+def test_listeners_with_and_without_hub():
+    _logger.info("testing...")
+    pipes = [Pipe(), Pipe()]
+    alone = BrokerSync(None, pipes[0])
+    with PipeHub() as hub:
+        hubbed = BrokerSync(None, pipes[1], hub=hub)
+        hubbed.start()
+        got = [queue.Queue(), queue.Queue()]
+        try:
+            alone.add_listener(got[0].put)
+            alone.add_listener(lambda _: 1 / 0)  # doesn't stop the others
+            hubbed.add_listener(got[1].put)
+            threads = threading.active_count()
+            hubbed.add_listener(got[1].put)  # the hub calls both, no new thread
+            assert threading.active_count() == threads
+            for pipe in pipes:
+                os.write(pipe.from_external_to_choreo, b'{"id": 1}\0{"id": 2}\0')
+            assert [got[0].get(timeout=5) for _ in range(2)] == [
+                {"id": 1},
+                {"id": 2},
+            ]
+            assert [got[1].get(timeout=5) for _ in range(4)] == [
+                {"id": 1},
+                {"id": 1},
+                {"id": 2},
+                {"id": 2},
+            ]
+        finally:
+            for pipe in pipes:
+                pipe.close()
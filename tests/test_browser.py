@@ -1,3 +1,5 @@
+import asyncio
+
 import logistro
 import pytest
 
@@ -132,3 +134,23 @@ async def test_get_tab(browser):
     await browser.create_tab()
     await browser.create_tab("")
     assert browser.get_tab() == next(iter(browser.tabs.values()))
+
+
+async def _drain(stream):
+    async for _ in stream:
+        pass
+
+
+@pytest.mark.asyncio
+async def test_tab_streams_end(browser):
+    _logger.info("testing...")
+    tab = await browser.create_tab("")
+    stream = tab.events("Page.*")
+    await browser.close_tab(tab)
+    assert stream.closed
+    await asyncio.wait_for(_drain(stream), 5)
+    tab = await browser.create_tab("")
+    stream = tab.events("Page.*")
+    await browser.close()
+    assert stream.closed
+    await asyncio.wait_for(_drain(stream), 5)
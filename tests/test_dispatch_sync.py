@@ -0,0 +1,42 @@
+import logistro
+
+from choreographer.protocol._dispatch import SubscriptionIndex
+
+_logger = logistro.getLogger(__name__)
+
+
+def test_subscription_index_matches():
+    _logger.info("testing...")
+    index = SubscriptionIndex()
+    for pattern in ["Page.loadEventFired", "*", "Network.*", "Page.*", "Page.load*"]:
+        index[pattern] = pattern.upper()
+    assert [p for p, _ in index.matches("Page.loadEventFired")] == [
+        "Page.loadEventFired",
+        "*",
+        "Page.*",
+        "Page.load*",
+    ]
+    assert index.matches("Network.dataReceived") == [
+        ("*", "*"),
+        ("Network.*", "NETWORK.*"),
+    ]
+    assert list(index) == [
+        "Page.loadEventFired",
+        "*",
+        "Network.*",
+        "Page.*",
+        "Page.load*",
+    ]
+
+    del index["*"]
+    del index["Page.*"]
+    assert [p for p, _ in index.matches("Page.loadEventFired")] == [
+        "Page.loadEventFired",
+        "Page.load*",
+    ]
+    assert index.matches("Runtime.consoleAPICalled") == []
+    del index["Page.load*"]
+    del index["Network.*"]
+    assert not index._trie.children  # noqa: SLF001 pruned
+    assert "Page.loadEventFired" in index
+    assert len(index) == 1
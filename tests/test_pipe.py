@@ -0,0 +1,158 @@
+import asyncio
+import os
+import platform
+import threading
+
+import logistro
+import pytest
+
+from choreographer._brokers import Broker
+from choreographer.channels import ChannelClosedError, Pipe, PipeHub, _cbor
+from choreographer.channels._framing import EnvelopeFramer
+
+# allows to create a browser pool for tests
+pytestmark = pytest.mark.asyncio(loop_scope="function")
+
+_logger = logistro.getLogger(__name__)
+
+
+@pytest.mark.skipif(
+    platform.system() == "Windows",
+    reason="Windows event loops can't watch pipes.",
+)
+@pytest.mark.asyncio
+async def test_pipe_async_read_write():
+    _logger.info("testing...")
+    pipe = Pipe()
+    try:
+        await pipe.write_json_async({"id": 0, "method": "Target.getTargets"})
+        written = os.read(pipe.from_choreo_to_external, 1000)
+        assert written == b'{"id":0,"method":"Target.getTargets"}\0'
+
+        read_task = asyncio.create_task(pipe.read_jsons_async())
+        await asyncio.sleep(0)
+        os.write(pipe.from_external_to_choreo, b'{"id": 0, "res')
+        await asyncio.sleep(0.1)
+        assert not read_task.done()
+        os.write(pipe.from_external_to_choreo, b'ult": {}}\0')
+        assert await asyncio.wait_for(read_task, 1) == [{"id": 0, "result": {}}]
+
+        read_task = asyncio.create_task(pipe.read_jsons_async())
+        await asyncio.sleep(0)
+        pipe.close()
+        with pytest.raises(ChannelClosedError):
+            await asyncio.wait_for(read_task, 1)
+    finally:
+        pipe.close()
+
+
+@pytest.mark.skipif(
+    platform.system() == "Windows",
+    reason="Windows event loops can't watch pipes.",
+)
+@pytest.mark.asyncio
+async def test_pipe_close_off_loop():
+    _logger.info("testing...")
+    pipe = Pipe()
+    fd = pipe._read_from_browser  # noqa: SLF001
+    selector = asyncio.get_running_loop()._selector  # noqa: SLF001
+    read_task = asyncio.create_task(pipe.read_jsons_async())
+    await asyncio.sleep(0)
+    assert selector.get_map().get(fd)
+
+    closer = threading.Thread(target=pipe.close)
+    closer.start()
+    closer.join()  # blocking the loop, so it can't have run what close() left it
+    os.fstat(fd)  # not closed while the loop still watches it
+    with pytest.raises(ChannelClosedError):
+        await asyncio.wait_for(read_task, 1)
+    assert not selector.get_map().get(fd)
+    with pytest.raises(OSError, match="Bad file descriptor"):
+        os.fstat(fd)
+
+
+@pytest.mark.skipif(
+    platform.system() == "Windows",
+    reason="Windows can't select on pipes.",
+)
+@pytest.mark.asyncio
+async def test_hub_hands_close_to_loop():
+    _logger.info("testing...")
+    closed_in = []
+    loop = asyncio.get_running_loop()
+    closed = asyncio.Event()
+
+    class _Pipe(Pipe):
+        def close(self):
+            closed_in.append(threading.get_ident())
+            super().close()
+            loop.call_soon_threadsafe(closed.set)
+
+    pipe = _Pipe()
+    with PipeHub() as hub:
+        hub.add(pipe, print)
+        await pipe.write_json_async(
+            {"id": 0, "method": "Page.enable"}
+        )  # the loop writes
+        os.write(pipe.from_external_to_choreo, b"{bye}\n")
+        await asyncio.wait_for(closed.wait(), 5)
+        assert closed_in == [threading.get_ident()]  # the loop's, not the hub's
+        assert not len(hub)
+    with pytest.raises(ChannelClosedError):
+        await pipe.write_json_async({"id": 1, "method": "Page.enable"})
+
+
+_png = b"\x89PNG\r\n\x1a\n\0\0"
+
+
+def _cbor_peer(pipe):
+    """Stand in for chrome in cbor mode: answer every command until EOF."""
+    framer = EnvelopeFramer()
+    while framer.read_from(pipe.from_choreo_to_external, 2**16):
+        for frame in framer.frames():
+            command = _cbor.loads(frame)
+            result = {}
+            if command["method"] == "Page.captureScreenshot":
+                result = {"data": _png}
+            os.write(
+                pipe.from_external_to_choreo,
+                _cbor.dumps(
+                    {
+                        "id": command["id"],
+                        "result": result,
+                        "sessionId": command["sessionId"],
+                    },
+                ),
+            )
+
+
+@pytest.mark.skipif(
+    platform.system() == "Windows",
+    reason="Windows event loops can't watch pipes.",
+)
+@pytest.mark.asyncio
+async def test_pipe_cbor():
+    _logger.info("testing...")
+    pipe = Pipe(wire_format="cbor")
+    broker = Broker(None, pipe)  # the browser is only needed for events
+    peer = threading.Thread(target=_cbor_peer, args=(pipe,))
+    peer.start()
+    try:
+        broker.run_read_loop()
+        results = await asyncio.wait_for(
+            asyncio.gather(
+                *(
+                    broker.write_json({"id": i, "method": method, "sessionId": "AB"})
+                    for i, method in enumerate(
+                        ["Page.enable", "Page.captureScreenshot", "Page.disable"],
+                    )
+                ),
+            ),
+            5,
+        )
+        assert [r["id"] for r in results] == [0, 1, 2]
+        assert results[1]["result"]["data"] == _png
+    finally:
+        broker.clean()
+        pipe.close()
+        peer.join(5)
@@ -0,0 +1,148 @@
+import os
+import platform
+import queue
+import threading
+import time
+
+import logistro
+import pytest
+
+from choreographer.channels import ChannelClosedError, JSONError, Pipe, PipeHub, _cbor
+from choreographer.channels._framing import EnvelopeFramer, NulFramer
+
+_logger = logistro.getLogger(__name__)
+
+
+def test_framer_carries_partial_frames():
+    _logger.info("testing...")
+    framer = NulFramer(initial_size=8)
+    framer.feed(b'{"a":1}\0{"b"')
+    assert framer.frames() == [b'{"a":1}']
+    assert framer.pending() == b'{"b"'
+    framer.feed(b":2}\0\0")
+    assert framer.frames() == [b'{"b":2}']
+    assert framer.pending_size == 0
+
+
+def test_framer_grows_for_big_frames():
+    _logger.info("testing...")
+    framer = NulFramer(initial_size=8)
+    big = b"x" * 300_000
+    for i in range(0, len(big), 1000):
+        framer.feed(big[i : i + 1000])
+        assert framer.frames() == []
+    framer.feed(b"\0")
+    assert framer.frames() == [big]
+
+
+def test_pipe_read_jsons():
+    _logger.info("testing...")
+    pipe = Pipe()
+    try:
+        os.write(pipe.from_external_to_choreo, b'{"id": 1}\0{"id": 2}\0{"id"')
+        assert pipe.read_jsons(blocking=True) == [{"id": 1}, {"id": 2}]
+        os.write(pipe.from_external_to_choreo, b": 3}\0")
+        assert pipe.read_jsons(blocking=True) == [{"id": 3}]
+        os.write(pipe.from_external_to_choreo, b"{bye}\n")
+        with pytest.raises(ChannelClosedError):
+            pipe.read_jsons(blocking=True)
+    finally:
+        pipe.close()
+
+
+def test_framer_splits_envelopes():
+    _logger.info("testing...")
+    first = _cbor.dumps({"id": 1, "result": {}})
+    second = _cbor.dumps({"method": "Page.loadEventFired", "params": {"t": 1.5}})
+    framer = EnvelopeFramer(initial_size=8)
+    framer.feed(first + second[:5])
+    assert framer.frames() == [first]
+    framer.feed(second[5:])
+    assert framer.frames() == [second]
+    assert framer.pending_size == 0
+    framer.feed(b"{bye}\n")  # too short to be a header, it waits
+    assert framer.frames() == []
+    framer.feed(b"garbage")
+    with pytest.raises(ValueError, match="CBOR envelope"):
+        framer.frames()
+
+
+def test_cbor_decodes_chrome_types():
+    _logger.info("testing...")
+    # a definite map {"k": utf-16 "é", "b": tag 22 bytes, "n": -500, "f": half 1.5}
+    message = (
+        b"\xa4\x61k\x42"
+        + "é".encode("utf-16-le")
+        + b"\x61b\xd6\x42\x00\x01"
+        + b"\x61n\x39\x01\xf3"
+        + b"\x61f\xf9\x3e\x00"
+    )
+    assert _cbor.loads(message) == {"k": "é", "b": b"\x00\x01", "n": -500, "f": 1.5}
+    with pytest.raises(JSONError):
+        _cbor.loads(message[:-1])
+
+
+def test_pipe_cbor_read_jsons():
+    _logger.info("testing...")
+    pipe = Pipe(wire_format="cbor")
+    try:
+        pipe.write_json({"id": 1, "method": "Page.enable"})
+        written = os.read(pipe.from_choreo_to_external, 1000)
+        assert _cbor.loads(written) == {"id": 1, "method": "Page.enable"}
+        os.write(pipe.from_external_to_choreo, _cbor.dumps({"id": 1, "result": {}}))
+        assert pipe.read_jsons(blocking=True) == [{"id": 1, "result": {}}]
+        os.write(pipe.from_external_to_choreo, b"not an envelope")
+        with pytest.raises(ChannelClosedError):
+            pipe.read_jsons(blocking=True)
+    finally:
+        pipe.close()
+
+
+@pytest.mark.skipif(
+    platform.system() == "Windows",
+    reason="Windows can't select on pipes.",
+)
+def test_pipe_hub():
+    _logger.info("testing...")
+    threads = threading.active_count()
+    pipes = [Pipe() for _ in range(8)]
+    results = {i: queue.Queue() for i in range(8)}
+    try:
+        with PipeHub() as hub:
+            for i, pipe in enumerate(pipes):
+                hub.add(pipe, results[i].put)
+            with pytest.raises(ValueError, match="hub"):
+                hub.add(pipes[0], print)
+            with pytest.raises(RuntimeError, match="hub"):
+                pipes[0].read_jsons(blocking=False)
+            assert threading.active_count() == threads + 1  # one for all
+            for i, pipe in enumerate(pipes):
+                os.write(pipe.from_external_to_choreo, b'{"id": %d}\0{"id"' % i)
+                os.write(pipe.from_external_to_choreo, b": %d}\0" % (i + 100))
+            for i in range(8):
+                jsons = list(results[i].get(timeout=5))
+                if len(jsons) == 1:  # the second came in another read
+                    jsons += results[i].get(timeout=5)
+                assert jsons == [{"id": i}, {"id": i + 100}]
+            # a closed pipe leaves the hub
+            pipes[1].close()
+            assert len(hub) == 7  # noqa: PLR2004
+            os.write(pipes[2].from_external_to_choreo, b"{bye}\n")
+            for _ in range(500):
+                if pipes[2].shutdown_lock.locked():
+                    break
+                time.sleep(0.01)
+            assert len(hub) == 6  # noqa: PLR2004
+            # a failing callback doesn't stop the hub
+            hub.remove(pipes[4])
+            hub.add(pipes[4], lambda _: 1 / 0)
+            os.write(pipes[4].from_external_to_choreo, b'{"id": 4}\0')
+            os.write(pipes[5].from_external_to_choreo, b'{"id": 5}\0')
+            assert results[5].get(timeout=5) == [{"id": 5}]
+        # the rest read alone again
+        assert threading.active_count() == threads
+        os.write(pipes[3].from_external_to_choreo, b'{"id": 3}\0')
+        assert pipes[3].read_jsons(blocking=True) == [{"id": 3}]
+    finally:
+        for pipe in pipes:
+            pipe.close()
@@ -3,6 +3,8 @@ import os
 import platform
 import signal
 import subprocess
+import sys
+import threading
 
 import logistro
 import pytest
@@ -10,6 +12,8 @@ from async_timeout import timeout
 
 import choreographer as choreo
 from choreographer import errors
+from choreographer.browsers.remote import RemoteProcess
+from choreographer.utils._wait import wait_process
 
 # ruff: noqa: PLR0913 (lots of parameters)
 
@@ -100,3 +104,25 @@ async def test_watchdog(headless):
 
     await browser.close()
     await asyncio.sleep(0)
+
+
+@pytest.mark.asyncio(loop_scope="function")
+async def test_wait_process():
+    _logger.info("testing...")
+    threads = threading.active_count()
+    process = subprocess.Popen(  # noqa: ASYNC220 a Popen like Browser.open makes
+        [sys.executable, "-c", "import time; time.sleep(0.3)"],
+    )
+    try:
+        assert not await wait_process(process, 0.05)
+        assert process.poll() is None
+        assert threading.active_count() == threads  # the loop watches it
+        assert await wait_process(process, 5)
+        assert process.returncode == 0  # it was reaped
+    finally:
+        process.kill()
+        process.wait()
+    remote = RemoteProcess()
+    assert not await wait_process(remote, 0.05)
+    asyncio.get_running_loop().call_later(0.05, remote.terminate)
+    assert await wait_process(remote, 5)
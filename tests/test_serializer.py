@@ -1,3 +1,7 @@
+import base64
+import copy
+import json
+
 try:
     from datetime import UTC, datetime  #  type: ignore [attr-defined]
 except ImportError:
@@ -18,13 +22,22 @@ pytestmark = pytest.mark.asyncio(loop_scope="function")
 _timestamp = datetime(1970, 1, 1, tzinfo=UTC)
 
 data = [1, 2.00, 3, float("nan"), float("inf"), float("-inf"), _timestamp]
-expected_message = b'[1, 2.0, 3, null, null, null, "1970-01-01T00:00:00+00:00"]'
+expected_message = b'[1,2.0,3,null,null,null,"1970-01-01T00:00:00+00:00"]'
 converted_type = [int, float, int, type(None), type(None), type(None), str]
 
 _logger = logistro.getLogger(__name__)
 
 
+# every codec has to produce the same bytes
+@pytest.fixture(params=wire.available_codecs())
+def codec(request):
+    old = wire.get_codec()
+    yield wire.use_codec(request.param)
+    wire.use_codec(old.name)
+
+
 @pytest.mark.asyncio
+@pytest.mark.usefixtures("codec")
 async def test_de_serialize():
     _logger.info("testing...")
     message = wire.serialize(data)
@@ -39,3 +52,128 @@ async def test_de_serialize():
     assert len(obj_np) == len(converted_type)
     for o, t in zip(obj_np, converted_type):
         assert isinstance(o, t)
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("codec")
+async def test_serialize_arrays():
+    _logger.info("testing...")
+    floats = np.array([[1.5, np.nan, 3.0], [np.inf, 5.0, 6.0]])
+    dates = np.array(["1970-01-01T00:00:01", "NaT"], dtype="datetime64[s]")
+    message = wire.serialize(
+        {
+            "floats": floats,
+            "columns": floats[:, ::2],  # not contiguous
+            "ints": np.arange(3, dtype=np.int32),
+            "cube": np.array([[[np.nan, 1.0]], [[2.0, -np.inf]]], dtype="f4"),
+            "dates": dates,
+        },
+    )
+    assert message == (
+        b'{"floats":[[1.5,null,3.0],[null,5.0,6.0]],'
+        b'"columns":[[1.5,3.0],[null,6.0]],'
+        b'"ints":[0,1,2],'
+        b'"cube":[[[null,1.0]],[[2.0,null]]],'
+        b'"dates":["1970-01-01T00:00:01",null]}'
+    )
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("codec")
+async def test_serialize_arrays_any_byte_order_and_width():
+    _logger.info("testing...")
+    message = wire.serialize(
+        {
+            "big": np.array([1.0, 2.5], dtype=">f8"),
+            "big_ints": np.array([1, -2], dtype=">i4"),
+            "f4": np.array([0.1, np.nan], dtype="f4"),
+            "big_f4": np.array([0.1], dtype=">f4"),
+            "f2": np.array([0.1], dtype="f2"),
+        },
+    )
+    assert message == (
+        b'{"big":[1.0,2.5],"big_ints":[1,-2],'
+        b'"f4":[0.10000000149011612,null],"big_f4":[0.10000000149011612],'
+        b'"f2":[0.0999755859375]}'
+    )
+
+
+@pytest.mark.asyncio
+async def test_orjson_fragments():
+    _logger.info("testing...")
+    orjson = pytest.importorskip("orjson")
+    if not hasattr(orjson, "Fragment"):
+        pytest.skip("orjson is older than 3.9, it doesn't take fragments")
+    codec = wire.OrjsonCodec()
+    arrays = {"x": np.array([1.0, 2.5], dtype=">f8"), "y": np.arange(3)}
+    assert codec.dumps(arrays) == b'{"x":[1.0,2.5],"y":[0,1,2]}'
+    # orjson can't do a bigint, the stdlib can't do a fragment
+    arrays["z"] = 2**70
+    assert codec.dumps(arrays) == wire.Codec().dumps(arrays)
+
+
+@pytest.mark.asyncio
+async def test_encode_typed_arrays():
+    _logger.info("testing...")
+    floats = np.arange(6, dtype=">f8").reshape(2, 3)  # big-endian, 2-d
+    params = wire.encode_typed_arrays(
+        {"x": floats, "y": [np.arange(3, dtype=np.int32)], "t": np.array([True])},
+    )
+    assert params["x"]["dtype"] == "f8"
+    assert params["x"]["shape"] == [2, 3]
+    decoded = np.frombuffer(base64.b64decode(params["x"]["bdata"]), dtype="<f8")
+    assert decoded.tolist() == floats.ravel().tolist()
+    assert params["y"][0]["dtype"] == "i4"
+    assert params["t"].dtype == bool  # no typed array, left alone
+    assert wire.serialize(params)  # blobs are plain json
+
+
+@pytest.mark.usefixtures("codec")
+async def test_serialize_unparsed_lazy():
+    _logger.info("testing...")
+    raw = b'{"method":"Page.frame","params":{"n":[1,2.5]},"sessionId":"AB12"}'
+    # codecs reading the dict's storage get the body from `default`
+    assert wire.serialize([wire.deserialize_lazy(raw)]) == b"[" + raw + b"]"
+
+
+@pytest.mark.asyncio
+async def test_deserialize_lazy():
+    _logger.info("testing...")
+    event = wire.deserialize_lazy(
+        b'{"method":"Network.dataReceived","params":{"a":[1]},"sessionId":"AB12"}',
+    )
+    assert isinstance(event, wire.LazyMessage)
+    assert isinstance(event, dict)
+    assert event["method"] == "Network.dataReceived"
+    assert event.get("sessionId") == "AB12"
+    assert "params" in event
+    assert "id" not in event
+    assert event.get("id") is None
+    assert not event.parsed
+    assert event["params"] == {"a": [1]}
+    assert event.parsed
+    assert wire.serialize(event) == (
+        b'{"method":"Network.dataReceived","params":{"a":[1]},"sessionId":"AB12"}'
+    )
+
+    response = wire.deserialize_lazy(b'{"id":3,"error":{"code":-1}}')
+    assert isinstance(response, wire.LazyMessage)
+    assert list(response) == ["id", "error"]
+    assert dict(response) == {"id": 3, "error": {"code": -1}}
+    response = wire.deserialize_lazy(b'{"id":3,"error":{"code":-1}}')
+    assert json.dumps(response) == '{"id": 3, "error": {"code": -1}}'
+    response = wire.deserialize_lazy(b'{"id":3,"error":{"code":-1}}')
+    assert response == {"id": 3, "error": {"code": -1}}
+    assert copy.deepcopy(response) == response
+
+    # sessionId isn't last, so it can't be found without parsing
+    attached = wire.deserialize_lazy(
+        b'{"method":"Target.attachedToTarget","params":{"sessionId":"AB12"}}',
+    )
+    assert attached == {
+        "method": "Target.attachedToTarget",
+        "params": {"sessionId": "AB12"},
+    }
+    assert not isinstance(attached, wire.LazyMessage)
+    # not chrome's formatting
+    assert isinstance(wire.deserialize_lazy(b'{"id": 1, "result": {}}'), dict)
@@ -0,0 +1,272 @@
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import zlib
+
+import logistro
+import pytest
+
+from choreographer import Browser, Scheduler
+from choreographer.browsers import BrowserClosedError, RemoteChromium
+from choreographer.channels import ChannelClosedError, WebSocket
+
+# allows to create a browser pool for tests
+pytestmark = pytest.mark.asyncio(loop_scope="function")
+
+_logger = logistro.getLogger(__name__)
+
+_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+_CONTINUATION, _PONG = 0x0, 0xA
+
+
+async def _read_frame(reader):
+    first, second = await reader.readexactly(2)
+    n = second & 0x7F
+    if n == 126:  # noqa: PLR2004 websocket encoding
+        n = int.from_bytes(await reader.readexactly(2), "big")
+    elif n == 127:  # noqa: PLR2004 websocket encoding
+        n = int.from_bytes(await reader.readexactly(8), "big")
+    assert second & 0x80, "clients must mask"
+    key = await reader.readexactly(4)
+    payload = bytes(b ^ key[i % 4] for i, b in enumerate(await reader.readexactly(n)))
+    return first, payload
+
+
+def _server_frames(opcode, payload, *, rsv1=False, pieces=1):
+    frames = b""
+    size = -(-len(payload) // pieces)
+    for i in range(pieces):
+        piece = payload[i * size : (i + 1) * size]
+        first = (opcode if i == 0 else 0) | (0x40 if rsv1 and i == 0 else 0)
+        first |= 0x80 if i == pieces - 1 else 0
+        n = len(piece)
+        if n < 126:  # noqa: PLR2004 websocket encoding
+            frames += bytes((first, n))
+        elif n < 2**16:
+            frames += bytes((first, 126)) + n.to_bytes(2, "big")
+        else:
+            frames += bytes((first, 127)) + n.to_bytes(8, "big")
+        frames += piece
+    return frames
+
+
+class FakeCDP:
+    """Answers every command with its params, like chrome would with a result."""
+
+    def __init__(self, *, deflate, delay=0):
+        self.deflate = deflate
+        self.delay = delay
+        self.opcodes = []
+        self.methods = []
+
+    async def version(self, writer):
+        # chrome answers with the host it thinks it has
+        body = json.dumps(
+            {"webSocketDebuggerUrl": "ws://localhost:1/devtools/browser/abc"},
+        )
+        writer.write(
+            "HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n"
+            f"{body}".encode(),
+        )
+        await writer.drain()
+        writer.close()
+
+    async def answer(self, command):
+        self.methods.append(command["method"])
+        result = command.get("params", {})
+        if command["method"] == "Target.getTargets":
+            result = {"targetInfos": []}
+        await asyncio.sleep(self.delay)
+        return json.dumps({"id": command["id"], "result": result}).encode()
+
+    async def handle(self, reader, writer):
+        request = (await reader.readuntil(b"\r\n\r\n")).decode()
+        if request.startswith("GET /json/version "):
+            await self.version(writer)
+            return
+        headers = dict(
+            line.split(": ", 1) for line in request.split("\r\n")[1:] if ": " in line
+        )
+        accept = base64.b64encode(
+            hashlib.sha1(headers["Sec-WebSocket-Key"].encode() + _GUID).digest(),  # noqa: S324 protocol
+        ).decode()
+        response = (
+            "HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\n"
+            f"Connection: Upgrade\r\nSec-WebSocket-Accept: {accept}\r\n"
+        )
+        deflate = self.deflate and "permessage-deflate" in request
+        if deflate:
+            response += "Sec-WebSocket-Extensions: permessage-deflate\r\n"
+        writer.write((response + "\r\n").encode() + _server_frames(0x9, b"hi"))
+        inflater = zlib.decompressobj(-15)
+        deflater = zlib.compressobj(wbits=-15)
+        fragments = b""
+        try:
+            while True:
+                first, payload = await _read_frame(reader)
+                self.opcodes.append(first & 0x0F)
+                if first & 0x0F == 0x8:  # noqa: PLR2004 close
+                    return
+                if first & 0x0F == 0x1:
+                    compressed = bool(first & 0x40)
+                if first & 0x0F == _PONG:
+                    continue
+                fragments += payload
+                if not first & 0x80:
+                    continue
+                message, fragments = fragments, b""
+                if compressed:
+                    message = inflater.decompress(message + b"\0\0\xff\xff")
+                reply = await self.answer(json.loads(message))
+                if deflate:
+                    reply = deflater.compress(reply) + deflater.flush(zlib.Z_SYNC_FLUSH)
+                    reply = reply[:-4]
+                writer.write(_server_frames(0x1, reply, rsv1=deflate, pieces=3))
+                await writer.drain()
+        finally:
+            writer.close()
+
+
+@pytest.mark.parametrize("deflate", [True, False], ids=["deflate", ""])
+@pytest.mark.asyncio
+async def test_websocket_round_trip(deflate):
+    _logger.info("testing...")
+    fake = FakeCDP(deflate=deflate)
+    server = await asyncio.start_server(fake.handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    ws = WebSocket()
+    try:
+        await ws.open(f"ws://127.0.0.1:{port}/devtools/browser/abc")
+        big = os.urandom(1_500_000).hex()  # even compressed, it's several frames
+        await ws.write_jsons_async(
+            [
+                {"id": 0, "method": "Page.enable"},
+                {"id": 1, "method": "Runtime.evaluate", "params": {"e": big}},
+            ],
+        )
+        responses = []
+        while len(responses) < 2:  # noqa: PLR2004 two commands
+            responses += await asyncio.wait_for(ws.read_jsons_async(), 5)
+        assert [r["id"] for r in responses] == [0, 1]
+        assert responses[1]["result"]["e"] == big
+        assert _PONG in fake.opcodes  # the ping was answered
+        assert _CONTINUATION in fake.opcodes  # the big message was fragmented
+
+        read_task = asyncio.create_task(ws.read_jsons_async())
+        await asyncio.sleep(0)
+        ws.close()
+        with pytest.raises(ChannelClosedError):
+            await asyncio.wait_for(read_task, 1)
+    finally:
+        ws.close()
+        server.close()
+        await server.wait_closed()
+
+
+class Refuser:
+    """Refuses every handshake, and notes what it was sent."""
+
+    def __init__(self):
+        self.hosts = []
+        self.closed = asyncio.Event()
+
+    async def handle(self, reader, writer):
+        request = (await reader.readuntil(b"\r\n\r\n")).decode()
+        self.hosts += [
+            line.split(": ", 1)[1] for line in request.split("\r\n") if "Host: " in line
+        ]
+        writer.write(b"HTTP/1.1 403 Forbidden\r\nContent-Length: 0\r\n\r\n")
+        await writer.drain()
+        assert await reader.read() == b""  # nothing, not even a close frame
+        self.closed.set()
+        writer.close()
+
+
+@pytest.mark.parametrize("host", ["127.0.0.1", "::1"], ids=["ipv4", "ipv6"])
+@pytest.mark.asyncio
+async def test_websocket_refused(host):
+    _logger.info("testing...")
+    refuser = Refuser()
+    try:
+        server = await asyncio.start_server(refuser.handle, host, 0)
+    except OSError:
+        pytest.skip(f"Can't listen on {host}.")
+    port = server.sockets[0].getsockname()[1]
+    url = f"ws://{f'[{host}]' if ':' in host else host}:{port}/devtools/browser/abc"
+    loop = asyncio.get_running_loop()
+    try:
+        with pytest.raises(ChannelClosedError, match=r"refused: HTTP/1\.1 403"):
+            await WebSocket().open(url)
+        await asyncio.wait_for(refuser.closed.wait(), 5)  # the socket's closed
+        refuser.closed.clear()
+        with pytest.raises(ChannelClosedError, match=r"refused: HTTP/1\.1 403"):
+            await loop.run_in_executor(None, WebSocket().connect, url)
+        await asyncio.wait_for(refuser.closed.wait(), 5)
+        assert refuser.hosts == [url.split("/")[2]] * 2
+    finally:
+        server.close()
+        await server.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_remote_attach():
+    _logger.info("testing...")
+    fake = FakeCDP(deflate=True)
+    server = await asyncio.start_server(fake.handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    try:
+        browser = await Browser(
+            browser_cls=RemoteChromium,
+            channel_cls=WebSocket,
+            endpoint=f"http://127.0.0.1:{port}",
+        )
+        response = await browser.send_command("Page.enable", params={"a": 1})
+        assert response["result"] == {"a": 1}
+        assert browser._broker.latency is not None  # noqa: SLF001
+        await browser.close()
+        assert "Browser.close" not in fake.methods  # we only detach
+        assert await browser._is_closed()  # noqa: SLF001
+    finally:
+        server.close()
+        await server.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_scheduler_routes_to_least_loaded():
+    _logger.info("testing...")
+    fast, slow = FakeCDP(deflate=False), FakeCDP(deflate=False, delay=0.05)
+    servers = [
+        await asyncio.start_server(fake.handle, "127.0.0.1", 0) for fake in (fast, slow)
+    ]
+    endpoints = [f"127.0.0.1:{s.sockets[0].getsockname()[1]}" for s in servers]
+    try:
+        scheduler = Scheduler(endpoints)
+        with pytest.raises(BrowserClosedError):
+            scheduler.pick()  # not opened
+        async with scheduler:
+            fast_browser, _ = scheduler.browsers
+            # both answered getTargets on open, the slow one slower
+            assert scheduler.pick() is fast_browser
+            # one job on fast costs less than one on slow
+            async with scheduler.reserve() as first, scheduler.reserve() as second:
+                assert first is fast_browser
+                assert second is fast_browser
+            # concurrent commands pile up on the fast one until it's as slow
+            await asyncio.gather(
+                *(
+                    scheduler.run(lambda b: b.send_command("Page.enable"))
+                    for _ in range(10)
+                ),
+            )
+            assert fast.methods.count("Page.enable") == 10  # noqa: PLR2004
+            scheduler_load = [scheduler._load(i) for i in range(2)]  # noqa: SLF001
+            assert scheduler_load[0] < scheduler_load[1]
+        with pytest.raises(BrowserClosedError):
+            scheduler.pick()  # closed
+    finally:
+        for server in servers:
+            server.close()
+            await server.wait_closed()